@@ -0,0 +1,47 @@
+"""
+Compute embeddings for KB rows that were ingested without one.
+Safe to stop at any time: the next run continues with the rows still missing an embedding.
+
+Usage:
+    python scripts/backfill_embeddings.py [--config config/settings.yaml] [--batch-size 32]
+"""
+import sys
+import json
+import logging
+import argparse
+from pathlib import Path
+
+import yaml
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.ingestion.kb_writer import KBWriter
+from src.ingestion.embedder import EmbeddingBackfill
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--config", default="config/settings.yaml")
+    parser.add_argument("--batch-size", type=int, help="Override ingestion.embedding.batch_size")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+    if args.batch_size:
+        config["ingestion"].setdefault("embedding", {})["batch_size"] = args.batch_size
+
+    kb_writer = KBWriter(config)
+    backfill = EmbeddingBackfill(config, kb_writer)
+    try:
+        stats = backfill.run()
+    except KeyboardInterrupt:
+        stats = backfill.stats
+        logging.info("Interrupted; rerun to continue with the remaining rows")
+    finally:
+        kb_writer.close()
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == "__main__":
+    main()
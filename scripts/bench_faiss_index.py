@@ -0,0 +1,89 @@
+"""
+Recall@k and query latency of each FAISS index type against the exact FlatIP baseline.
+
+Uses the KB embeddings when --from-kb is given, otherwise synthetic clustered
+vectors (screens of the same feature sit close together, like real screenshots).
+
+Usage:
+    python scripts/bench_faiss_index.py --vectors 200000 --queries 1000 --k 10
+    python scripts/bench_faiss_index.py --from-kb --config config/settings.yaml
+"""
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import faiss
+import numpy as np
+import yaml
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.ingestion.vector_index import DEFAULT_PARAMS, INDEX_TYPES, VectorIndex, build_index, index_kind
+
+
+def synthetic_vectors(n: int, dim: int, clusters: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype("float32")
+    vectors = centers[rng.integers(0, clusters, n)] + 0.35 * rng.standard_normal((n, dim)).astype("float32")
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def measure(index: faiss.Index, queries: np.ndarray, k: int):
+    latencies = []
+    results = []
+    for query in queries:
+        started = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        results.append(ids[0])
+    return np.array(results), np.array(latencies)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--config", default="config/settings.yaml")
+    parser.add_argument("--from-kb", action="store_true", help="Benchmark the embeddings stored in the KB")
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--clusters", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--types", nargs="+", choices=INDEX_TYPES, default=list(INDEX_TYPES))
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+    params = dict(DEFAULT_PARAMS, **(config["kb"].get("faiss_params") or {}))
+
+    if args.from_kb:
+        vectors, ids = VectorIndex(config, read_only=True)._stored_vectors()
+        if not len(ids):
+            sys.exit("The KB has no embeddings yet; run scripts/backfill_embeddings.py first")
+    else:
+        vectors = synthetic_vectors(args.vectors + args.queries, args.dim, args.clusters)
+        ids = np.arange(len(vectors), dtype="int64")
+    # Hold out queries so they are not trivially their own nearest neighbour
+    queries, vectors, ids = vectors[-args.queries:], vectors[:-args.queries], ids[:-args.queries]
+    print(f"{len(ids)} vectors of dim {vectors.shape[1]}, {len(queries)} queries, k={args.k}")
+
+    baseline = build_index("FlatIP", vectors.shape[1], vectors, ids, params)
+    truth, _ = measure(baseline, queries, args.k)
+
+    print(f"{'type':<8} {'built as':<8} {'build s':>8} {'size MB':>8} {'recall@k':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    for index_type in args.types:
+        started = time.perf_counter()
+        index = build_index(index_type, vectors.shape[1], vectors, ids, params)
+        build_seconds = time.perf_counter() - started
+        found, latencies = measure(index, queries, args.k)
+        recall = np.mean([len(set(f) & set(t)) / args.k for f, t in zip(found, truth)])
+        size_mb = faiss.serialize_index(index).nbytes / 1e6
+        print(
+            f"{index_type:<8} {index_kind(index):<8} {build_seconds:8.1f} {size_mb:8.1f} {recall:9.3f} "
+            f"{np.percentile(latencies, 50):8.3f} {np.percentile(latencies, 95):8.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
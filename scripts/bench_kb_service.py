@@ -0,0 +1,106 @@
+"""
+Request latency of KBService under concurrent load, before and after pooling.
+
+"per-request" rebuilds what routes used to do: construct a new KBService
+(re-reading the FAISS index) and open a fresh SQLite connection per call.
+"shared" uses one KBService on a pooled WAL connection set, as the app
+lifespan now does. Each request reads one screenshot; every tenth request
+also updates one, so readers run next to a writer.
+
+Usage:
+    python scripts/bench_kb_service.py --rows 10000 --requests 400 --concurrency 8
+"""
+import sys
+import time
+import json
+import sqlite3
+import argparse
+import tempfile
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import yaml
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.ingestion.kb_writer import KBWriter
+from src.ingestion.kb_codec import KBCodec
+from src.backend.services.kb_service import KBService
+from src.backend.utils.db import SQLitePool
+
+
+def handle(service: KBService, request_number: int, rows: int) -> None:
+    screenshot_id = request_number % rows + 1
+    service.get_screenshot_by_id(screenshot_id)
+    if request_number % 10 == 0:
+        service.update_screenshot(screenshot_id, {"status": "generated"})
+
+
+def run(label: str, make_service, args) -> None:
+    def one(request_number: int) -> float:
+        started = time.perf_counter()
+        service = make_service()
+        handle(service, request_number, args.rows)
+        if service is not make_service.shared:
+            service.close()
+        return (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        latencies = list(executor.map(one, range(args.requests)))
+    elapsed = time.perf_counter() - started
+    print(
+        f"{label:<12} p50 {np.percentile(latencies, 50):8.2f} ms  p99 {np.percentile(latencies, 99):8.2f} ms  "
+        f"{args.requests / elapsed:8.1f} req/s"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--config", default="config/settings.yaml")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        for key, name in (("sqlite_db_path", "kb.sqlite"), ("faiss_index_path", "faiss.index"),
+                          ("metadata_json_path", "metadata.json"), ("metadata_jsonl_path", "metadata.jsonl")):
+            config["kb"][key] = str(tmp / name)
+        KBWriter(config).close()  # Creates the schema
+        dim = config["kb"].get("embedding_dim", 768)
+        vectors = np.random.default_rng(0).random((args.rows, dim), dtype="float32")
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        screens = json.dumps([{"id": "screen_home", "description": "Camera preview"}])
+        conn = sqlite3.connect(config["kb"]["sqlite_db_path"])
+        KBCodec(config).register(conn)  # The FTS/graph triggers read payloads through kb_json
+        conn.executemany(
+            "INSERT INTO screenshots (id, filename, feature_name, screens, transitions, image_path, embedding) "
+            "VALUES (?, ?, 'Camera', ?, '[]', ?, ?)",
+            ((i + 1, f"{i}.png", screens, f"{i}.png", vectors[i].tobytes()) for i in range(args.rows))
+        )
+        conn.commit()
+        conn.close()
+        KBService(config).close()  # Persist the index once so both runs start from the same file
+
+        print(f"{args.rows} rows, {args.requests} requests, concurrency {args.concurrency}")
+
+        def per_request():
+            return KBService(config, pool=SQLitePool(config["kb"]["sqlite_db_path"], size=1, on_connect=KBCodec(config).register))
+        per_request.shared = None
+        run("per-request", per_request, args)
+
+        shared_service = KBService(config)
+        shared = lambda: shared_service
+        shared.shared = shared_service
+        run("shared", shared, args)
+        shared_service.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Per-record cost of KBWriter.write() versus write_batch() on a KB that
+already holds `--rows` records.
+
+Usage:
+    python scripts/bench_kb_writer.py --rows 10000 --samples 500 --batch-size 64
+"""
+import sys
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.ingestion.kb_writer import KBWriter
+
+
+def make_record(i: int) -> dict:
+    return {
+        "filename": f"screen_{i:06d}.png",
+        "feature_name": "Camera",
+        "screens": [{"id": f"screen_{i}", "description": "Camera preview", "text_content": ["Flash", "Timer"]}],
+        "transitions": [{"from_screen": f"screen_{i}", "to_screen": "screen_flash", "action": "tap"}],
+        "image_path": f"data/input/screen_{i:06d}.png",
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000, help="Records already in the KB")
+    parser.add_argument("--samples", type=int, default=500, help="Records written per measurement")
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        writer = KBWriter({"kb": {
+            "sqlite_db_path": str(tmp / "kb.sqlite"),
+            "faiss_index_path": str(tmp / "faiss.index"),
+            "metadata_json_path": str(tmp / "metadata.json"),
+            "metadata_jsonl_path": str(tmp / "metadata.jsonl"),
+        }})
+        for start in range(0, args.rows, 1000):
+            writer.write_batch([make_record(i) for i in range(start, min(start + 1000, args.rows))])
+        next_id = args.rows
+
+        started = time.perf_counter()
+        for i in range(next_id, next_id + args.samples):
+            writer.write(make_record(i))
+        single = (time.perf_counter() - started) / args.samples
+        next_id += args.samples
+
+        started = time.perf_counter()
+        for start in range(next_id, next_id + args.samples, args.batch_size):
+            end = min(start + args.batch_size, next_id + args.samples)
+            writer.write_batch([make_record(i) for i in range(start, end)])
+        batched = (time.perf_counter() - started) / args.samples
+        writer.close()
+
+    print(f"KB size: {args.rows} rows, {args.samples} records per measurement")
+    print(f"write():       {single * 1000:8.3f} ms/record")
+    print(f"write_batch(): {batched * 1000:8.3f} ms/record (batch size {args.batch_size})")
+    print(f"speedup:       {single / batched:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Latency of KBService.search on a synthetic KB (default 100k rows).
+Measures by-ID queries end to end (FAISS search + SQLite metadata fetch),
+with and without a feature_name filter. Text/image encoding time is not included.
+
+Usage:
+    python scripts/bench_search.py --rows 100000 --queries 500 --k 10 --index-type HNSW
+"""
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import yaml
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.ingestion.kb_writer import KBWriter
+from src.ingestion.kb_codec import KBCodec
+from src.backend.services.kb_service import KBService
+from scripts.bench_faiss_index import synthetic_vectors
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--config", default="config/settings.yaml")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--batch", type=int, default=1, help="Queries per search call")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--index-type", help="Override kb.faiss_index_type")
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+    if args.index_type:
+        config["kb"]["faiss_index_type"] = args.index_type
+    features = [f"Feature {i}" for i in range(50)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        for key, name in (("sqlite_db_path", "kb.sqlite"), ("faiss_index_path", "faiss.index"),
+                          ("metadata_json_path", "metadata.json"), ("metadata_jsonl_path", "metadata.jsonl")):
+            config["kb"][key] = str(tmp / name)
+        KBWriter(config).close()  # Creates the schema
+
+        vectors = synthetic_vectors(args.rows, config["kb"].get("embedding_dim", 768), clusters=500)
+        screens = json.dumps([{"id": "screen_home", "description": "Camera preview", "text_content": ["Flash"]}])
+        conn = sqlite3.connect(config["kb"]["sqlite_db_path"])
+        KBCodec(config).register(conn)  # The FTS/graph triggers read payloads through kb_json
+        conn.executemany(
+            "INSERT INTO screenshots (id, filename, feature_name, screens, transitions, image_path, embedding) "
+            "VALUES (?, ?, ?, ?, '[]', ?, ?)",
+            ((i + 1, f"{i}.png", features[i % len(features)], screens, f"{i}.png", vectors[i].tobytes())
+             for i in range(args.rows))
+        )
+        conn.commit()
+        conn.close()
+
+        started = time.perf_counter()
+        service = KBService(config)  # Builds the index from SQLite
+        print(f"{args.rows} rows, {service.index.kind} index built in {time.perf_counter() - started:.1f}s")
+
+        rng = np.random.default_rng(1)
+        query_ids = rng.integers(1, args.rows + 1, args.queries)
+        for label, feature in (("unfiltered", None), ("feature_name", features[0])):
+            latencies = []
+            for start in range(0, len(query_ids), args.batch):
+                batch = [{"id": int(i)} for i in query_ids[start:start + args.batch]]
+                started = time.perf_counter()
+                service.search(batch, k=args.k, feature_name=feature)
+                latencies.append((time.perf_counter() - started) * 1000)
+            print(
+                f"{label:<13} batch={args.batch}: p50 {np.percentile(latencies, 50):7.2f} ms  "
+                f"p99 {np.percentile(latencies, 99):7.2f} ms per call"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Re-encode a KB's screens/transitions payloads and embeddings, and report the size before and after.
+
+Rows are rewritten in batches with the encodings given here (default: kb.storage),
+then the file is VACUUMed. Readers accept every encoding, so the KB stays usable
+throughout and a later run can switch back. Set kb.storage to the same values so
+new ingests are written the same way.
+
+Usage:
+    python scripts/compact_kb.py --payload-encoding zlib --embedding-dtype float16
+    python scripts/compact_kb.py --payload-encoding json --embedding-dtype float32   # back to plain
+"""
+import os
+import sys
+import base64
+import time
+import sqlite3
+import logging
+import argparse
+from pathlib import Path
+
+import yaml
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.ingestion.kb_codec import EMBEDDING_DTYPES, PAYLOAD_ENCODINGS, KBCodec, decode_embedding
+from src.ingestion.kb_schema import migrate, refresh_fulltext
+from src.ingestion.metadata_log import MetadataLog
+
+
+def sizes(conn: sqlite3.Connection, db_path: Path, sidecar: Path) -> dict:
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    totals = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(length(screens)), 0), COALESCE(SUM(length(transitions)), 0), "
+        "COALESCE(SUM(length(embedding)), 0) + COALESCE(SUM(length(image_embedding)), 0) FROM screenshots"
+    ).fetchone()
+    return {
+        "rows": totals[0],
+        "screens": totals[1],
+        "transitions": totals[2],
+        "embeddings": totals[3],
+        "kb file": db_path.stat().st_size + sum(
+            os.path.getsize(f"{db_path}{suffix}") for suffix in ("-wal", "-shm") if os.path.exists(f"{db_path}{suffix}")
+        ),
+        "sidecar": sidecar.stat().st_size if sidecar.exists() else 0,
+    }
+
+
+def report(before: dict, after: dict) -> None:
+    print(f"{'':<12}{'before':>14}{'after':>14}{'ratio':>8}")
+    for key in ("screens", "transitions", "embeddings", "kb file", "sidecar"):
+        ratio = f"{after[key] / before[key]:.2f}" if before[key] else "-"
+        print(f"{key:<12}{before[key]:>14,}{after[key]:>14,}{ratio:>8}")
+    print(f"{before['rows']} rows")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--config", default="config/settings.yaml")
+    parser.add_argument("--payload-encoding", choices=PAYLOAD_ENCODINGS)
+    parser.add_argument("--embedding-dtype", choices=EMBEDDING_DTYPES)
+    parser.add_argument("--sidecar-embeddings", choices=("list", "base64", "omit"))
+    parser.add_argument("--dictionary-size", type=int, default=32 * 1024, help="Bytes of shared dictionary to train")
+    parser.add_argument("--samples", type=int, default=2000, help="Payloads sampled to train the dictionary")
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--no-vacuum", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+    storage = config["kb"].setdefault("storage", {})
+    for key in ("payload_encoding", "embedding_dtype", "sidecar_embeddings"):
+        if getattr(args, key):
+            storage[key] = getattr(args, key)
+    db_path = Path(config["kb"]["sqlite_db_path"])
+    dim = config["kb"].get("embedding_dim", 768)
+
+    codec = KBCodec(config)
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    codec.register(conn)
+    migrate(conn)
+    metadata_log = MetadataLog(config)
+    before = sizes(conn, db_path, metadata_log.path)
+    started = time.perf_counter()
+
+    if codec.payload_encoding in ("zlib", "zstd"):
+        rows = conn.execute(
+            "SELECT screens, transitions FROM screenshots ORDER BY random() LIMIT ?", (args.samples,)
+        ).fetchall()
+        samples = [codec.decode_payload(value) for row in rows for value in row if value]
+        if samples:
+            conn.execute("BEGIN IMMEDIATE")
+            dictionary_id = codec.add_dictionary(
+                conn, codec.payload_encoding, codec.train_dictionary(samples, args.dictionary_size)
+            )
+            conn.execute("COMMIT")
+            logging.info(f"Trained {codec.payload_encoding} dictionary {dictionary_id} from {len(samples)} payloads")
+
+    last_id, rewritten = 0, 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, screens, transitions, embedding, image_embedding FROM screenshots "
+            "WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, args.batch)
+        ).fetchall()
+        if not rows:
+            break
+        updates = []
+        for row_id, screens, transitions, *blobs in rows:
+            embeddings = []
+            for blob in blobs:
+                vector = decode_embedding(blob, dim) if blob is not None else None
+                embeddings.append(codec.encode_embedding(vector) if vector is not None else blob)
+            updates.append((codec.encode_payload(codec.decode_payload(screens)),
+                            codec.encode_payload(codec.decode_payload(transitions)), *embeddings, row_id))
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(
+            "UPDATE screenshots SET screens = ?, transitions = ?, embedding = ?, image_embedding = ? WHERE id = ?",
+            updates
+        )
+        refresh_fulltext(conn)  # The FTS trigger marked every re-encoded row
+        conn.execute("COMMIT")
+        last_id = rows[-1][0]
+        rewritten += len(rows)
+        logging.info(f"Re-encoded {rewritten}/{before['rows']} rows")
+
+    def sidecar_record(record: dict) -> dict:
+        embedding = record.get("embedding")
+        if isinstance(embedding, str):
+            embedding = decode_embedding(base64.b64decode(embedding), dim)
+        return dict(record, embedding=codec.sidecar_embedding(embedding))
+    metadata_log.compact(sidecar_record)
+    metadata_log.close()
+
+    if not args.no_vacuum:
+        conn.execute("VACUUM")
+    after = sizes(conn, db_path, metadata_log.path)
+    conn.close()
+    print(
+        f"payloads: {codec.payload_encoding}, embeddings: {codec.embedding_dtype}, "
+        f"sidecar embeddings: {codec.sidecar_embeddings} ({time.perf_counter() - started:.1f}s)"
+    )
+    report(before, after)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""
+Rebuild (and retrain) the KB FAISS indexes (text and image) from the embeddings stored in SQLite.
+
+Usage:
+    python scripts/rebuild_faiss_index.py [--config config/settings.yaml] [--type HNSW]
+"""
+import sys
+import logging
+import argparse
+from pathlib import Path
+
+import yaml
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.ingestion.vector_index import EMBEDDING_COLUMNS, INDEX_TYPES, VectorIndex
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--config", default="config/settings.yaml")
+    parser.add_argument("--type", choices=INDEX_TYPES, help="Override kb.faiss_index_type")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+    if args.type:
+        # Keep the override, otherwise the next KBWriter start would rebuild back to the configured type
+        config["kb"]["faiss_index_type"] = args.type
+        logging.info(f"Set kb.faiss_index_type: \"{args.type}\" in {args.config} to keep this index type")
+
+    for column in EMBEDDING_COLUMNS:
+        index = VectorIndex(config, column=column)
+        index.rebuild()
+        print(f"{index.kind} index with {index.ntotal} vectors written to {index.index_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Export the KB to a Parquet snapshot directory, or load one into the configured KB.
+
+A snapshot holds one Parquet file per table, the FAISS index, the metadata
+sidecar and a manifest with row counts and checksums, all taken from one
+consistent read of the KB. Loading verifies the checksums and writes every
+table in one transaction; stop ingestion and the backend first.
+Needs pyarrow (pip install pyarrow).
+
+Usage:
+    python scripts/snapshot_kb.py export backups/kb-2024-06-01
+    python scripts/snapshot_kb.py import backups/kb-2024-06-01 [--replace]
+"""
+import sys
+import logging
+import argparse
+from pathlib import Path
+
+import yaml
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.ingestion.kb_snapshot import KBSnapshot
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("command", choices=("export", "import"))
+    parser.add_argument("bundle", help="Snapshot directory")
+    parser.add_argument("--config", default="config/settings.yaml")
+    parser.add_argument("--replace", action="store_true", help="import: overwrite a KB that already has rows")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+    snapshot = KBSnapshot(config)
+    if args.command == "export":
+        manifest = snapshot.export(args.bundle)
+        tables = ", ".join(f"{table} {entry['rows']}" for table, entry in manifest["tables"].items())
+        index = f"{manifest['index']['kind']} index" if manifest["index"] else "no index (rebuilt on import)"
+        print(f"Snapshot written to {args.bundle}: {tables}; {index}")
+    else:
+        loaded = snapshot.load(args.bundle, replace=args.replace)
+        print(f"Loaded {args.bundle} into {config['kb']['sqlite_db_path']}: "
+              + ", ".join(f"{table} {rows}" for table, rows in loaded.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,13 +2,17 @@ import sys
 import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
 
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import logging
 import yaml
 
-from src.backend.routes import ingest, generate, export, feedback
+from src.backend.routes import ingest, generate, export, feedback, search, screenshots, graph, metrics
 from src.backend.utils.logger import setup_logger
+from src.backend.utils.db import SQLitePool
+from src.backend.services.kb_service import KBService
+from src.backend.services.generation_service import GenerationService
 
 # Load config
 with open("config/settings.yaml", "r", encoding="utf-8") as f:
@@ -17,8 +21,21 @@ with open("config/settings.yaml", "r", encoding="utf-8") as f:
 # Setup logger
 setup_logger(config["logging"])
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One connection pool and one loaded FAISS index for the whole app
+    app.state.db_pool = SQLitePool.from_config(config)
+    app.state.kb_service = KBService(config, pool=app.state.db_pool)
+    # Shared so concurrent /generate requests stay within one LLM concurrency limit
+    app.state.generation_service = GenerationService(config)
+    yield
+    app.state.generation_service = None
+    app.state.kb_service = None
+    app.state.db_pool.close()
+
 # Initialize FastAPI app
 app = FastAPI(
+    lifespan=lifespan,
     title="Camera TestGen Backend",
     description="API for generating BDD test cases from UI screenshots",
     version="1.0.0",
@@ -43,6 +60,10 @@ app.include_router(ingest.router, prefix=config["backend"]["api_prefix"])
 app.include_router(generate.router, prefix=config["backend"]["api_prefix"])
 app.include_router(export.router, prefix=config["backend"]["api_prefix"])
 app.include_router(feedback.router, prefix=config["backend"]["api_prefix"])
+app.include_router(search.router, prefix=config["backend"]["api_prefix"])
+app.include_router(screenshots.router, prefix=config["backend"]["api_prefix"])
+app.include_router(graph.router, prefix=config["backend"]["api_prefix"])
+app.include_router(metrics.router)
 
 @app.get("/")
 def root():
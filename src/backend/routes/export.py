@@ -1,11 +1,10 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from typing import List, Dict
 
-from src.backend.services.kb_service import KBService
+from src.backend.services.kb_service import get_kb_service
 from src.backend.services.export_service import ExportService
 from src.backend.utils.retry import retry
 import logging
-import yaml
 
 logger = logging.getLogger(__name__)
 
@@ -13,21 +12,16 @@ router = APIRouter()
 
 @router.get("/export", summary="Export accepted test cases to .feature files")
 @retry(max_attempts=3, delay_seconds=2)
-def export_feature_files():
+def export_feature_files(request: Request):
     """
     Export all accepted test cases to .feature files
     Grouped by feature name (configurable)
     """
     try:
-        # Load config from settings.yaml
-        with open("config/settings.yaml", "r") as f:
-            config = yaml.safe_load(f)
-        
-        kb_service = KBService(config)
-        export_service = ExportService(config)
-
-        screenshots = kb_service.get_all_screenshots()
-        accepted_screenshots = [s for s in screenshots if s.get("status") == "accepted"]
+        kb_service = get_kb_service(request.app)
+        export_service = ExportService(request.app.state.config)
+
+        accepted_screenshots = kb_service.get_all_screenshots(status="accepted")
 
         if not accepted_screenshots:
             return {"message": "No accepted test cases to export"}
@@ -1,7 +1,7 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from typing import List, Dict
 
-from src.backend.services.kb_service import KBService
+from src.backend.services.kb_service import get_kb_service
 from src.backend.utils.retry import retry
 import logging
 
@@ -12,6 +12,7 @@ router = APIRouter()
 @router.post("/feedback", summary="Log user feedback for rejected test cases")
 @retry(max_attempts=3, delay_seconds=2)
 def log_feedback(
+    request: Request,
     screenshot_id: int,
     status: str,  # "accepted" or "rejected"
     rejection_reason: str = None,
@@ -21,7 +22,7 @@ def log_feedback(
     Log user feedback for a test case
     """
     try:
-        kb_service = KBService({})
+        kb_service = get_kb_service(request.app)
 
         updates = {"status": status}
         if status == "rejected":
@@ -1,8 +1,8 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from typing import List, Dict
 
-from src.backend.services.kb_service import KBService
-from src.backend.services.generation_service import GenerationService
+from src.backend.services.kb_service import get_kb_service
+from src.backend.services.generation_service import get_generation_service
 from src.backend.utils.retry import retry
 import logging
 
@@ -12,31 +12,22 @@ router = APIRouter()
 
 @router.post("/generate", summary="Generate Gherkin test cases for all screenshots")
 @retry(max_attempts=3, delay_seconds=2)
-def generate_gherkin():
+def generate_gherkin(request: Request, force: bool = False):
     """
-    Generate Gherkin test cases for all screenshots in KB
+    Generate Gherkin test cases for all screenshots in KB.
+    Screenshots whose metadata, model, prompt template and rules are unchanged since
+    their last generation are skipped; pass force=true to regenerate everything.
     """
     try:
-        from src.backend.main import app
-        kb_service = KBService(app.state.config)
-        generation_service = GenerationService(app.state.config)
+        kb_service = get_kb_service(request.app)
+        generation_service = get_generation_service(request.app)
 
-        screenshots = kb_service.get_all_screenshots()
-        results = []
+        # Streamed in keyset pages; batched write-backs between pages do not disturb the cursor.
+        # The prompt and the fingerprint both need the decoded screens/transitions.
+        screenshots = kb_service.iter_screenshots(include_layout=True)
+        run = generation_service.generate_all(kb_service, screenshots, force=force)
 
-        for screenshot in screenshots:
-            gherkin = generation_service.generate_gherkin(screenshot)
-            screenshot["gherkin"] = gherkin
-            screenshot["status"] = "generated"
-            kb_service.update_screenshot(screenshot["id"], {"gherkin": gherkin, "status": "generated"})
-            results.append({
-                "id": screenshot["id"],
-                "filename": screenshot["filename"],
-                "feature_name": screenshot["feature_name"],
-                "status": "generated"
-            })
-
-        return {"message": "Generation completed", "results": results}
+        return {"message": "Generation completed", "results": run["results"], "timing": run["timing"]}
     except Exception as e:
         logger.error(f"Generation failed: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
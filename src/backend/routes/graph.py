@@ -0,0 +1,49 @@
+from fastapi import APIRouter, HTTPException, Query, Request
+from typing import Optional
+
+from src.backend.services.kb_service import get_kb_service
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+@router.get("/graph/neighbors", summary="Screens one transition away from a screen")
+def neighbors(
+    request: Request,
+    screen_id: str,
+    direction: str = Query("out", description="'out', 'in' or 'both'"),
+    feature_name: Optional[str] = None
+):
+    try:
+        results = get_kb_service(request.app).graph.neighbors(screen_id, direction=direction, feature_name=feature_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"screen_id": screen_id, "neighbors": results}
+
+@router.get("/graph/path", summary="Shortest transition path between two screens")
+def shortest_path(
+    request: Request,
+    source: str,
+    target: str,
+    max_depth: Optional[int] = Query(None, ge=1),
+    feature_name: Optional[str] = None
+):
+    path = get_kb_service(request.app).graph.shortest_path(source, target, max_depth=max_depth, feature_name=feature_name)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"{target} is not reachable from {source}")
+    return {"source": source, "target": target, "path": path}
+
+@router.get("/graph/paths", summary="All transition paths between two screens up to a depth")
+def all_paths(
+    request: Request,
+    source: str,
+    target: str,
+    max_depth: Optional[int] = Query(None, ge=1),
+    limit: Optional[int] = Query(None, ge=1),
+    feature_name: Optional[str] = None
+):
+    paths = get_kb_service(request.app).graph.paths(
+        source, target, max_depth=max_depth, feature_name=feature_name, limit=limit
+    )
+    return {"source": source, "target": target, "paths": paths}
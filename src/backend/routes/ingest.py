@@ -23,8 +23,8 @@ def ingest_screenshots():
     try:
         logger.info(f"Config loaded: {config}")
         ingestor = ScreenshotIngestor(config)
-        ingestor.run()
-        return {"message": "Ingestion completed successfully"}
+        summary = ingestor.run()
+        return {"message": "Ingestion completed successfully", "summary": summary}
     except Exception as e:
         logger.error(f"Ingestion failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
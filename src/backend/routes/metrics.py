@@ -0,0 +1,11 @@
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+router = APIRouter()
+
+@router.get("/metrics", summary="Prometheus metrics of this worker")
+def metrics():
+    """
+    Metrics in the Prometheus text format, including the KB record cache hit rate and size.
+    """
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
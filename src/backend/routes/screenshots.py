@@ -0,0 +1,55 @@
+import json
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from typing import Optional
+
+from src.backend.services.kb_service import get_kb_service
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+def _ndjson(rows):
+    for row in rows:
+        if row.get("embedding") is not None:
+            row["embedding"] = row["embedding"].tolist()
+        yield json.dumps(row, ensure_ascii=False) + "\n"
+
+@router.get("/screenshots", summary="List KB entries as NDJSON, newest first")
+def list_screenshots(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, description="Page size; omit to stream the whole KB"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+    feature_name: Optional[str] = None,
+    status: Optional[str] = None,
+    fields: Optional[str] = Query(None, description="Comma-separated columns/list fields to return"),
+    include_layout: bool = False,
+    include_embedding: bool = False
+):
+    """
+    One JSON object per line, read from SQLite in keyset pages so memory stays flat.
+    With `limit`, returns one page and the cursor of the next in the X-Next-Cursor header.
+    """
+    kb_service = get_kb_service(request.app)
+    options = dict(
+        feature_name=feature_name,
+        status=status,
+        fields=[f.strip() for f in fields.split(",") if f.strip()] if fields else None,
+        include_layout=include_layout,
+        include_embedding=include_embedding,
+    )
+    headers = {}
+    try:
+        if limit is None:
+            rows = kb_service.iter_screenshots(cursor=cursor, **options)
+        else:
+            rows, next_cursor = kb_service.list_screenshots(limit=limit, cursor=cursor, **options)
+            if next_cursor:
+                headers["X-Next-Cursor"] = next_cursor
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Listing screenshots failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return StreamingResponse(_ndjson(rows), media_type="application/x-ndjson", headers=headers)
@@ -0,0 +1,71 @@
+import base64
+import binascii
+from fastapi import APIRouter, HTTPException, Query, Request
+from pydantic import BaseModel, Field
+from typing import List, Optional
+
+from src.backend.services.kb_service import get_kb_service
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+class SearchQuery(BaseModel):
+    id: Optional[int] = Field(None, description="Find entries similar to this screenshot")
+    text: Optional[str] = Field(None, description="Free-text query")
+    image_base64: Optional[str] = Field(None, description="Base64-encoded query image")
+
+class SearchRequest(BaseModel):
+    queries: List[SearchQuery]
+    k: Optional[int] = None
+    feature_name: Optional[str] = None
+    status: Optional[str] = None
+
+@router.post("/search", summary="Find KB entries similar to screenshots, text or images")
+def search(body: SearchRequest, request: Request):
+    """
+    Top-k similar KB entries for a batch of queries.
+    Each query gives a screenshot ID, free text or a base64-encoded image.
+    """
+    queries = []
+    for query in body.queries:
+        if query.image_base64:
+            try:
+                queries.append({"image": base64.b64decode(query.image_base64, validate=True)})
+            except (binascii.Error, ValueError):
+                raise HTTPException(status_code=400, detail="image_base64 is not valid base64")
+        else:
+            queries.append({"id": query.id, "text": query.text})
+    try:
+        results = get_kb_service(request.app).search(queries, k=body.k, feature_name=body.feature_name, status=body.status)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Search failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"results": results}
+
+@router.get("/search/text", summary="Full-text search over screen text, annotations and Gherkin")
+def text_search(
+    request: Request,
+    q: str = Query(..., description="Whitespace-separated terms, e.g. 'Timer 타이머'"),
+    limit: Optional[int] = Query(None, ge=1),
+    offset: int = Query(0, ge=0),
+    feature_name: Optional[str] = None,
+    status: Optional[str] = None,
+    match: str = Query("any", description="'any' or 'all' terms")
+):
+    """
+    Ranked KB entries whose text matches the query, with highlighted snippets.
+    """
+    try:
+        hits = get_kb_service(request.app).text_search(
+            q, limit=limit, offset=offset, feature_name=feature_name, status=status, match=match
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Text search failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"results": hits}
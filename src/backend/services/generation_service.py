@@ -1,13 +1,149 @@
+import time
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List
+
 from src.generation.generator import GherkinGenerator
-from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+# Per-screenshot stages summed into the run summary
+STAGES = ("rule_seconds", "llm_wait_seconds", "llm_seconds", "fallback_seconds")
+
+def get_generation_service(app) -> "GenerationService":
+    """
+    The app-wide GenerationService, so every request shares one LLM concurrency limit.
+    """
+    generation_service = getattr(app.state, "generation_service", None)
+    if generation_service is None:
+        generation_service = GenerationService(app.state.config)
+        app.state.generation_service = generation_service
+    return generation_service
 
 class GenerationService:
     def __init__(self, config: dict):
         self.config = config
         self.generator = GherkinGenerator(config)
+        generation_config = config["generation"]
+        self.workers = max(1, int(generation_config.get("workers", 4)))
+        self.write_batch_size = max(1, int(generation_config.get("write_batch_size", 64)))
 
     def generate_gherkin(self, metadata: Dict) -> str:
         """
         Generate Gherkin test cases from metadata
         """
-        return self.generator.generate(metadata)
\ No newline at end of file
+        return self.generator.generate(metadata)
+
+    def _generate_one(self, screenshot: Dict) -> Dict:
+        timing = {}
+        started = time.perf_counter()
+        try:
+            gherkin = self.generator.generate(screenshot, timing)
+            error = None
+        except Exception as e:
+            gherkin, error = None, str(e)
+        timing["seconds"] = round(time.perf_counter() - started, 4)
+        return {"gherkin": gherkin, "error": error, "timing": timing}
+
+    def generate_all(self, kb_service, screenshots: Iterable[Dict], force: bool = False) -> Dict:
+        """
+        Generate Gherkin for many screenshots and store it.
+        Screenshots whose stored generation_fingerprint matches their current one
+        (same metadata, model, prompt template and rules) are skipped unless `force`.
+        Generation runs on `generation.workers` threads, with LLM calls further limited to
+        `generation.llm_concurrency`. Results are written back in transactions of
+        `generation.write_batch_size` rows while later screenshots are still generating.
+        Args:
+            kb_service (KBService): KB to write results to.
+            screenshots (Iterable[Dict]): Records to generate for, e.g. KBService.iter_screenshots(include_layout=True).
+            force (bool): Regenerate every screenshot.
+        Returns:
+            Dict: Per-screenshot results of the regenerated screenshots (in input order) and
+                per-stage timing of the run.
+        """
+        started = time.perf_counter()
+        skipped = 0
+        stages = dict.fromkeys(("read_seconds", "write_seconds") + STAGES, 0.0)
+        results: List[Dict] = []
+        pending: List[Dict] = []
+        in_flight = deque()
+
+        def flush():
+            if not pending:
+                return
+            write_started = time.perf_counter()
+            kb_service.update_screenshots([
+                (result["id"], {"gherkin": result["gherkin"], "status": "generated",
+                                "generation_fingerprint": result["fingerprint"]})
+                for result in pending
+            ])
+            stages["write_seconds"] += time.perf_counter() - write_started
+            pending.clear()
+
+        def collect():
+            screenshot, fingerprint, future = in_flight.popleft()
+            outcome = future.result()
+            for stage in STAGES:
+                stages[stage] += outcome["timing"].get(stage, 0.0)
+            result = {
+                "id": screenshot["id"],
+                "filename": screenshot["filename"],
+                "feature_name": screenshot["feature_name"],
+                "status": "generated" if outcome["error"] is None else "failed",
+                "source": outcome["timing"].get("source"),
+                "seconds": outcome["timing"]["seconds"],
+            }
+            if outcome["error"] is not None:
+                logger.error(f"Generation failed for {screenshot['filename']}: {outcome['error']}")
+                result["error"] = outcome["error"]
+            else:
+                # A degraded result (LLM tried and failed) keeps no fingerprint, so the next run retries it
+                degraded = outcome["timing"].get("source") is None or outcome["timing"].get("llm_failed")
+                pending.append({"id": screenshot["id"], "gherkin": outcome["gherkin"],
+                                "fingerprint": None if degraded else fingerprint})
+            results.append(result)
+            if len(pending) >= self.write_batch_size:
+                flush()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            iterator = iter(screenshots)
+            while True:
+                read_started = time.perf_counter()
+                screenshot = next(iterator, None)
+                stages["read_seconds"] += time.perf_counter() - read_started
+                if screenshot is None:
+                    break
+                fingerprint = self.generator.fingerprint(screenshot)
+                if not force and screenshot.get("generation_fingerprint") == fingerprint:
+                    skipped += 1
+                    continue
+                in_flight.append((screenshot, fingerprint, executor.submit(self._generate_one, screenshot)))
+                # Bounded window: at most two screenshots per worker are held in memory
+                if len(in_flight) >= 2 * self.workers:
+                    collect()
+            while in_flight:
+                collect()
+            flush()
+
+        elapsed = time.perf_counter() - started
+        generated = sum(1 for result in results if result["status"] == "generated")
+        logger.info(
+            f"Generated Gherkin for {generated}/{len(results)} screenshots ({skipped} unchanged) in {elapsed:.2f}s "
+            f"(workers={self.workers}, llm_concurrency={self.generator.llm_concurrency})"
+        )
+        return {
+            "results": results,
+            "timing": {
+                "screenshots": len(results),
+                "generated": generated,
+                "failed": len(results) - generated,
+                "skipped_unchanged": skipped,
+                "workers": self.workers,
+                "llm_concurrency": self.generator.llm_concurrency,
+                "elapsed_seconds": round(elapsed, 3),
+                "screenshots_per_second": round(len(results) / elapsed, 2) if elapsed > 0 else None,
+                # read/write are wall time on the request thread; the other stages are summed over workers
+                "stages": {stage: round(seconds, 3) for stage, seconds in stages.items()},
+            },
+        }
@@ -1,86 +1,537 @@
-import sqlite3
+import io
+import re
+import base64
 import faiss
 import numpy as np
 import json
 from pathlib import Path
-from typing import List, Dict
+from typing import Iterator, List, Dict, Optional, Sequence, Tuple
+
+from src.ingestion.vector_index import VectorIndex
+from src.ingestion.kb_schema import (
+    CHILD_TABLES, FTS_COLUMNS, SCREENSHOT_COLUMNS, UPDATABLE_COLUMNS, data_version, migrate, read_children,
+    refresh_fulltext
+)
+from src.ingestion.kb_codec import KBCodec, decode_embedding, decode_embeddings
+from src.backend.utils.db import SQLitePool
+from src.backend.utils.record_cache import RecordCache
+from src.backend.services.screen_graph import ScreenGraph
+
+SEARCH_COLUMNS = ("id", "filename", "feature_name", "image_path", "version", "status", "screens", "transitions")
+
+def encode_cursor(created_at: str, screenshot_id: int) -> str:
+    """Opaque listing cursor for the (created_at, id) keyset."""
+    return base64.urlsafe_b64encode(json.dumps([created_at, screenshot_id]).encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    try:
+        created_at, screenshot_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(created_at), int(screenshot_id)
+    except (ValueError, TypeError):
+        raise ValueError("Malformed cursor")
+
+def _highlight(texts: List[str], terms: List[str], mark_open: str, mark_close: str, width: int = 40) -> str:
+    """Window around the first term found in texts, with every term occurrence marked."""
+    pattern = re.compile("|".join(re.escape(term) for term in terms), re.IGNORECASE)
+    for text in texts:
+        found = pattern.search(text)
+        if found:
+            start, end = max(0, found.start() - width), min(len(text), found.end() + width)
+            window = pattern.sub(lambda m: f"{mark_open}{m.group(0)}{mark_close}", text[start:end])
+            return ("…" if start else "") + window + ("…" if end < len(text) else "")
+    return ""
+
+def get_kb_service(app) -> "KBService":
+    """
+    The app-wide KBService created in the lifespan, or created on first use
+    when the app runs without one (e.g. a TestClient outside a `with` block).
+    """
+    kb_service = getattr(app.state, "kb_service", None)
+    if kb_service is None:
+        kb_service = KBService(app.state.config)
+        app.state.kb_service = kb_service
+    return kb_service
 
 class KBService:
-    def __init__(self, config: dict):
+    def __init__(self, config: dict, pool: Optional[SQLitePool] = None):
         self.config = config
         self.sqlite_db_path = Path(config["kb"]["sqlite_db_path"])
+        # Decodes whichever payload/embedding encodings the rows were written with
+        self.codec = KBCodec(config)
+        # Shared WAL connection pool; pass the app's pool to reuse it across services
+        self.pool = pool or SQLitePool.from_config(config)
         self.faiss_index_path = Path(config["kb"]["faiss_index_path"])
+        search_config = config["kb"].get("search", {})
+        self.default_k = search_config.get("default_k", 10)
+        self.max_k = search_config.get("max_k", 100)
+        self.overfetch = max(1, search_config.get("overfetch", 4))
+        self.exact_filter_max = search_config.get("exact_filter_max", 2000)
+        fulltext_config = config["kb"].get("fulltext", {})
+        self.fulltext_default_limit = fulltext_config.get("default_limit", 20)
+        self.fulltext_max_limit = fulltext_config.get("max_limit", 100)
+        self.fulltext_snippet_tokens = fulltext_config.get("snippet_tokens", 24)
+        self.fulltext_highlight = tuple(fulltext_config.get("highlight", ["<mark>", "</mark>"]))
+        self.fulltext_weights = fulltext_config.get("weights", {})
+        listing_config = config["kb"].get("listing", {})
+        self.page_size = listing_config.get("page_size", 500)
+        self.max_page_size = listing_config.get("max_page_size", 1000)
+        self._embedder = None
+        # Decoded records by ID, invalidated through the KB's data_version counter
+        self.cache = RecordCache.from_config(config)
+        with self.pool.connection() as conn:
+            migrate(conn)
+        # Neighbor and path queries over the screen_nodes/screen_edges tables
+        self.graph = ScreenGraph(config, self.pool)
         self._init_faiss()
 
     def _init_faiss(self):
-        self.index = faiss.read_index(str(self.faiss_index_path)) if self.faiss_index_path.exists() else None
+        # Vector IDs are screenshots.id, see src/ingestion/vector_index.py; KBWriter owns the index files
+        self.index = VectorIndex(self.config, read_only=True)
+        # Image queries search the separate image vectors; text and ID queries the text vectors
+        self.image_index = VectorIndex(self.config, column="image_embedding", read_only=True)
+
+    @property
+    def embedder(self):
+        # Query encoders are only loaded for text/image queries
+        if self._embedder is None:
+            from src.ingestion.embedder import Embedder
+            self._embedder = Embedder(self.config)
+        return self._embedder
+
+    def search(self, queries: List[Dict], k: Optional[int] = None, feature_name: Optional[str] = None,
+               status: Optional[str] = None) -> List[List[Dict]]:
+        """
+        Top-k similar KB entries for a batch of queries, in one FAISS search per vector space:
+        ID and text queries search the text embeddings, image queries the image embeddings.
+        Args:
+            queries (List[Dict]): Each has one of "id" (screenshot ID), "text" or "image" (raw image bytes).
+            k (int): Results per query.
+            feature_name (str): Only return entries of this feature.
+            status (str): Only return entries with this status.
+        Returns:
+            List[List[Dict]]: Per query, hits with "score" and the entry's metadata, best first.
+        Raises:
+            ValueError: If a query is malformed or refers to an entry without an embedding.
+        """
+        k = min(k or self.default_k, self.max_k)
+        if not queries:
+            return []
+        vectors, exclude = self._query_vectors(queries)
+        results = [None] * len(queries)
+        for index in (self.index, self.image_index):
+            # Image queries live in the image encoder's space, everything else in the text encoder's
+            positions = [i for i, query in enumerate(queries) if (index is self.image_index) == self._is_image(query)]
+            if positions:
+                hits = self._search_index(index, vectors[positions], [exclude[i] for i in positions], k,
+                                          feature_name, status)
+                for position, position_hits in zip(positions, hits):
+                    results[position] = position_hits
+        return results
+
+    @staticmethod
+    def _is_image(query: Dict) -> bool:
+        return query.get("id") is None and not query.get("text") and bool(query.get("image"))
+
+    def _search_index(self, index: VectorIndex, vectors: np.ndarray, exclude: List[Optional[int]], k: int,
+                      feature_name: Optional[str], status: Optional[str]) -> List[List[Dict]]:
+        index.refresh()
+        if not index.ntotal:
+            return [[] for _ in vectors]
+        filtered = feature_name is not None or status is not None
+
+        if filtered:
+            # Selective filters: score the few matching rows exactly; broader ones over-fetch from the index
+            subset = self._filtered_embeddings(feature_name, status, index)
+            if subset is not None:
+                subset_ids, matrix = subset
+                if not len(subset_ids):
+                    return [[] for _ in vectors]
+                all_scores = vectors @ matrix.T
+                fetch = min(k + 1, len(subset_ids))
+                top = np.argpartition(-all_scores, fetch - 1, axis=1)[:, :fetch]
+                scores = np.take_along_axis(all_scores, top, axis=1)
+                order = np.argsort(-scores, axis=1)
+                scores = np.take_along_axis(scores, order, axis=1)
+                ids = subset_ids[np.take_along_axis(top, order, axis=1)]
+                rows = self._fetch_rows({int(i) for i in ids.flatten()}, None, None)
+                return self._collect(scores, ids, exclude, rows, k)
+
+        # Over-fetch so filtered-out entries and the query's own entry do not leave holes
+        fetch = k + 1 if not filtered else k * self.overfetch
+        while True:
+            fetch = min(fetch, index.ntotal)
+            scores, ids = index.search(vectors, fetch)
+            rows = self._fetch_rows({int(i) for i in ids.flatten() if i != -1}, feature_name, status)
+            results = self._collect(scores, ids, exclude, rows, k)
+            if all(len(hits) == k for hits in results) or fetch >= index.ntotal:
+                return results
+            fetch *= 2
+
+    @staticmethod
+    def _collect(scores, ids, exclude, rows: Dict[int, Dict], k: int) -> List[List[Dict]]:
+        results = []
+        for query_scores, query_ids, own_id in zip(scores, ids, exclude):
+            hits = []
+            for score, row_id in zip(query_scores, query_ids):
+                row_id = int(row_id)
+                if row_id == -1 or row_id == own_id or row_id not in rows:
+                    continue
+                hits.append(dict(rows[row_id], score=round(float(score), 4)))
+                if len(hits) == k:
+                    break
+            results.append(hits)
+        return results
+
+    @staticmethod
+    def _filter_clause(feature_name: Optional[str], status: Optional[str]):
+        clauses, params = [], []
+        if feature_name is not None:
+            clauses.append("feature_name = ?")
+            params.append(feature_name)
+        if status is not None:
+            clauses.append("status = ?")
+            params.append(status)
+        return clauses, params
+
+    def _filtered_embeddings(self, feature_name: Optional[str], status: Optional[str], index: VectorIndex):
+        clause = self._filter_clause(feature_name, status)
+        with self.pool.connection() as conn:
+            where = " AND ".join(clause[0] + [f"{index.column} IS NOT NULL"])
+            count = conn.execute(f"SELECT COUNT(*) FROM screenshots WHERE {where}", clause[1]).fetchone()[0]
+            if count > self.exact_filter_max:
+                return None
+            rows = conn.execute(f"SELECT id, {index.column} FROM screenshots WHERE {where}", clause[1]).fetchall()
+        positions, matrix = decode_embeddings((blob for _, blob in rows), index.dim)
+        ids = np.array([row_id for row_id, _ in rows], dtype="int64")[positions]
+        return ids, matrix
+
+    def _query_vectors(self, queries: List[Dict]):
+        vectors = [None] * len(queries)
+        exclude = [None] * len(queries)
+        by_id, texts, images = {}, {}, {}
+        for position, query in enumerate(queries):
+            if query.get("id") is not None:
+                by_id[position] = int(query["id"])
+                exclude[position] = int(query["id"])
+            elif query.get("text"):
+                texts[position] = query["text"]
+            elif query.get("image"):
+                images[position] = query["image"]
+            else:
+                raise ValueError(f"Query {position} needs an 'id', 'text' or 'image'")
+
+        if by_id:
+            stored = self._stored_embeddings(set(by_id.values()))
+            for position, screenshot_id in by_id.items():
+                if screenshot_id not in stored:
+                    raise ValueError(f"Screenshot {screenshot_id} does not exist or has no embedding")
+                vectors[position] = stored[screenshot_id]
+        if texts:
+            for position, vector in zip(texts, self.embedder.encode_texts(list(texts.values()))):
+                vectors[position] = vector
+        if images:
+            encoded = self.embedder.encode_images([io.BytesIO(image) for image in images.values()])
+            for position, vector in zip(images, encoded):
+                vectors[position] = vector
+        vectors = np.vstack(vectors).astype("float32")
+        faiss.normalize_L2(vectors)
+        return vectors, exclude
+
+    def _stored_embeddings(self, ids) -> Dict[int, np.ndarray]:
+        placeholders = ",".join("?" * len(ids))
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                f"SELECT id, embedding FROM screenshots WHERE id IN ({placeholders}) AND embedding IS NOT NULL",
+                list(ids)
+            ).fetchall()
+        vectors = {row_id: decode_embedding(blob, self.index.dim) for row_id, blob in rows}
+        return {row_id: vector for row_id, vector in vectors.items() if vector is not None}
+
+    def _fetch_rows(self, ids, feature_name: Optional[str], status: Optional[str]) -> Dict[int, Dict]:
+        if not ids:
+            return {}
+        clause = self._filter_clause(feature_name, status)
+        columns = list(SEARCH_COLUMNS)
+        where = " AND ".join([f"id IN ({','.join('?' * len(ids))})"] + clause[0])
+        with self.pool.connection() as conn:
+            cursor = conn.execute(f"SELECT {', '.join(columns)} FROM screenshots WHERE {where}", list(ids) + clause[1])
+            rows = {}
+            for row in cursor.fetchall():
+                metadata = dict(zip(columns, row))
+                for key in ("screens", "transitions"):
+                    metadata[key] = self.codec.decode_payload(metadata[key])
+                rows[metadata["id"]] = metadata
+            return rows
+
+    def get_all_screenshots(self, feature_name: Optional[str] = None, status: Optional[str] = None,
+                            include_layout: bool = False) -> List[Dict]:
+        """
+        Get screenshots from SQLite, newest first, filtered in SQL
+        Args:
+            feature_name (str): Only return entries of this feature.
+            status (str): Only return entries with this status.
+            include_layout (bool): Also decode the screens/transitions JSON.
+        Returns:
+            List[Dict]: Screenshot rows with their gestures, conditions, errors, languages and text lists.
+        """
+        return list(self.iter_screenshots(feature_name=feature_name, status=status, include_layout=include_layout))
+
+    def iter_screenshots(self, feature_name: Optional[str] = None, status: Optional[str] = None,
+                         fields: Optional[Sequence[str]] = None, include_layout: bool = False,
+                         include_embedding: bool = False, cursor: Optional[str] = None,
+                         page_size: Optional[int] = None) -> Iterator[Dict]:
+        """
+        Stream screenshots newest first, one keyset page at a time.
+        A pooled connection is only held while a page is fetched, so callers may
+        update rows between iterations; memory stays at one page.
+        Args:
+            fields (Sequence[str]): Columns and list fields to return ("id" is always included); default all.
+            include_layout (bool): Also return the decoded screens/transitions.
+            include_embedding (bool): Also return the embedding as a float32 array.
+            cursor (str): Resume after the entry this cursor points at.
+            page_size (int): Rows fetched per query.
+        Yields:
+            Dict: One screenshot per iteration.
+        Raises:
+            ValueError: If a field is unknown or the cursor is malformed.
+        """
+        page_size = page_size or self.page_size
+        # Validated here, not on first next(), so callers can report bad input before streaming
+        after = decode_cursor(cursor) if cursor else None
+        self._projection(fields)
+
+        def pages(after):
+            while True:
+                rows, after = self._page(feature_name, status, fields, include_layout, include_embedding,
+                                         after, page_size)
+                yield from rows
+                if after is None:
+                    return
+        return pages(after)
 
-    def get_all_screenshots(self) -> List[Dict]:
+    def list_screenshots(self, limit: Optional[int] = None, cursor: Optional[str] = None,
+                         feature_name: Optional[str] = None, status: Optional[str] = None,
+                         fields: Optional[Sequence[str]] = None, include_layout: bool = False,
+                         include_embedding: bool = False) -> Tuple[List[Dict], Optional[str]]:
         """
-        Get all screenshots from SQLite
+        One page of screenshots, newest first.
+        Returns:
+            Tuple[List[Dict], Optional[str]]: The rows and the cursor of the next page (None on the last page).
         """
-        conn = sqlite3.connect(self.sqlite_db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM screenshots ORDER BY created_at DESC")
-        rows = cursor.fetchall()
-        columns = [description[0] for description in cursor.description]
-        conn.close()
+        limit = min(limit or self.page_size, self.max_page_size)
+        after = decode_cursor(cursor) if cursor else None
+        rows, after = self._page(feature_name, status, fields, include_layout, include_embedding, after, limit)
+        return rows, encode_cursor(*after) if after else None
+
+    def _page(self, feature_name, status, fields, include_layout, include_embedding, after, limit):
+        columns, children = self._projection(fields)
+        columns = ["created_at"] + columns
+        if include_layout:
+            columns += ["screens", "transitions"]
+        if include_embedding:
+            columns.append("embedding")
+        clauses, params = self._filter_clause(feature_name, status)
+        if after is not None:
+            clauses.append("(created_at, id) < (?, ?)")
+            params += list(after)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self.pool.connection() as conn:
+            # One row past the page tells whether another page follows
+            rows = conn.execute(
+                f"SELECT {', '.join(columns)} FROM screenshots {where} ORDER BY created_at DESC, id DESC LIMIT ?",
+                params + [limit + 1]
+            ).fetchall()
+            more = len(rows) > limit
+            rows = rows[:limit]
+            lists = read_children(conn, [row[1] for row in rows], children) if children else {}
 
         screenshots = []
         for row in rows:
             metadata = dict(zip(columns, row))
-            # Handle the column name inconsistency (gesture vs gestures)
-            if "gesture" in metadata:
-                metadata["gestures"] = json.loads(metadata["gesture"]) if metadata["gesture"] else []
-                # Remove the old column to avoid confusion
-                del metadata["gesture"]
-            else:
-                metadata["gestures"] = []
-                
-            metadata["conditions"] = json.loads(metadata["conditions"]) if metadata["conditions"] else []
-            metadata["errors"] = json.loads(metadata["errors"]) if metadata["errors"] else []
-            metadata["languages"] = json.loads(metadata["languages"]) if metadata["languages"] else []
-            metadata["text"] = json.loads(metadata["text"]) if metadata["text"] else []
+            if include_layout:
+                for key in ("screens", "transitions"):
+                    metadata[key] = self.codec.decode_payload(metadata[key])
+            if include_embedding and metadata["embedding"] is not None:
+                metadata["embedding"] = decode_embedding(metadata["embedding"], self.index.dim)
+            metadata.update(lists.get(metadata["id"], {}))
+            if fields is not None and "created_at" not in fields:
+                del metadata["created_at"]
             screenshots.append(metadata)
-        return screenshots
+        return screenshots, (rows[-1][0], rows[-1][1]) if more else None
+
+    @staticmethod
+    def _projection(fields: Optional[Sequence[str]]) -> Tuple[List[str], List[str]]:
+        if fields is None:
+            return [c for c in SCREENSHOT_COLUMNS if c != "created_at"], list(CHILD_TABLES)
+        unknown = set(fields) - set(SCREENSHOT_COLUMNS) - set(CHILD_TABLES)
+        if unknown:
+            raise ValueError(f"Unknown field(s): {', '.join(sorted(unknown))}")
+        columns = ["id"] + [c for c in SCREENSHOT_COLUMNS if c in fields and c not in ("id", "created_at")]
+        return columns, [f for f in CHILD_TABLES if f in fields]
 
     def get_screenshot_by_id(self, screenshot_id: int) -> Dict:
         """
-        Get screenshot by ID
+        Get screenshot by ID, from the record cache when it is still current
         """
-        conn = sqlite3.connect(self.sqlite_db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM screenshots WHERE id = ?", (screenshot_id,))
-        row = cursor.fetchone()
-        columns = [description[0] for description in cursor.description]
-        conn.close()
-
-        if not row:
-            return None
-
+        columns = list(SCREENSHOT_COLUMNS) + ["screens", "transitions"]
+        with self.pool.connection() as conn:
+            if self.cache is not None:
+                self.cache.sync(data_version(conn))
+                cached = self.cache.get(screenshot_id)
+                if cached is not None:
+                    return cached
+                # Miss: read the version and the row in one snapshot, so nothing stale is cached
+                conn.execute("BEGIN")
+                version = data_version(conn)
+            row = conn.execute(f"SELECT {', '.join(columns)} FROM screenshots WHERE id = ?", (screenshot_id,)).fetchone()
+            if not row:
+                return None
+            children = read_children(conn, [screenshot_id])
         metadata = dict(zip(columns, row))
-        # Handle the column name inconsistency (gesture vs gestures)
-        if "gesture" in metadata:
-            metadata["gestures"] = json.loads(metadata["gesture"]) if metadata["gesture"] else []
-            # Remove the old column to avoid confusion
-            del metadata["gesture"]
-        else:
-            metadata["gestures"] = []
-            
-        metadata["conditions"] = json.loads(metadata["conditions"]) if metadata["conditions"] else []
-        metadata["errors"] = json.loads(metadata["errors"]) if metadata["errors"] else []
-        metadata["languages"] = json.loads(metadata["languages"]) if metadata["languages"] else []
-        metadata["text"] = json.loads(metadata["text"]) if metadata["text"] else []
+        for key in ("screens", "transitions"):
+            metadata[key] = self.codec.decode_payload(metadata[key])
+        metadata.update(children[screenshot_id])
+        if self.cache is not None:
+            self.cache.put(screenshot_id, metadata, version)
         return metadata
 
+    def count_by_feature(self, status: Optional[str] = None) -> Dict[str, int]:
+        """
+        Number of screenshots per feature, grouped in SQL
+        """
+        clauses, params = self._filter_clause(None, status)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                f"SELECT feature_name, COUNT(*) FROM screenshots {where} GROUP BY feature_name", params
+            ).fetchall()
+        return dict(rows)
+
+    def text_search(self, query: str, limit: Optional[int] = None, offset: int = 0,
+                    feature_name: Optional[str] = None, status: Optional[str] = None,
+                    match: str = "any") -> List[Dict]:
+        """
+        Full-text search over screen text, annotations, transitions and gherkin (screenshots_fts).
+        Terms of three or more characters go through the trigram index and are ranked by bm25;
+        a query with shorter terms (e.g. two-syllable Korean words) falls back to substring matching.
+        Args:
+            query (str): Whitespace-separated terms, e.g. "Timer 타이머".
+            limit (int): Maximum number of hits.
+            offset (int): Hits to skip, for paging.
+            feature_name (str): Only return entries of this feature.
+            status (str): Only return entries with this status.
+            match (str): "any" term or "all" terms.
+        Returns:
+            List[Dict]: Hits with id, filename, feature_name, status, version, score and a highlighted snippet.
+        Raises:
+            ValueError: If the query is empty or `match` is unknown.
+        """
+        terms = query.split()
+        if not terms:
+            raise ValueError("Query is empty")
+        if match not in ("any", "all"):
+            raise ValueError("match must be 'any' or 'all'")
+        limit = min(limit or self.fulltext_default_limit, self.fulltext_max_limit)
+        joiner = " OR " if match == "any" else " AND "
+        clauses, params = self._filter_clause(feature_name, status)
+        filters = "".join(f" AND s.{clause}" for clause in clauses)
+        mark_open, mark_close = self.fulltext_highlight
+
+        with self.pool.connection() as conn:
+            # Rows another writer changed are re-indexed before they are searched
+            if conn.execute("SELECT 1 FROM screenshots_fts_dirty LIMIT 1").fetchone():
+                conn.execute("BEGIN IMMEDIATE")
+                refresh_fulltext(conn)
+                conn.commit()
+            if all(len(term) >= 3 for term in terms):
+                expression = joiner.join('"' + term.replace('"', '""') + '"' for term in terms)
+                weights = ", ".join(str(self.fulltext_weights.get(column, 1.0)) for column in FTS_COLUMNS)
+                rows = conn.execute(
+                    f"""
+                    SELECT s.id, s.filename, s.feature_name, s.status, s.version,
+                           bm25(screenshots_fts, {weights}) AS rank,
+                           snippet(screenshots_fts, -1, ?, ?, '…', ?)
+                    FROM screenshots_fts JOIN screenshots s ON s.id = screenshots_fts.rowid
+                    WHERE screenshots_fts MATCH ?{filters}
+                    ORDER BY rank LIMIT ? OFFSET ?
+                    """,
+                    [mark_open, mark_close, self.fulltext_snippet_tokens, expression] + params + [limit, offset]
+                ).fetchall()
+                return [
+                    {"id": row[0], "filename": row[1], "feature_name": row[2], "status": row[3], "version": row[4],
+                     "score": round(-row[5], 4), "snippet": row[6]}
+                    for row in rows
+                ]
+
+            # Trigram MATCH needs three characters; LIKE still runs inside SQLite, and so does the
+            # ranking (share of terms matched), so paging follows score order
+            columns = [f"screenshots_fts.{column}" for column in FTS_COLUMNS]
+            term_clauses, like_params = [], []
+            for term in terms:
+                pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                # Empty columns are NULL, which would turn the whole sum NULL
+                term_clauses.append(
+                    "COALESCE(" + " OR ".join(f"{column} LIKE ? ESCAPE '\\'" for column in columns) + ", 0)"
+                )
+                like_params += [pattern] * len(columns)
+            rows = conn.execute(
+                f"""
+                SELECT * FROM (
+                    SELECT s.id, s.filename, s.feature_name, s.status, s.version,
+                           {' + '.join(term_clauses)} AS matched, {', '.join(columns)}
+                    FROM screenshots_fts JOIN screenshots s ON s.id = screenshots_fts.rowid
+                    WHERE 1{filters}
+                )
+                WHERE matched >= ?
+                ORDER BY matched DESC, id LIMIT ? OFFSET ?
+                """,
+                like_params + params + [1 if match == "any" else len(terms), limit, offset]
+            ).fetchall()
+        return [
+            {"id": row[0], "filename": row[1], "feature_name": row[2], "status": row[3], "version": row[4],
+             "score": round(row[5] / len(terms), 4),
+             "snippet": _highlight([text for text in row[6:] if text], terms, mark_open, mark_close)}
+            for row in rows
+        ]
+
     def update_screenshot(self, screenshot_id: int, updates: Dict):
         """
         Update screenshot metadata
+        Raises:
+            ValueError: If the update is empty or names a column outside UPDATABLE_COLUMNS.
+        """
+        self.update_screenshots([(screenshot_id, updates)])
+
+    def update_screenshots(self, updates: List[Tuple[int, Dict]]) -> None:
         """
-        conn = sqlite3.connect(self.sqlite_db_path)
-        cursor = conn.cursor()
-        set_clause = ", ".join([f"{k} = ?" for k in updates.keys()])
-        values = list(updates.values()) + [screenshot_id]
-        cursor.execute(f"UPDATE screenshots SET {set_clause} WHERE id = ?", values)
-        conn.commit()
-        conn.close()
\ No newline at end of file
+        Apply many screenshot updates in one write transaction.
+        Args:
+            updates (List[Tuple[int, Dict]]): (screenshot ID, column values) pairs.
+        Raises:
+            ValueError: If an update is empty or names a column outside UPDATABLE_COLUMNS; nothing is written then.
+        """
+        # Rows updating the same columns share one statement
+        statements: Dict[Tuple[str, ...], List[list]] = {}
+        for screenshot_id, values in updates:
+            if not values:
+                raise ValueError(f"No columns to update for screenshot {screenshot_id}")
+            unknown = set(values) - UPDATABLE_COLUMNS
+            if unknown:
+                raise ValueError(f"Cannot update column(s): {', '.join(sorted(unknown))}")
+            columns = tuple(values)
+            statements.setdefault(columns, []).append([values[column] for column in columns] + [screenshot_id])
+        if not statements:
+            return
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            before = data_version(conn)
+            for columns, rows in statements.items():
+                set_clause = ", ".join(f"{column} = ?" for column in columns)
+                conn.executemany(f"UPDATE screenshots SET {set_clause} WHERE id = ?", rows)
+            refresh_fulltext(conn)
+            after = data_version(conn)
+        if self.cache is not None:
+            self.cache.invalidate([screenshot_id for screenshot_id, _ in updates], before, after)
+
+    def close(self):
+        self.pool.close()
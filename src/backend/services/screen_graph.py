@@ -0,0 +1,198 @@
+import threading
+import logging
+from collections import defaultdict, deque
+from typing import Dict, List, Optional
+
+from src.ingestion.kb_schema import data_version
+from src.backend.utils.db import SQLitePool
+
+logger = logging.getLogger(__name__)
+
+class ScreenGraph:
+    """
+    Reachability queries over the screen_nodes/screen_edges tables.
+    Screens are matched by their ID (e.g. "screen_home") across all screenshots.
+    Neighbors are answered from the indexed tables; path queries walk an
+    in-memory adjacency list that is rebuilt when the KB's data_version moves.
+    """
+
+    def __init__(self, config: dict, pool: SQLitePool):
+        self.config = config
+        self.pool = pool
+        graph_config = config["kb"].get("graph", {})
+        self.max_depth = graph_config.get("max_depth", 6)
+        self.max_paths = graph_config.get("max_paths", 100)
+        self._version: Optional[int] = None
+        # (adjacency, reverse): from -> to -> transitions, and to -> set of from
+        self._graph = ({}, {})
+        self._lock = threading.Lock()
+
+    def neighbors(self, screen_id: str, direction: str = "out", feature_name: Optional[str] = None) -> List[Dict]:
+        """
+        Screens one transition away from screen_id.
+        Args:
+            screen_id (str): Screen to start from.
+            direction (str): "out" (screens it leads to), "in" (screens leading to it) or "both".
+            feature_name (str): Only use transitions of screenshots of this feature.
+        Returns:
+            List[Dict]: One entry per distinct transition, with the screenshots it appears in.
+        Raises:
+            ValueError: If direction is unknown.
+        """
+        if direction not in ("out", "in", "both"):
+            raise ValueError("direction must be 'out', 'in' or 'both'")
+        clauses, params = [], []
+        if direction in ("out", "both"):
+            clauses.append("e.from_screen = ?")
+            params.append(screen_id)
+        if direction in ("in", "both"):
+            clauses.append("e.to_screen = ?")
+            params.append(screen_id)
+        where = f"({' OR '.join(clauses)})"
+        if feature_name is not None:
+            where += " AND s.feature_name = ?"
+            params.append(feature_name)
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                f"""
+                SELECT e.from_screen, e.to_screen, e.trigger_element, e.action, e.condition,
+                       group_concat(e.screenshot_id)
+                FROM screen_edges e JOIN screenshots s ON s.id = e.screenshot_id
+                WHERE {where}
+                GROUP BY e.from_screen, e.to_screen, e.trigger_element, e.action, e.condition
+                ORDER BY COUNT(*) DESC, e.from_screen, e.to_screen
+                """,
+                params
+            ).fetchall()
+        return [
+            {"from_screen": row[0], "to_screen": row[1], "trigger_element": row[2], "action": row[3],
+             "condition": row[4], "screenshot_ids": sorted(int(i) for i in row[5].split(","))}
+            for row in rows
+        ]
+
+    def shortest_path(self, source: str, target: str, max_depth: Optional[int] = None,
+                      feature_name: Optional[str] = None) -> Optional[List[Dict]]:
+        """
+        Fewest-transition path from source to target (breadth-first).
+        Returns:
+            Optional[List[Dict]]: The hops in order, or None if target is unreachable within max_depth.
+        """
+        max_depth = min(max_depth or self.max_depth, self.max_depth)
+        adjacency, _ = self._current_graph()
+        if source == target:
+            return []
+        parents = {source: None}
+        frontier = deque([(source, 0)])
+        while frontier:
+            node, depth = frontier.popleft()
+            if depth == max_depth:
+                continue
+            for neighbor, edges in adjacency.get(node, {}).items():
+                if neighbor in parents or not self._edges(edges, feature_name):
+                    continue
+                parents[neighbor] = node
+                if neighbor == target:
+                    path = [neighbor]
+                    while parents[path[-1]] is not None:
+                        path.append(parents[path[-1]])
+                    return self._hops(list(reversed(path)), adjacency, feature_name)
+                frontier.append((neighbor, depth + 1))
+        return None
+
+    def paths(self, source: str, target: str, max_depth: Optional[int] = None,
+              feature_name: Optional[str] = None, limit: Optional[int] = None) -> List[List[Dict]]:
+        """
+        All simple paths (no screen visited twice) from source to target with at most max_depth transitions.
+        Returns:
+            List[List[Dict]]: Up to `limit` paths, shortest first, each a list of hops.
+        """
+        max_depth = min(max_depth or self.max_depth, self.max_depth)
+        limit = min(limit or self.max_paths, self.max_paths)
+        adjacency, reverse = self._current_graph()
+        # Transitions still needed to reach target from each screen; prunes branches that cannot make it
+        distance = {target: 0}
+        frontier = deque([target])
+        while frontier:
+            node = frontier.popleft()
+            for previous in reverse.get(node, ()):
+                if previous not in distance:
+                    distance[previous] = distance[node] + 1
+                    frontier.append(previous)
+        found = []
+        # Iterative deepening keeps results shortest-first and stops once `limit` paths are found
+        for depth in range(distance.get(source, max_depth + 1), max_depth + 1):
+            stack = [[source]]
+            while stack and len(found) < limit:
+                path = stack.pop()
+                if len(path) - 1 == depth:
+                    if path[-1] == target:
+                        found.append(self._hops(path, adjacency, feature_name))
+                    continue
+                remaining = depth - len(path)
+                for neighbor, edges in sorted(adjacency.get(path[-1], {}).items(), reverse=True):
+                    if distance.get(neighbor, remaining + 1) > remaining or neighbor in path:
+                        continue
+                    if not self._edges(edges, feature_name):
+                        continue
+                    if neighbor == target and len(path) < depth:
+                        continue  # Already reported at a shallower depth
+                    stack.append(path + [neighbor])
+            if len(found) >= limit:
+                break
+        return found
+
+    @staticmethod
+    def _edges(edges: List[Dict], feature_name: Optional[str]) -> List[Dict]:
+        if feature_name is None:
+            return edges
+        return [edge for edge in edges if edge["feature_name"] == feature_name]
+
+    def _hops(self, path: List[str], adjacency, feature_name: Optional[str]) -> List[Dict]:
+        hops = []
+        for from_screen, to_screen in zip(path, path[1:]):
+            edges = self._edges(adjacency[from_screen][to_screen], feature_name)
+            triggers = []
+            for edge in edges:
+                trigger = {key: edge[key] for key in ("trigger_element", "action", "condition")}
+                if trigger not in triggers:
+                    triggers.append(trigger)
+            hops.append({
+                "from_screen": from_screen,
+                "to_screen": to_screen,
+                "triggers": triggers,
+                "screenshot_ids": sorted({edge["screenshot_id"] for edge in edges}),
+            })
+        return hops
+
+    def _current_graph(self):
+        with self.pool.connection() as conn:
+            # Version and edges from one snapshot
+            conn.execute("BEGIN")
+            version = data_version(conn)
+            if version == self._version:
+                return self._graph
+            with self._lock:
+                if version == self._version:
+                    return self._graph
+                rows = conn.execute(
+                    """
+                    SELECT e.from_screen, e.to_screen, e.trigger_element, e.action, e.condition,
+                           e.screenshot_id, s.feature_name
+                    FROM screen_edges e JOIN screenshots s ON s.id = e.screenshot_id
+                    """
+                ).fetchall()
+                adjacency = defaultdict(lambda: defaultdict(list))
+                for from_screen, to_screen, trigger, action, condition, screenshot_id, feature_name in rows:
+                    adjacency[from_screen][to_screen].append({
+                        "trigger_element": trigger, "action": action, "condition": condition,
+                        "screenshot_id": screenshot_id, "feature_name": feature_name,
+                    })
+                adjacency = {node: dict(links) for node, links in adjacency.items()}
+                reverse = defaultdict(set)
+                for from_screen, links in adjacency.items():
+                    for to_screen in links:
+                        reverse[to_screen].add(from_screen)
+                self._graph = (adjacency, dict(reverse))
+                self._version = version
+                logger.info(f"Loaded screen graph: {len(adjacency)} screens, {len(rows)} transitions")
+                return self._graph
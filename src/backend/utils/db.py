@@ -0,0 +1,107 @@
+import queue
+import sqlite3
+import threading
+import logging
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+class SQLitePool:
+    """
+    Fixed-size pool of WAL-mode SQLite connections shared across requests.
+    Each connection keeps its own prepared-statement cache, so hot queries
+    are parsed once per connection instead of once per request.
+    """
+
+    def __init__(self, db_path, size: int = 8, busy_timeout_ms: int = 5000,
+                 cached_statements: int = 256, acquire_timeout: float = 30.0,
+                 on_connect: Optional[Callable[[sqlite3.Connection], None]] = None):
+        self.db_path = Path(db_path)
+        self.size = max(1, size)
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cached_statements = cached_statements
+        self.acquire_timeout = acquire_timeout
+        self.on_connect = on_connect
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @classmethod
+    def from_config(cls, config: dict) -> "SQLitePool":
+        from src.ingestion.kb_codec import KBCodec
+        pool_config = config["kb"].get("sqlite_pool", {})
+        return cls(
+            config["kb"]["sqlite_db_path"],
+            size=pool_config.get("size", 8),
+            busy_timeout_ms=pool_config.get("busy_timeout_ms", 5000),
+            cached_statements=pool_config.get("cached_statements", 256),
+            # kb_json() for the triggers that read encoded screens/transitions
+            on_connect=KBCodec(config).register,
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,  # Handed between worker threads, never shared concurrently
+            cached_statements=self.cached_statements,
+            timeout=self.busy_timeout_ms / 1000,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        if self.on_connect is not None:
+            self.on_connect(conn)
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        if self._closed:
+            raise RuntimeError("SQLite pool is closed")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._created -= 1
+                    raise
+        try:
+            return self._idle.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No SQLite connection free after {self.acquire_timeout}s (pool size {self.size})")
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrow a connection. The open transaction is committed on success and
+        rolled back on error before the connection goes back to the pool.
+        """
+        conn = self._acquire()
+        try:
+            yield conn
+            if conn.in_transaction:
+                conn.commit()
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            if self._closed:
+                conn.close()
+            else:
+                self._idle.put(conn)
+
+    def close(self) -> None:
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
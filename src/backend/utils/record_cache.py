@@ -0,0 +1,133 @@
+import time
+import pickle
+import threading
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional
+
+from prometheus_client import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+# Define metrics
+CACHE_LOOKUPS = Counter('camera_testgen_kb_cache_lookups_total', 'KB record cache lookups', ['cache', 'result'])
+CACHE_EVICTIONS = Counter('camera_testgen_kb_cache_evictions_total', 'KB record cache evictions', ['cache'])
+CACHE_ENTRIES = Gauge('camera_testgen_kb_cache_entries', 'Records held in the KB record cache', ['cache'])
+CACHE_BYTES = Gauge('camera_testgen_kb_cache_bytes', 'Pickled size of the KB record cache', ['cache'])
+CACHE_HIT_RATIO = Gauge('camera_testgen_kb_cache_hit_ratio', 'KB record cache hit rate since start', ['cache'])
+
+class RecordCache:
+    """
+    In-process LRU cache of decoded records with a TTL and a byte budget.
+    Records are stored pickled, so every hit returns a private copy and the
+    byte count is the real footprint. `sync` drops everything when the KB's
+    data_version moved, which keeps several worker processes consistent.
+    """
+
+    def __init__(self, name: str = "screenshots", max_entries: int = 10000, max_size_mb: float = 64,
+                 ttl_seconds: float = 300):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self.ttl_seconds = ttl_seconds
+        self.version: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size_bytes = 0
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Gauges are computed at scrape time, keeping the lookup path free of metric updates
+        CACHE_ENTRIES.labels(cache=name).set_function(lambda: len(self._entries))
+        CACHE_BYTES.labels(cache=name).set_function(lambda: self.size_bytes)
+        CACHE_HIT_RATIO.labels(cache=name).set_function(
+            lambda: self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0
+        )
+        self._hit_counter = CACHE_LOOKUPS.labels(cache=name, result="hit")
+        self._miss_counter = CACHE_LOOKUPS.labels(cache=name, result="miss")
+
+    @classmethod
+    def from_config(cls, config: dict) -> Optional["RecordCache"]:
+        cache_config = config["kb"].get("cache", {})
+        if not cache_config.get("enabled", True):
+            return None
+        return cls(
+            max_entries=cache_config.get("max_entries", 10000),
+            max_size_mb=cache_config.get("max_size_mb", 64),
+            ttl_seconds=cache_config.get("ttl_seconds", 300),
+        )
+
+    def sync(self, version: int) -> None:
+        """
+        Adopt the KB's current data_version, dropping all entries if it changed.
+        """
+        with self._lock:
+            if version != self.version:
+                if self._entries:
+                    logger.debug(f"KB data_version {self.version} -> {version}, dropping {len(self._entries)} cached records")
+                self._entries.clear()
+                self.size_bytes = 0
+                self.version = version
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] > self.ttl_seconds:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                self._miss_counter.inc()
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self._hit_counter.inc()
+        return pickle.loads(entry[0])
+
+    def put(self, key: Hashable, value: Any, version: int) -> None:
+        """
+        Store value, read at data_version `version`; stale reads are not cached.
+        """
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            if version != self.version or len(payload) > self.max_bytes:
+                return
+            self._remove(key)
+            self._entries[key] = (payload, time.monotonic())
+            self.size_bytes += len(payload)
+            while len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+                CACHE_EVICTIONS.labels(cache=self.name).inc()
+
+    def invalidate(self, keys: Iterable[Hashable], before: int, after: int) -> None:
+        """
+        Drop entries this process rewrote in one write transaction that moved
+        data_version from `before` to `after`; the rest stays valid if the cache was at `before`.
+        """
+        with self._lock:
+            for key in keys:
+                self._remove(key)
+            if self.version is not None and self.version == before:
+                self.version = after
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size_bytes -= len(entry[0])
+
+    def stats(self) -> Dict:
+        """
+        Get hit/miss counters and current cache size.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "size_bytes": self.size_bytes,
+                "data_version": self.version,
+            }
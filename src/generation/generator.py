@@ -1,58 +1,124 @@
+import time
+import json
+import hashlib
 import logging
-from typing import List, Dict
+import threading
+from typing import List, Dict, Optional
 
-from .rule_engine import RuleEngine
-from .llm_adapter import LLMAdapter
+from .rule_engine import RULES_VERSION, RuleEngine
+from .llm_adapter import PROMPT_EXCLUDED_FIELDS, PROMPT_VERSION, LLMAdapter
 from .gherkin_formatter import GherkinFormatter
 
 logger = logging.getLogger(__name__)
 
+# Record fields that are not generation input: the same set the LLM prompt leaves out
+NON_INPUT_FIELDS = PROMPT_EXCLUDED_FIELDS
+
+# Layout fields the prompt and the rules read; KBService only returns them with include_layout=True
+LAYOUT_FIELDS = ("screens", "transitions")
+
+# Settings that change what generate() returns for the same metadata
+FINGERPRINT_SETTINGS = ("llm_model", "llm_temperature", "llm_max_tokens", "prompt_template",
+                        "rule_priority", "fallback_to_rule_only")
+
 class GherkinGenerator:
     def __init__(self, config: dict):
         self.config = config
         self.rule_engine = RuleEngine(config)
         self.llm_adapter = LLMAdapter(config)
         self.gherkin_formatter = GherkinFormatter(config)
+        # Caps in-flight LLM calls across all threads using this generator; the rule path is not limited
+        self.llm_concurrency = max(1, int(config["generation"].get("llm_concurrency", 2)))
+        self.llm_semaphore = threading.BoundedSemaphore(self.llm_concurrency)
+        settings = {key: config["generation"].get(key) for key in FINGERPRINT_SETTINGS}
+        settings["rules_version"] = RULES_VERSION
+        settings["prompt_version"] = PROMPT_VERSION
+        self._settings_digest = hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def fingerprint(self, metadata: Dict) -> str:
+        """
+        Hash of everything generate() depends on: the metadata the prompt and rules read (no IDs, paths,
+        version, vectors or review fields), its screens/transitions, the LLM model and options, the prompt
+        template and the prompt-builder and rule-engine versions.
+        Args:
+            metadata (Dict): Screenshot metadata, including its layout.
+        Returns:
+            str: Hex SHA-256; equal fingerprints produce the same Gherkin.
+        Raises:
+            ValueError: If the metadata was read without its screens/transitions.
+        """
+        missing = [key for key in LAYOUT_FIELDS if key not in metadata]
+        if missing:
+            # A record read without its layout would keep its fingerprint when only the layout changed
+            raise ValueError(f"Screenshot {metadata.get('id')} was read without {', '.join(missing)}")
+        inputs = {key: value for key, value in metadata.items() if key not in NON_INPUT_FIELDS + LAYOUT_FIELDS}
+        layout = {key: metadata[key] for key in LAYOUT_FIELDS}
+        digest = hashlib.sha256(self._settings_digest.encode("ascii"))
+        digest.update(json.dumps(inputs, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+        digest.update(json.dumps(layout, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+        return digest.hexdigest()
 
-    def generate(self, metadata: Dict) -> str:
+    def generate(self, metadata: Dict, timing: Optional[Dict] = None) -> str:
         """
         Generate Gherkin test cases from metadata.
         Priority: Rule-Based > LLM > Fallback to Rule-Based.
         Args:
             metadata (Dict): Screenshot metadata.
+            timing (Dict): If given, filled with seconds per stage ("rule_seconds", "llm_wait_seconds",
+                "llm_seconds", "fallback_seconds"), the "source" that produced the result and
+                "llm_failed" if the LLM was tried and gave nothing.
         Returns:
             str: Gherkin formatted test cases.
         """
         logger.info(f"Generating Gherkin for {metadata['filename']}")
+        timing = timing if timing is not None else {}
+        timing["source"] = None
 
         # Step 1: Try Rule-Based
+        started = time.perf_counter()
         try:
             rule_based_scenarios = self.rule_engine.generate(metadata)
             if rule_based_scenarios:
                 logger.info("✅ Rule-based generation successful.")
+                timing["source"] = "rule"
                 return self.gherkin_formatter.format(metadata, rule_based_scenarios)
         except Exception as e:
             logger.warning(f"⚠️ Rule-based generation failed: {e}")
+        finally:
+            timing["rule_seconds"] = round(time.perf_counter() - started, 4)
 
         # Step 2: Try LLM
         if not self.config["generation"]["rule_priority"]:
-            try:
-                llm_output = self.llm_adapter.generate(metadata)
-                if llm_output:
-                    logger.info("✅ LLM generation successful.")
-                    return llm_output
-            except Exception as e:
-                logger.warning(f"⚠️ LLM generation failed: {e}")
+            started = time.perf_counter()
+            with self.llm_semaphore:
+                timing["llm_wait_seconds"] = round(time.perf_counter() - started, 4)
+                started = time.perf_counter()
+                try:
+                    llm_output = self.llm_adapter.generate(metadata)
+                    if llm_output:
+                        logger.info("✅ LLM generation successful.")
+                        timing["source"] = "llm"
+                        return llm_output
+                    timing["llm_failed"] = True
+                except Exception as e:
+                    logger.warning(f"⚠️ LLM generation failed: {e}")
+                    timing["llm_failed"] = True
+                finally:
+                    timing["llm_seconds"] = round(time.perf_counter() - started, 4)
 
         # Step 3: Fallback to Rule-Based (if enabled)
         if self.config["generation"]["fallback_to_rule_only"]:
+            started = time.perf_counter()
             try:
                 fallback_scenarios = self.rule_engine.generate(metadata, fallback=True)
                 logger.info("✅ Fallback rule-based generation successful.")
+                timing["source"] = "fallback"
                 return self.gherkin_formatter.format(metadata, fallback_scenarios)
             except Exception as e:
                 logger.error(f"💥 Generation failed for {metadata['filename']}: {e}")
                 return ""
+            finally:
+                timing["fallback_seconds"] = round(time.perf_counter() - started, 4)
 
         logger.error(f"💥 No generation method succeeded for {metadata['filename']}")
         return ""
\ No newline at end of file
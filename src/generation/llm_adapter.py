@@ -1,9 +1,31 @@
+import json
+import time
+import hashlib
 import logging
+import sqlite3
 import requests
-from typing import Dict
+from typing import Dict, Optional
+
+from prometheus_client import Counter, Gauge
+
+from src.ingestion.response_cache import ResponseCache
 
 logger = logging.getLogger(__name__)
 
+# Define metrics
+LLM_CACHE_LOOKUPS = Counter('camera_testgen_llm_cache_lookups_total', 'LLM response cache lookups', ['result'])
+LLM_CACHE_SAVED_SECONDS = Counter('camera_testgen_llm_cache_saved_seconds_total',
+                                  'Ollama latency avoided by LLM response cache hits')
+LLM_CACHE_ENTRIES = Gauge('camera_testgen_llm_cache_entries', 'Responses held in the LLM response cache')
+LLM_CACHE_BYTES = Gauge('camera_testgen_llm_cache_bytes', 'Size of the LLM response cache')
+
+# Record fields that are storage bookkeeping, vectors, generation output or review state; left out of the prompt
+PROMPT_EXCLUDED_FIELDS = ("id", "filename", "image_path", "created_at", "version", "embedding", "image_embedding",
+                          "status", "gherkin", "rejection_reason", "comment", "generation_fingerprint")
+
+# Bump when _build_prompt changes what it puts in the prompt, so stored generation fingerprints expire
+PROMPT_VERSION = 2
+
 class LLMAdapter:
     def __init__(self, config: dict):
         self.config = config
@@ -11,16 +33,50 @@ class LLMAdapter:
         self.model = config["generation"]["llm_model"]
         self.temperature = config["generation"]["llm_temperature"]
         self.max_tokens = config["generation"]["llm_max_tokens"]
+        self.cache = self._open_cache(config["generation"].get("llm_cache", {}))
+
+    def _open_cache(self, cache_config: Dict) -> Optional[ResponseCache]:
+        if not cache_config.get("enabled", False):
+            return None
+        cache = ResponseCache(
+            cache_config["path"],
+            max_size_mb=cache_config.get("max_size_mb", 64),
+            ttl_seconds=cache_config.get("ttl_seconds"),
+            busy_timeout_ms=cache_config.get("busy_timeout_ms", 5000),
+        )
+        # Computed at scrape time from the shared file, so every worker reports the same size
+        LLM_CACHE_ENTRIES.set_function(lambda: cache.stats()["entries"])
+        LLM_CACHE_BYTES.set_function(lambda: cache.stats()["size_bytes"])
+        return cache
+
+    def cache_key(self, prompt: str) -> str:
+        """
+        Cache key of a prompt: model, generation options and the prompt's SHA-256.
+        """
+        options = json.dumps({"temperature": self.temperature, "max_tokens": self.max_tokens}, sort_keys=True)
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        return ResponseCache.make_key("llm", self.model, options, prompt_hash)
 
     def generate(self, metadata: Dict) -> str:
         """
         Generate Gherkin using Ollama LLM.
+        Identical prompts are answered from the LLM response cache when it is enabled.
         Args:
             metadata (Dict): Screenshot metadata.
         Returns:
             str: Gherkin formatted test cases from LLM.
         """
         prompt = self._build_prompt(metadata)
+        key = self.cache_key(prompt) if self.cache is not None else None
+        if key is not None:
+            cached = self._cache_get(key)
+            if cached is not None:
+                LLM_CACHE_LOOKUPS.labels(result="hit").inc()
+                LLM_CACHE_SAVED_SECONDS.inc(cached["seconds"])
+                logger.debug(f"LLM cache hit for {metadata.get('filename')}")
+                return cached["response"]
+            LLM_CACHE_LOOKUPS.labels(result="miss").inc()
+
         payload = {
             "model": self.model,
             "prompt": prompt,
@@ -30,13 +86,31 @@ class LLMAdapter:
         }
 
         try:
+            started = time.perf_counter()
             response = requests.post(self.ollama_url, json=payload, timeout=60)
             response.raise_for_status()
             result = response.json()
-            return result.get("response", "").strip()
+            output = result.get("response", "").strip()
         except Exception as e:
             logger.error(f"LLM generation failed: {e}")
             raise
+        # Empty answers are not cached, so the next run asks again
+        if key is not None and output:
+            self._cache_put(key, {"response": output, "seconds": round(time.perf_counter() - started, 4)})
+        return output
+
+    def _cache_get(self, key: str) -> Optional[Dict]:
+        try:
+            return self.cache.get(key)
+        except sqlite3.Error as e:
+            logger.warning(f"LLM cache lookup failed: {e}")
+            return None
+
+    def _cache_put(self, key: str, value: Dict) -> None:
+        try:
+            self.cache.put(key, value)
+        except sqlite3.Error as e:
+            logger.warning(f"LLM cache write failed: {e}")
 
     def _build_prompt(self, metadata: Dict) -> str:
         """
@@ -47,5 +121,7 @@ class LLMAdapter:
             str: Prompt string for LLM.
         """
         template = self.config["generation"]["prompt_template"]
-        metadata_str = json.dumps(metadata, ensure_ascii=False, indent=2)
-        return template.format(metadata=metadata_str)
\ No newline at end of file
+        # Only the UI metadata goes in, so screenshots with the same metadata share one prompt
+        inputs = {key: value for key, value in metadata.items() if key not in PROMPT_EXCLUDED_FIELDS}
+        metadata_str = json.dumps(inputs, ensure_ascii=False, indent=2)
+        return template.format(metadata=metadata_str)
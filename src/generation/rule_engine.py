@@ -3,6 +3,9 @@ from typing import List, Dict
 
 logger = logging.getLogger(__name__)
 
+# Bump whenever rules or their Gherkin formatting change, so /generate regenerates stored test cases
+RULES_VERSION = 1
+
 class RuleEngine:
     def __init__(self, config: dict):
         self.config = config
@@ -0,0 +1,75 @@
+import os
+import json
+import hashlib
+import logging
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("layout", "metadata", "kb")
+
+class StageCheckpointer:
+    """
+    Persists the output of each ingestion stage (vision layout, built metadata,
+    KB write) so a retry or an interrupted run resumes from the failed stage.
+    Checkpoints are keyed by path and content hash, so an edited file never
+    resumes from a stale layout.
+    """
+
+    def __init__(self, config: dict):
+        self.config = config
+        checkpoint_config = config["ingestion"].get("checkpoints", {})
+        self.enabled = checkpoint_config.get("enabled", False)
+        self.checkpoint_dir = Path(checkpoint_config.get("dir", "data/kb/checkpoints"))
+        if self.enabled:
+            self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key_for(entry: Dict) -> str:
+        """
+        Checkpoint key for a manifest entry.
+        """
+        return hashlib.sha256(f"{entry['path']}\x1f{entry['sha256']}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str, stage: str) -> Path:
+        return self.checkpoint_dir / f"{key}.{stage}.json"
+
+    def load(self, key: str, stage: str) -> Optional[Any]:
+        """
+        Return the saved output of a stage, or None if it has not completed.
+        """
+        if not self.enabled:
+            return None
+        path = self._path(key, stage)
+        if not path.exists():
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Ignoring unreadable checkpoint {path.name}: {e}")
+            return None
+
+    def save(self, key: str, stage: str, data: Any) -> None:
+        """
+        Atomically persist a stage's output.
+        """
+        if not self.enabled:
+            return
+        path = self._path(key, stage)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def clear(self, key: str) -> None:
+        """
+        Drop all checkpoints of an image once it is fully ingested.
+        """
+        if not self.enabled:
+            return
+        for stage in STAGES:
+            self._path(key, stage).unlink(missing_ok=True)
@@ -0,0 +1,267 @@
+import time
+import sqlite3
+import logging
+import threading
+import numpy as np
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from .kb_codec import KBCodec
+from .kb_schema import read_children
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIM = 768
+
+def embedding_text(metadata: Dict) -> str:
+    """
+    Flatten the screens, annotations and transitions of a record into the text that gets embedded.
+    Args:
+        metadata (Dict): KB record.
+    Returns:
+        str: One line per screen, annotation and transition.
+    """
+    lines = [metadata.get("feature_name") or ""]
+    for screen in metadata.get("screens") or []:
+        if not isinstance(screen, dict):
+            continue
+        lines.append(f"{screen.get('id', '')}: {screen.get('description', '')}")
+        lines.extend(str(t) for t in screen.get("text_content") or [])
+        for annotation in screen.get("annotations") or []:
+            if isinstance(annotation, dict):
+                lines.append(f"({annotation.get('number', '')}) {annotation.get('explanation', '')}")
+    for transition in metadata.get("transitions") or []:
+        if isinstance(transition, dict):
+            lines.append(
+                f"{transition.get('from_screen', '')} -> {transition.get('to_screen', '')} "
+                f"via {transition.get('trigger_element', '')} ({transition.get('action', '')})"
+            )
+    # OCR text from the text child table; legacy rows may have no screens at all
+    for text in metadata.get("text") or []:
+        lines.append(text.get("text", "") if isinstance(text, dict) else str(text))
+    return "\n".join(line for line in lines if line.strip())
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+class Embedder:
+    """
+    Computes 768-d CPU embeddings for KB records: a multilingual sentence
+    encoder over the screen text (`embedding`) and, separately, a ViT encoder
+    over the image (`image_embedding`). The two models do not share a vector
+    space, so their vectors are stored and searched apart, never mixed.
+    torch/transformers are imported on first use.
+    """
+
+    def __init__(self, config: dict):
+        self.config = config
+        embedding_config = config["ingestion"].get("embedding", {})
+        self.enabled = embedding_config.get("enabled", False)
+        self.text_model_name = embedding_config.get("text_model", "sentence-transformers/paraphrase-multilingual-mpnet-base-v2")
+        self.image_model_name = embedding_config.get("image_model", "google/vit-base-patch16-224-in21k")
+        self.images = bool(embedding_config.get("images", True))
+        self.batch_size = max(1, int(embedding_config.get("batch_size", 16)))
+        self.max_length = int(embedding_config.get("max_length", 512))
+        self.num_threads = embedding_config.get("num_threads")
+        self._models = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._models is None:
+                import torch
+                from transformers import AutoImageProcessor, AutoModel, AutoTokenizer
+
+                if self.num_threads:
+                    torch.set_num_threads(int(self.num_threads))
+                started = time.perf_counter()
+                tokenizer = AutoTokenizer.from_pretrained(self.text_model_name)
+                text_model = AutoModel.from_pretrained(self.text_model_name).eval()
+                image_processor, image_model = None, None
+                if self.images:
+                    image_processor = AutoImageProcessor.from_pretrained(self.image_model_name)
+                    image_model = AutoModel.from_pretrained(self.image_model_name).eval()
+                self._models = (torch, tokenizer, text_model, image_processor, image_model)
+                logger.info(f"Loaded embedding models in {time.perf_counter() - started:.1f}s")
+        return self._models
+
+    def encode_texts(self, texts: List[str]) -> np.ndarray:
+        """
+        Mean-pooled sentence embeddings, L2-normalized.
+        """
+        torch, tokenizer, text_model, _, _ = self._load()
+        with torch.inference_mode():
+            batch = tokenizer(texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="pt")
+            hidden = text_model(**batch).last_hidden_state
+            mask = batch["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+        return _normalize(pooled.numpy().astype("float32"))
+
+    def encode_images(self, image_paths: List[str]) -> np.ndarray:
+        """
+        ViT [CLS] embeddings, L2-normalized. Unreadable images get a zero vector.
+        """
+        from PIL import Image
+
+        torch, _, _, image_processor, image_model = self._load()
+        images, readable = [], []
+        for path in image_paths:
+            try:
+                with Image.open(path) as image:
+                    images.append(image.convert("RGB"))
+                readable.append(True)
+            except Exception as e:
+                logger.warning(f"Could not read {path} for image embedding: {e}")
+                readable.append(False)
+        vectors = np.zeros((len(image_paths), EMBEDDING_DIM), dtype="float32")
+        if images:
+            with torch.inference_mode():
+                batch = image_processor(images=images, return_tensors="pt")
+                cls = image_model(**batch).last_hidden_state[:, 0]
+            vectors[np.array(readable)] = _normalize(cls.numpy().astype("float32"))
+        return vectors
+
+    def embed(self, records: List[Dict]) -> np.ndarray:
+        """
+        Text-embed KB records in batches of `ingestion.embedding.batch_size`.
+        Args:
+            records (List[Dict]): Records with screens/transitions.
+        Returns:
+            np.ndarray: float32 array of shape (len(records), 768), L2-normalized.
+        """
+        chunks = [
+            self.encode_texts([embedding_text(m) for m in records[start:start + self.batch_size]])
+            for start in range(0, len(records), self.batch_size)
+        ]
+        if not chunks:
+            return np.zeros((0, EMBEDDING_DIM), dtype="float32")
+        return np.vstack(chunks)
+
+    def embed_images(self, records: List[Dict]) -> List[Optional[np.ndarray]]:
+        """
+        Image-embed KB records in batches of `ingestion.embedding.batch_size`.
+        Args:
+            records (List[Dict]): Records with image_path.
+        Returns:
+            List: Per record, a 768-d L2-normalized vector, or None if the image could not be read.
+        """
+        vectors = []
+        for start in range(0, len(records), self.batch_size):
+            chunk = self.encode_images([m.get("image_path") or "" for m in records[start:start + self.batch_size]])
+            vectors.extend(vector if vector.any() else None for vector in chunk)
+        return vectors
+
+class EmbeddingBackfill:
+    """
+    Fills `screenshots.embedding` (and `image_embedding`, if image embeddings
+    are enabled) for rows ingested without one.
+    Progress is the set of rows still NULL, so a stopped or crashed job
+    simply picks up the remaining rows on its next run.
+    """
+
+    def __init__(self, config: dict, kb_writer, embedder: Optional[Embedder] = None):
+        self.config = config
+        self.kb_writer = kb_writer
+        self.embedder = embedder or Embedder(config)
+        self.sqlite_db_path = Path(config["kb"]["sqlite_db_path"])
+        self.codec = KBCodec(config)
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"processed": 0, "failed": 0, "seconds": 0.0, "rows_per_second": None, "remaining": None}
+
+    def _missing(self) -> str:
+        if self.embedder.images:
+            return "(embedding IS NULL OR image_embedding IS NULL)"
+        return "embedding IS NULL"
+
+    def _remaining(self, conn: sqlite3.Connection) -> int:
+        return conn.execute(f"SELECT COUNT(*) FROM screenshots WHERE {self._missing()}").fetchone()[0]
+
+    def _next_rows(self, conn: sqlite3.Connection, after_id: int, limit: int) -> List[Dict]:
+        columns = ("id", "feature_name", "screens", "transitions", "image_path")
+        cursor = conn.execute(
+            f"SELECT {', '.join(columns)}, embedding IS NULL, image_embedding IS NULL FROM screenshots "
+            f"WHERE {self._missing()} AND id > ? ORDER BY id LIMIT ?",
+            (after_id, limit)
+        )
+        records = []
+        for row in cursor.fetchall():
+            record = dict(zip(columns, row))
+            record["needs_text"], record["needs_image"] = bool(row[-2]), bool(row[-1]) and self.embedder.images
+            for key in ("screens", "transitions"):
+                try:
+                    record[key] = self.codec.decode_payload(record.get(key))
+                except (TypeError, ValueError):
+                    record[key] = []
+            records.append(record)
+        # OCR text lives in screenshot_texts since schema v2
+        children = read_children(conn, [record["id"] for record in records], fields=["text"])
+        for record in records:
+            record["text"] = children[record["id"]]["text"]
+        return records
+
+    def run(self) -> Dict:
+        """
+        Embed every row whose embedding is NULL, one batch per transaction.
+        Returns:
+            Dict: processed/failed counts, elapsed seconds and rows/sec.
+        """
+        self._stop.clear()
+        conn = sqlite3.connect(self.sqlite_db_path)
+        started = time.perf_counter()
+        last_id = 0
+        try:
+            total = self._remaining(conn)
+            logger.info(f"Embedding backfill: {total} rows without embeddings")
+            while not self._stop.is_set():
+                records = self._next_rows(conn, last_id, self.embedder.batch_size)
+                if not records:
+                    break
+                last_id = records[-1]["id"]
+                try:
+                    texts = [m for m in records if m["needs_text"]]
+                    if texts:
+                        self.kb_writer.set_embeddings([m["id"] for m in texts], self.embedder.embed(texts))
+                    images = [m for m in records if m["needs_image"]]
+                    if images:
+                        # Unreadable images stay NULL and are tried again by the next run
+                        embedded = [(m["id"], v) for m, v in zip(images, self.embedder.embed_images(images))
+                                    if v is not None]
+                        if embedded:
+                            self.kb_writer.set_embeddings([row_id for row_id, _ in embedded],
+                                                          np.vstack([v for _, v in embedded]), "image_embedding")
+                    self.stats["processed"] += len(records)
+                except Exception as e:
+                    # Skip this batch for the rest of the run; a later run retries it
+                    self.stats["failed"] += len(records)
+                    logger.error(f"❌ Failed to embed rows {records[0]['id']}-{last_id}: {e}")
+                elapsed = time.perf_counter() - started
+                self.stats["seconds"] = round(elapsed, 3)
+                self.stats["rows_per_second"] = round(self.stats["processed"] / elapsed, 2) if elapsed else None
+                logger.info(
+                    f"Embedded {self.stats['processed']}/{total} rows ({self.stats['rows_per_second']} rows/sec)"
+                )
+            self.stats["remaining"] = self._remaining(conn)
+        finally:
+            conn.close()
+        self.kb_writer.vector_index.flush()
+        self.kb_writer.image_index.flush()
+        return dict(self.stats)
+
+    def start(self) -> threading.Thread:
+        """
+        Run the backfill on a background thread.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self.run, name="embedding-backfill", daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def stop(self, wait: bool = True) -> None:
+        """
+        Stop after the current batch; rows left NULL are picked up by the next run.
+        """
+        self._stop.set()
+        if wait and self._thread is not None:
+            self._thread.join()
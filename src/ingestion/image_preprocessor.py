@@ -0,0 +1,174 @@
+import io
+import math
+import logging
+from PIL import Image
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+class ImagePreprocessor:
+    """
+    Normalizes image resolution before vision inference and splits oversized
+    flowchart exports into overlapping tiles.
+    """
+
+    def __init__(self, config: dict):
+        self.config = config
+        preprocessing = config["ingestion"].get("preprocessing", {})
+        self.max_side = preprocessing.get("max_side", 1920)
+        tiling = preprocessing.get("tiling", {})
+        self.tiling_enabled = tiling.get("enabled", False)
+        self.tile_min_side = tiling.get("min_side", 4000)
+        self.tile_size = tiling.get("tile_size", 1920)
+        self.overlap = tiling.get("overlap", 200)
+        self.max_tiles = tiling.get("max_tiles", 6)
+        if self.overlap >= self.tile_size:
+            raise ValueError(
+                f"Tiling overlap ({self.overlap}) must be smaller than tile_size ({self.tile_size})"
+            )
+
+    def signature(self) -> str:
+        """
+        Stable description of the policy, used to keep cached responses apart.
+        """
+        if self.tiling_enabled:
+            return f"max{self.max_side}-tile{self.tile_min_side}/{self.tile_size}/{self.overlap}/{self.max_tiles}"
+        return f"max{self.max_side}"
+
+    def prepare(self, image_bytes: bytes) -> List[bytes]:
+        """
+        Turn one image into the list of images to send to the model.
+        Args:
+            image_bytes (bytes): Raw image file contents.
+        Returns:
+            List[bytes]: A single normalized image, or the tiles of an oversized one.
+        """
+        try:
+            image = Image.open(io.BytesIO(image_bytes))
+            image.load()
+        except Exception as e:
+            logger.warning(f"Could not decode image for preprocessing, sending as-is: {e}")
+            return [image_bytes]
+        with image:
+            width, height = image.size
+            if self.tiling_enabled and max(width, height) > self.tile_min_side:
+                tiles = self._tile(image)
+                logger.info(f"Split {width}x{height} image into {len(tiles)} tiles")
+                return tiles
+            if max(width, height) <= self.max_side:
+                return [image_bytes]  # Already small enough, send untouched
+            return [self._encode(self._fit(image, self.max_side))]
+
+    def _tile(self, image: Image.Image) -> List[bytes]:
+        width, height = image.size
+        # Downscale first if the tile grid would exceed max_tiles
+        scale = 1.0
+        cols, rows = self._grid(width, height)
+        while cols * rows > self.max_tiles:
+            scale *= 0.9
+            cols, rows = self._grid(width * scale, height * scale)
+        if scale < 1.0:
+            image = image.resize((int(width * scale), int(height * scale)), Image.LANCZOS)
+            width, height = image.size
+
+        cols, rows = self._grid(width, height)
+        stride = self.tile_size - self.overlap
+        tiles = []
+        for row in range(rows):
+            for col in range(cols):
+                left = min(col * stride, max(width - self.tile_size, 0))
+                top = min(row * stride, max(height - self.tile_size, 0))
+                box = (left, top, min(left + self.tile_size, width), min(top + self.tile_size, height))
+                tiles.append(self._encode(self._fit(image.crop(box), self.max_side)))
+        return tiles
+
+    def _grid(self, width: float, height: float):
+        stride = self.tile_size - self.overlap
+        cols = max(1, math.ceil((width - self.overlap) / stride))
+        rows = max(1, math.ceil((height - self.overlap) / stride))
+        return cols, rows
+
+    @staticmethod
+    def _fit(image: Image.Image, max_side: int) -> Image.Image:
+        width, height = image.size
+        if max(width, height) <= max_side:
+            return image
+        ratio = max_side / max(width, height)
+        return image.resize((max(1, int(width * ratio)), max(1, int(height * ratio))), Image.LANCZOS)
+
+    @staticmethod
+    def _encode(image: Image.Image) -> bytes:
+        buffer = io.BytesIO()
+        image.convert("RGB").save(buffer, format="PNG", optimize=True)
+        return buffer.getvalue()
+
+def merge_layouts(layouts: List[Dict]) -> Dict:
+    """
+    Merge per-tile vision outputs into one document.
+    Screens with the same ID are merged when they share text (the same screen cut
+    by a tile border); otherwise the later one is renamed to `<id>_t<tile>` (plus a
+    counter if a screen of that tile already took the name) so IDs stay unique.
+    Args:
+        layouts (List[Dict]): Parsed model output for each tile, in tile order.
+    Returns:
+        Dict: {"screens": [...], "transitions": [...]}
+    """
+    screens = {}
+    transitions = []
+    seen_transitions = set()
+    for tile_number, layout in enumerate(layouts, 1):
+        renamed = {}
+        for screen in layout.get("screens", []) or []:
+            if not isinstance(screen, dict) or "id" not in screen:
+                continue
+            screen_id = screen["id"]
+            existing = screens.get(screen_id)
+            if existing is not None and not _same_screen(existing, screen):
+                new_id = f"{screen_id}_t{tile_number}"
+                suffix = 2
+                while new_id in screens:
+                    new_id, suffix = f"{screen_id}_t{tile_number}_{suffix}", suffix + 1
+                # Transitions of the tile refer to its first screen with that ID
+                renamed.setdefault(screen_id, new_id)
+                screen = dict(screen, id=new_id)
+                existing = None
+            if existing is None:
+                screens[screen["id"]] = dict(screen)
+            else:
+                _merge_screen(existing, screen)
+
+        for transition in layout.get("transitions", []) or []:
+            if not isinstance(transition, dict):
+                continue
+            transition = dict(transition)
+            for key in ("from_screen", "to_screen"):
+                if transition.get(key) in renamed:
+                    transition[key] = renamed[transition[key]]
+            fingerprint = tuple(transition.get(k) for k in ("from_screen", "to_screen", "trigger_element", "action"))
+            if fingerprint not in seen_transitions:
+                seen_transitions.add(fingerprint)
+                transitions.append(transition)
+
+    return {"screens": list(screens.values()), "transitions": transitions}
+
+def _same_screen(a: Dict, b: Dict) -> bool:
+    text_a = {str(t) for t in a.get("text_content") or []}
+    text_b = {str(t) for t in b.get("text_content") or []}
+    if not text_a or not text_b:
+        return True
+    return bool(text_a & text_b)
+
+def _merge_screen(target: Dict, other: Dict) -> None:
+    text = list(target.get("text_content") or [])
+    text.extend(t for t in other.get("text_content") or [] if t not in text)
+    target["text_content"] = text
+
+    annotations = list(target.get("annotations") or [])
+    known = {(a.get("number"), a.get("explanation")) for a in annotations if isinstance(a, dict)}
+    for annotation in other.get("annotations") or []:
+        if isinstance(annotation, dict) and (annotation.get("number"), annotation.get("explanation")) not in known:
+            annotations.append(annotation)
+    target["annotations"] = annotations
+
+    if len(other.get("description") or "") > len(target.get("description") or ""):
+        target["description"] = other["description"]
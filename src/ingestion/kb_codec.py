@@ -0,0 +1,229 @@
+import json
+import zlib
+import base64
+import sqlite3
+import struct
+import logging
+import threading
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PAYLOAD_ENCODINGS = ("json", "zlib", "zstd", "msgpack")
+EMBEDDING_DTYPES = ("float32", "float16", "int8")
+
+# First byte of binary screens/transitions payloads; TEXT values are plain JSON
+_MSGPACK, _ZLIB, _ZSTD = b"\x01", b"\x02", b"\x03"
+# Quantized embeddings carry a tag; untagged blobs are raw float32 (every KB before this encoding)
+_F16, _I8 = b"EF16", b"EI08"
+
+def compact_json(value: Any) -> str:
+    """JSON without padding and with UTF-8 text instead of \\uXXXX escapes (a Hangul syllable is 3 bytes, not 6)."""
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+def encode_embedding(vector: np.ndarray, dtype: str = "float32") -> bytes:
+    """
+    Serialize one L2-normalized embedding.
+    Args:
+        vector (np.ndarray): The embedding.
+        dtype (str): "float32" (raw), "float16" or "int8" (symmetric, one float32 scale per vector).
+    Returns:
+        bytes: The BLOB stored in screenshots.embedding.
+    """
+    vector = np.asarray(vector, dtype="float32").reshape(-1)
+    if dtype == "float32":
+        return vector.tobytes()
+    if dtype == "float16":
+        return _F16 + vector.astype("float16").tobytes()
+    if dtype == "int8":
+        scale = float(np.abs(vector).max()) / 127 or 1.0
+        quantized = np.clip(np.rint(vector / scale), -127, 127).astype("int8")
+        return _I8 + struct.pack("<f", scale) + quantized.tobytes()
+    raise ValueError(f"Unknown embedding dtype {dtype!r}, expected one of {EMBEDDING_DTYPES}")
+
+def decode_embedding(blob: bytes, dim: int) -> Optional[np.ndarray]:
+    """
+    Read an embedding BLOB in any of the supported formats.
+    Returns:
+        Optional[np.ndarray]: float32 vector, or None if the BLOB does not hold a `dim`-sized vector.
+    """
+    if len(blob) == 4 * dim:
+        return np.frombuffer(blob, dtype="float32")
+    if len(blob) == 4 + 2 * dim and blob[:4] == _F16:
+        return np.frombuffer(blob, dtype="float16", offset=4).astype("float32")
+    if len(blob) == 8 + dim and blob[:4] == _I8:
+        scale = struct.unpack("<f", blob[4:8])[0]
+        return np.frombuffer(blob, dtype="int8", offset=8).astype("float32") * scale
+    return None
+
+def decode_embeddings(blobs: Iterable[bytes], dim: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Decode many BLOBs into one matrix.
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (positions of the readable BLOBs, float32 matrix of their vectors).
+    """
+    blobs = list(blobs)
+    if blobs and all(len(blob) == 4 * dim for blob in blobs):
+        # Plain float32 KB: one copy instead of one array per row
+        matrix = np.frombuffer(b"".join(blobs), dtype="float32").reshape(len(blobs), dim)
+        return np.arange(len(blobs)), matrix
+    positions, vectors = [], []
+    for position, blob in enumerate(blobs):
+        vector = decode_embedding(blob, dim)
+        if vector is not None:
+            positions.append(position)
+            vectors.append(vector)
+    if not vectors:
+        return np.zeros(0, dtype="int64"), np.zeros((0, dim), dtype="float32")
+    return np.array(positions), np.vstack(vectors).astype("float32")
+
+class KBCodec:
+    """
+    Encoding of the screens/transitions payloads and embeddings of a KB file.
+    Reading is format-agnostic: JSON text, msgpack, zlib or zstd blobs (with a
+    shared dictionary from kb_dictionaries) and float32/float16/int8 embeddings
+    can all sit in the same table, so switching encodings needs no rewrite.
+    Writing uses the encodings configured under kb.storage.
+    """
+
+    def __init__(self, config: dict, db_path=None):
+        storage = config["kb"].get("storage", {})
+        self.payload_encoding = storage.get("payload_encoding", "json")
+        self.embedding_dtype = storage.get("embedding_dtype", "float32")
+        self.sidecar_embeddings = storage.get("sidecar_embeddings", "list")
+        self.compression_level = storage.get("compression_level", 9)
+        if self.payload_encoding not in PAYLOAD_ENCODINGS:
+            raise ValueError(f"Unknown kb.storage.payload_encoding {self.payload_encoding!r}")
+        if self.embedding_dtype not in EMBEDDING_DTYPES:
+            raise ValueError(f"Unknown kb.storage.embedding_dtype {self.embedding_dtype!r}")
+        self.db_path = db_path or config["kb"]["sqlite_db_path"]
+        self._dictionaries: Dict[int, bytes] = {}
+        self._current: Dict[str, int] = {}  # encoding -> newest dictionary id
+        self._lock = threading.Lock()
+        self._load_dictionaries()
+
+    def _load_dictionaries(self) -> None:
+        try:
+            conn = sqlite3.connect(self.db_path)
+        except sqlite3.Error:
+            return
+        try:
+            rows = conn.execute("SELECT id, encoding, data FROM kb_dictionaries ORDER BY id").fetchall()
+        except sqlite3.OperationalError:
+            rows = []  # Not migrated yet
+        finally:
+            conn.close()
+        with self._lock:
+            for dictionary_id, encoding, data in rows:
+                self._dictionaries[dictionary_id] = data
+                self._current[encoding] = dictionary_id
+
+    def _dictionary(self, dictionary_id: int) -> bytes:
+        if dictionary_id not in self._dictionaries:
+            self._load_dictionaries()  # Trained by another process since we started
+        if dictionary_id not in self._dictionaries:
+            raise ValueError(f"Payload needs compression dictionary {dictionary_id}, which is not in kb_dictionaries")
+        return self._dictionaries[dictionary_id]
+
+    def add_dictionary(self, conn: sqlite3.Connection, encoding: str, data: bytes) -> int:
+        """
+        Store a shared compression dictionary; later writes of that encoding use it.
+        """
+        dictionary_id = conn.execute(
+            "INSERT INTO kb_dictionaries (encoding, data) VALUES (?, ?)", (encoding, data)
+        ).lastrowid
+        with self._lock:
+            self._dictionaries[dictionary_id] = data
+            self._current[encoding] = dictionary_id
+        return dictionary_id
+
+    def train_dictionary(self, samples, size: int = 32 * 1024) -> bytes:
+        """
+        Build a shared dictionary for the configured payload encoding from sample payloads.
+        Args:
+            samples: Decoded screens/transitions values.
+            size (int): Dictionary size in bytes (zlib uses at most 32 KiB).
+        """
+        encoded = [compact_json(sample).encode("utf-8") for sample in samples]
+        if self.payload_encoding == "zstd":
+            import zstandard
+            return zstandard.train_dictionary(size, encoded).as_bytes()
+        # zlib: a preset window of typical content, most frequent payloads last (closest to the data)
+        counts: Dict[bytes, int] = {}
+        for sample in encoded:
+            counts[sample] = counts.get(sample, 0) + 1
+        dictionary = b""
+        for sample in sorted(counts, key=lambda s: (counts[s], -len(s))):
+            dictionary += sample
+        return dictionary[-min(size, 32 * 1024):]
+
+    def encode_payload(self, value: Any):
+        """
+        Serialize a screens/transitions value for its TEXT/BLOB column.
+        """
+        if self.payload_encoding == "json":
+            return compact_json(value)
+        if self.payload_encoding == "msgpack":
+            import msgpack
+            return _MSGPACK + msgpack.packb(value, use_bin_type=True)
+        text = compact_json(value).encode("utf-8")
+        dictionary_id = self._current.get(self.payload_encoding, 0)
+        header = struct.pack(">H", dictionary_id)
+        if self.payload_encoding == "zlib":
+            compressor = zlib.compressobj(self.compression_level, zlib.DEFLATED, -15,
+                                          **({"zdict": self._dictionary(dictionary_id)} if dictionary_id else {}))
+            return _ZLIB + header + compressor.compress(text) + compressor.flush()
+        import zstandard
+        dictionary = zstandard.ZstdCompressionDict(self._dictionary(dictionary_id)) if dictionary_id else None
+        compressor = zstandard.ZstdCompressor(level=self.compression_level, dict_data=dictionary)
+        return _ZSTD + header + compressor.compress(text)
+
+    def decode_payload(self, value) -> Any:
+        """
+        Read a screens/transitions column value in any supported format; NULL reads as [].
+        """
+        if not value:
+            return []
+        if isinstance(value, str):
+            return json.loads(value)
+        value = bytes(value)
+        tag = value[:1]
+        if tag == _MSGPACK:
+            import msgpack
+            return msgpack.unpackb(value[1:], raw=False)
+        dictionary_id = struct.unpack(">H", value[1:3])[0]
+        if tag == _ZLIB:
+            decompressor = zlib.decompressobj(-15, **({"zdict": self._dictionary(dictionary_id)} if dictionary_id else {}))
+            return json.loads(decompressor.decompress(value[3:]) + decompressor.flush())
+        if tag == _ZSTD:
+            import zstandard
+            dictionary = zstandard.ZstdCompressionDict(self._dictionary(dictionary_id)) if dictionary_id else None
+            return json.loads(zstandard.ZstdDecompressor(dict_data=dictionary).decompress(value[3:]))
+        raise ValueError(f"Unknown payload encoding tag {tag!r}")
+
+    def encode_embedding(self, vector: np.ndarray) -> bytes:
+        return encode_embedding(vector, self.embedding_dtype)
+
+    def sidecar_embedding(self, vector: Optional[np.ndarray]):
+        """
+        Embedding as written to the JSONL sidecar: a float list, base64 of the stored BLOB, or omitted.
+        """
+        if vector is None or self.sidecar_embeddings == "omit":
+            return None
+        if self.sidecar_embeddings == "base64":
+            return base64.b64encode(self.encode_embedding(vector)).decode("ascii")
+        return np.asarray(vector, dtype="float32").reshape(-1).tolist()
+
+    def register(self, conn: sqlite3.Connection) -> None:
+        """
+        Add kb_json(value) to a connection: the JSON text of an encoded payload.
+        The FTS and screen-graph triggers read screens/transitions through it,
+        so every connection that writes screenshots needs it.
+        """
+        def kb_json(value):
+            if value is None or isinstance(value, str):
+                return value
+            return compact_json(self.decode_payload(value))
+        conn.create_function("kb_json", 1, kb_json, deterministic=True)
@@ -0,0 +1,509 @@
+import json
+import logging
+import sqlite3
+from typing import Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Scalar columns of `screenshots`, in the order KB readers return them
+SCREENSHOT_COLUMNS = (
+    "id", "filename", "feature_name", "image_path", "width", "height", "version", "status",
+    "gherkin", "rejection_reason", "comment", "created_at", "generation_fingerprint",
+)
+
+# List fields of a record, each stored one row per item in a child table
+CHILD_TABLES = {
+    "gestures": ("screenshot_gestures", ("type", "target", "bbox", "confidence")),
+    "conditions": ("screenshot_conditions", ("condition",)),
+    "errors": ("screenshot_errors", ("message",)),
+    "languages": ("screenshot_languages", ("lang",)),
+    "text": ("screenshot_texts", ("text", "lang", "bbox")),
+}
+
+# Columns that feedback/generation may update; everything else is owned by ingestion
+UPDATABLE_COLUMNS = {"status", "gherkin", "rejection_reason", "comment", "version", "feature_name",
+                     "generation_fingerprint"}
+
+def _v1_base_table(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS screenshots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            filename TEXT NOT NULL,
+            feature_name TEXT,
+            screens TEXT,
+            transitions TEXT,
+            image_path TEXT,
+            version INTEGER DEFAULT 1,
+            status TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            embedding BLOB
+        )
+        """
+    )
+    # KB files from before versioned migrations miss some of these
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(screenshots)")}
+    for column, ddl in (("screens", "TEXT"), ("transitions", "TEXT"), ("image_path", "TEXT"),
+                        ("version", "INTEGER DEFAULT 1"), ("status", "TEXT"), ("created_at", "DATETIME"),
+                        ("embedding", "BLOB")):
+        if column not in existing:
+            conn.execute(f"ALTER TABLE screenshots ADD COLUMN {column} {ddl}")
+
+def _v2_normalize(conn: sqlite3.Connection) -> None:
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(screenshots)")}
+    for column, ddl in (("width", "INTEGER"), ("height", "INTEGER"), ("gherkin", "TEXT"),
+                        ("rejection_reason", "TEXT"), ("comment", "TEXT")):
+        if column not in existing:
+            conn.execute(f"ALTER TABLE screenshots ADD COLUMN {column} {ddl}")
+
+    # Statement by statement: executescript() would commit the migration transaction early
+    ddl = """
+        CREATE TABLE IF NOT EXISTS screenshot_gestures (
+            screenshot_id INTEGER NOT NULL REFERENCES screenshots(id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            type TEXT,
+            target TEXT,
+            bbox TEXT,
+            confidence REAL,
+            PRIMARY KEY (screenshot_id, position)
+        );
+        CREATE TABLE IF NOT EXISTS screenshot_conditions (
+            screenshot_id INTEGER NOT NULL REFERENCES screenshots(id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            condition TEXT NOT NULL,
+            PRIMARY KEY (screenshot_id, position)
+        );
+        CREATE TABLE IF NOT EXISTS screenshot_errors (
+            screenshot_id INTEGER NOT NULL REFERENCES screenshots(id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            message TEXT NOT NULL,
+            PRIMARY KEY (screenshot_id, position)
+        );
+        CREATE TABLE IF NOT EXISTS screenshot_languages (
+            screenshot_id INTEGER NOT NULL REFERENCES screenshots(id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            lang TEXT NOT NULL,
+            PRIMARY KEY (screenshot_id, position)
+        );
+        CREATE TABLE IF NOT EXISTS screenshot_texts (
+            screenshot_id INTEGER NOT NULL REFERENCES screenshots(id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            text TEXT,
+            lang TEXT,
+            bbox TEXT,
+            PRIMARY KEY (screenshot_id, position)
+        );
+        CREATE INDEX IF NOT EXISTS idx_screenshots_feature_name ON screenshots(feature_name);
+        CREATE INDEX IF NOT EXISTS idx_screenshots_status ON screenshots(status);
+        CREATE INDEX IF NOT EXISTS idx_screenshots_version ON screenshots(version);
+        CREATE INDEX IF NOT EXISTS idx_screenshots_feature_status ON screenshots(feature_name, status);
+        CREATE INDEX IF NOT EXISTS idx_gestures_type ON screenshot_gestures(type);
+        CREATE INDEX IF NOT EXISTS idx_conditions_condition ON screenshot_conditions(condition);
+        CREATE INDEX IF NOT EXISTS idx_errors_message ON screenshot_errors(message);
+        CREATE INDEX IF NOT EXISTS idx_languages_lang ON screenshot_languages(lang);
+    """
+    for statement in ddl.split(";"):
+        if statement.strip():
+            conn.execute(statement)
+
+    # Move the JSON list columns of older KB files into the child tables, then drop them
+    legacy = {"gestures": "gesture", "conditions": "conditions", "errors": "errors",
+              "languages": "languages", "text": "text"}
+    legacy = {field: column for field, column in legacy.items() if column in existing}
+    if not legacy:
+        return
+    rows = conn.execute(f"SELECT id, {', '.join(legacy.values())} FROM screenshots").fetchall()
+    for row in rows:
+        record = {}
+        for field, value in zip(legacy, row[1:]):
+            try:
+                record[field] = json.loads(value) if value else []
+            except (TypeError, json.JSONDecodeError):
+                logger.warning(f"Dropping unreadable {field} of screenshot {row[0]}")
+                record[field] = []
+        write_children(conn, [(row[0], record)])
+    for column in legacy.values():
+        conn.execute(f"ALTER TABLE screenshots DROP COLUMN {column}")
+    logger.info(f"Moved {', '.join(legacy.values())} of {len(rows)} screenshots into child tables")
+
+def _v3_keyset_index(conn: sqlite3.Connection) -> None:
+    # Listings page on (created_at, id); a column added by ALTER has no default, so fill the gaps
+    conn.execute("UPDATE screenshots SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_screenshots_created ON screenshots(created_at, id)")
+    # Filtered listings need the filter columns first, or every page sorts the whole match set;
+    # these indexes also serve plain feature_name/status lookups
+    for name, columns in (("feature_created", "feature_name, created_at, id"),
+                          ("status_created", "status, created_at, id"),
+                          ("feature_status_created", "feature_name, status, created_at, id")):
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_screenshots_{name} ON screenshots({columns})")
+    for name in ("feature_name", "status", "feature_status"):
+        conn.execute(f"DROP INDEX IF EXISTS idx_screenshots_{name}")
+
+# Columns whose change makes cached records stale (embedding backfills do not)
+_VERSIONED_COLUMNS = ("filename", "feature_name", "screens", "transitions", "image_path", "width", "height",
+                      "version", "status", "gherkin", "rejection_reason", "comment", "created_at")
+
+def _v4_data_version(conn: sqlite3.Connection) -> None:
+    # A counter every process can poll to tell whether its cached records are stale
+    conn.execute("CREATE TABLE IF NOT EXISTS kb_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+    conn.execute("INSERT OR IGNORE INTO kb_meta (key, value) VALUES ('data_version', 0)")
+    bump = "UPDATE kb_meta SET value = value + 1 WHERE key = 'data_version';"
+    for name, event in (("insert", "INSERT"), ("delete", "DELETE"),
+                        ("update", f"UPDATE OF {', '.join(_VERSIONED_COLUMNS)}")):
+        conn.execute(
+            f"CREATE TRIGGER IF NOT EXISTS trg_screenshots_{name}_version AFTER {event} ON screenshots "
+            f"BEGIN {bump} END"
+        )
+
+# Full-text columns of screenshots_fts, in order; the row ID is screenshots.id
+FTS_COLUMNS = ("feature_name", "screen_text", "annotations", "transitions", "gherkin")
+
+def _json_text(column: str, condition: str) -> str:
+    # Text values anywhere in a JSON column matching `condition`; unreadable JSON counts as empty
+    return (
+        f"SELECT value FROM json_tree(CASE WHEN json_valid({column}) THEN {column} ELSE '[]' END) "
+        f"WHERE type = 'text' AND ({condition})"
+    )
+
+def _payload(column: str, decode: bool) -> str:
+    # From schema v7 on, screens/transitions may be binary-encoded and are read through kb_json()
+    return f"kb_json({column})" if decode else column
+
+def _fts_insert(where: str, decode: bool = False) -> str:
+    screens, transitions = _payload("s.screens", decode), _payload("s.transitions", decode)
+    # The layout's text plus OCR rows of the text child table; UNION keeps each distinct line once,
+    # so text the metadata builder copied from text_content into `text` is not indexed twice
+    screen_text = (
+        _json_text(
+            screens,
+            # json_tree quotes some keys in paths: $[0]."text_content"
+            "path LIKE '%.text_content' OR path LIKE '%.\"text_content\"' OR key IN ('text_content', 'description')"
+        )
+        + " UNION SELECT t.text FROM screenshot_texts t WHERE t.screenshot_id = s.id AND t.text IS NOT NULL"
+    )
+    annotations = _json_text(screens, "key = 'explanation'")
+    transitions = _json_text(transitions, "key IN ('trigger_element', 'action', 'condition')")
+    values = ["s.feature_name"] + [
+        f"(SELECT group_concat(value, char(10)) FROM ({query}))" for query in (screen_text, annotations, transitions)
+    ] + ["s.gherkin"]
+    return (
+        f"INSERT INTO screenshots_fts (rowid, {', '.join(FTS_COLUMNS)}) "
+        f"SELECT s.id, {', '.join(values)} FROM screenshots s WHERE {where};"
+    )
+
+def _fts_mark(screenshot_id: str) -> str:
+    return f"INSERT OR IGNORE INTO screenshots_fts_dirty (screenshot_id) VALUES ({screenshot_id});"
+
+def _fts_triggers() -> Dict[str, str]:
+    # Writes only mark the screenshot dirty, an O(1) step per row; refresh_fulltext() then rebuilds each
+    # dirty FTS row once, after the screenshots row and all of its text rows are in place
+    return {
+        "trg_screenshots_fts_insert": f"AFTER INSERT ON screenshots BEGIN {_fts_mark('NEW.id')} END",
+        "trg_screenshots_fts_update": (
+            f"AFTER UPDATE OF feature_name, screens, transitions, gherkin ON screenshots BEGIN {_fts_mark('NEW.id')} END"
+        ),
+        "trg_screenshots_fts_delete": (
+            "AFTER DELETE ON screenshots BEGIN DELETE FROM screenshots_fts WHERE rowid = OLD.id; "
+            "DELETE FROM screenshots_fts_dirty WHERE screenshot_id = OLD.id; END"
+        ),
+        "trg_screenshot_texts_fts_insert": (
+            f"AFTER INSERT ON screenshot_texts BEGIN {_fts_mark('NEW.screenshot_id')} END"
+        ),
+        "trg_screenshot_texts_fts_delete": (
+            f"AFTER DELETE ON screenshot_texts BEGIN {_fts_mark('OLD.screenshot_id')} END"
+        ),
+    }
+
+def _create_fts_dirty(conn: sqlite3.Connection) -> None:
+    conn.execute("CREATE TABLE IF NOT EXISTS screenshots_fts_dirty (screenshot_id INTEGER PRIMARY KEY)")
+
+def _v5_fulltext(conn: sqlite3.Connection) -> None:
+    # Trigram tokens match substrings, so Korean words with attached particles and
+    # English words are found alike; matching is case-insensitive
+    conn.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS screenshots_fts USING fts5({', '.join(FTS_COLUMNS)}, tokenize = 'trigram')"
+    )
+    _create_fts_dirty(conn)
+    for name, body in _fts_triggers().items():
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+    conn.execute("DELETE FROM screenshots_fts")
+    conn.execute(_fts_insert("1"))
+
+def _graph_inserts(where: str, decode: bool = False) -> List[str]:
+    screens, transitions = _payload("s.screens", decode), _payload("s.transitions", decode)
+    screens = f"json_each(CASE WHEN json_valid({screens}) THEN {screens} ELSE '[]' END)"
+    transitions = f"json_each(CASE WHEN json_valid({transitions}) THEN {transitions} ELSE '[]' END)"
+    return [
+        f"""INSERT OR IGNORE INTO screen_nodes (screenshot_id, screen_id, description)
+        SELECT s.id, json_extract(n.value, '$.id'), json_extract(n.value, '$.description')
+        FROM screenshots s, {screens} n
+        WHERE {where} AND n.type = 'object' AND json_extract(n.value, '$.id') IS NOT NULL;""",
+        f"""INSERT INTO screen_edges (screenshot_id, position, from_screen, to_screen, trigger_element, action, condition)
+        SELECT s.id, e.key, json_extract(e.value, '$.from_screen'), json_extract(e.value, '$.to_screen'),
+               json_extract(e.value, '$.trigger_element'), json_extract(e.value, '$.action'),
+               json_extract(e.value, '$.condition')
+        FROM screenshots s, {transitions} e
+        WHERE {where} AND e.type = 'object'
+          AND json_extract(e.value, '$.from_screen') IS NOT NULL AND json_extract(e.value, '$.to_screen') IS NOT NULL;""",
+    ]
+
+def _graph_refresh(screenshot_id: str, decode: bool) -> str:
+    return (
+        f"DELETE FROM screen_nodes WHERE screenshot_id = {screenshot_id}; "
+        f"DELETE FROM screen_edges WHERE screenshot_id = {screenshot_id}; "
+        + " ".join(_graph_inserts(f"s.id = {screenshot_id}", decode))
+    )
+
+def _graph_triggers(decode: bool) -> Dict[str, str]:
+    return {
+        "trg_screenshots_graph_insert": f"AFTER INSERT ON screenshots BEGIN {_graph_refresh('NEW.id', decode)} END",
+        "trg_screenshots_graph_update": (
+            f"AFTER UPDATE OF screens, transitions ON screenshots BEGIN {_graph_refresh('NEW.id', decode)} END"
+        ),
+        "trg_screenshots_graph_delete": (
+            "AFTER DELETE ON screenshots BEGIN "
+            "DELETE FROM screen_nodes WHERE screenshot_id = OLD.id; "
+            "DELETE FROM screen_edges WHERE screenshot_id = OLD.id; END"
+        ),
+    }
+
+def _v6_screen_graph(conn: sqlite3.Connection) -> None:
+    # screens/transitions JSON materialized as a graph: one node per (screenshot, screen), one edge per transition
+    ddl = """
+        CREATE TABLE IF NOT EXISTS screen_nodes (
+            screenshot_id INTEGER NOT NULL REFERENCES screenshots(id) ON DELETE CASCADE,
+            screen_id TEXT NOT NULL,
+            description TEXT,
+            PRIMARY KEY (screenshot_id, screen_id)
+        );
+        CREATE TABLE IF NOT EXISTS screen_edges (
+            screenshot_id INTEGER NOT NULL REFERENCES screenshots(id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            from_screen TEXT NOT NULL,
+            to_screen TEXT NOT NULL,
+            trigger_element TEXT,
+            action TEXT,
+            condition TEXT,
+            PRIMARY KEY (screenshot_id, position)
+        );
+        CREATE INDEX IF NOT EXISTS idx_screen_nodes_screen ON screen_nodes(screen_id);
+        CREATE INDEX IF NOT EXISTS idx_screen_edges_from ON screen_edges(from_screen, to_screen);
+        CREATE INDEX IF NOT EXISTS idx_screen_edges_to ON screen_edges(to_screen, from_screen)
+    """
+    for statement in ddl.split(";"):
+        if statement.strip():
+            conn.execute(statement)
+    for name, body in _graph_triggers(decode=False).items():
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+    conn.execute("DELETE FROM screen_nodes")
+    conn.execute("DELETE FROM screen_edges")
+    for statement in _graph_inserts("1"):
+        conn.execute(statement)
+
+def _v7_encoded_payloads(conn: sqlite3.Connection) -> None:
+    # Shared compression dictionaries for binary payloads (see src/ingestion/kb_codec.py)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS kb_dictionaries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            encoding TEXT NOT NULL,
+            data BLOB NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    # Derived tables now read screens/transitions through kb_json(), which every writing connection registers
+    for name, body in derived_triggers().items():
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.execute(f"CREATE TRIGGER {name} {body}")
+
+def _v8_generation_fingerprint(conn: sqlite3.Connection) -> None:
+    # Inputs the stored Gherkin was generated from (see GherkinGenerator.fingerprint); NULL = never generated
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(screenshots)")}
+    if "generation_fingerprint" not in existing:
+        conn.execute("ALTER TABLE screenshots ADD COLUMN generation_fingerprint TEXT")
+    # Cached records carry the fingerprint too, so writing it alone must also bump data_version
+    columns = _VERSIONED_COLUMNS + ("generation_fingerprint",)
+    conn.execute("DROP TRIGGER IF EXISTS trg_screenshots_update_version")
+    conn.execute(
+        f"CREATE TRIGGER trg_screenshots_update_version AFTER UPDATE OF {', '.join(columns)} ON screenshots "
+        "BEGIN UPDATE kb_meta SET value = value + 1 WHERE key = 'data_version'; END"
+    )
+
+def _v9_image_embedding(conn: sqlite3.Connection) -> None:
+    # Image vectors live apart from the text `embedding`: the two encoders do not share a vector space
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(screenshots)")}
+    if "image_embedding" not in existing:
+        conn.execute("ALTER TABLE screenshots ADD COLUMN image_embedding BLOB")
+
+def _v10_fulltext_dirty(conn: sqlite3.Connection) -> None:
+    # The FTS triggers rebuilt the whole row once per screenshot_texts row; they now only mark it dirty
+    _create_fts_dirty(conn)
+    for name, body in _fts_triggers().items():
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.execute(f"CREATE TRIGGER {name} {body}")
+    # Re-index without the duplicated text lines
+    conn.execute("DELETE FROM screenshots_fts")
+    conn.execute(_fts_insert("1", decode=True))
+
+MIGRATIONS: List[Callable[[sqlite3.Connection], None]] = [
+    _v1_base_table,
+    _v2_normalize,
+    _v3_keyset_index,
+    _v4_data_version,
+    _v5_fulltext,
+    _v6_screen_graph,
+    _v7_encoded_payloads,
+    _v8_generation_fingerprint,
+    _v9_image_embedding,
+    _v10_fulltext_dirty,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """
+    Bring a KB file up to SCHEMA_VERSION, one migration per PRAGMA user_version step.
+    Each step runs in its own transaction, so a failed migration leaves the previous version intact.
+    Args:
+        conn (sqlite3.Connection): Connection to the KB file.
+    Returns:
+        int: The schema version after migrating.
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return version
+    for target in range(version + 1, SCHEMA_VERSION + 1):
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have migrated while we waited for the lock
+            current = conn.execute("PRAGMA user_version").fetchone()[0]
+            if current < target:
+                MIGRATIONS[target - 1](conn)
+                conn.execute(f"PRAGMA user_version = {target}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        logger.info(f"KB schema at version {target}")
+    return SCHEMA_VERSION
+
+def derived_triggers() -> Dict[str, str]:
+    """
+    Triggers that keep screenshots_fts and the screen graph in step with screenshots, by name.
+    """
+    return {**_fts_triggers(), **_graph_triggers(decode=True)}
+
+def rebuild_derived(conn: sqlite3.Connection) -> None:
+    """
+    Recompute screenshots_fts, screen_nodes and screen_edges from every screenshots row at once.
+    Bulk loads drop derived_triggers() first and call this instead of paying for the triggers row by row.
+    Args:
+        conn (sqlite3.Connection): Connection with kb_json registered, inside the loading transaction.
+    """
+    for table in ("screenshots_fts", "screenshots_fts_dirty", "screen_nodes", "screen_edges"):
+        conn.execute(f"DELETE FROM {table}")
+    conn.execute(_fts_insert("1", decode=True))
+    for statement in _graph_inserts("1", decode=True):
+        conn.execute(statement)
+
+def refresh_fulltext(conn: sqlite3.Connection) -> int:
+    """
+    Rebuild the screenshots_fts rows the triggers marked dirty, once each, and clear the marks.
+    KBWriter and KBService call it before committing their writes; text searches call it first,
+    which picks up rows written by any other writer.
+    Args:
+        conn (sqlite3.Connection): Connection with kb_json registered, inside a write transaction.
+    Returns:
+        int: Number of screenshots refreshed.
+    """
+    ids = [row[0] for row in conn.execute("SELECT screenshot_id FROM screenshots_fts_dirty")]
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        placeholders = ",".join("?" * len(chunk))
+        conn.execute(f"DELETE FROM screenshots_fts WHERE rowid IN ({placeholders})", chunk)
+        conn.execute(_fts_insert(f"s.id IN ({placeholders})", decode=True), chunk)
+        conn.execute(f"DELETE FROM screenshots_fts_dirty WHERE screenshot_id IN ({placeholders})", chunk)
+    return len(ids)
+
+def data_version(conn: sqlite3.Connection) -> int:
+    """
+    Counter bumped by triggers on every screenshots insert, delete and (non-embedding) update.
+    """
+    return conn.execute("SELECT value FROM kb_meta WHERE key = 'data_version'").fetchone()[0]
+
+def _child_values(field: str, item) -> tuple:
+    if field == "gestures":
+        item = item if isinstance(item, dict) else {"type": str(item)}
+        bbox = item.get("bbox")
+        return (item.get("type"), item.get("target"), json.dumps(bbox) if bbox is not None else None,
+                item.get("confidence"))
+    if field == "text":
+        item = item if isinstance(item, dict) else {"text": str(item)}
+        bbox = item.get("bbox")
+        return (item.get("text"), item.get("lang"), json.dumps(bbox) if bbox is not None else None)
+    return (item if isinstance(item, str) else json.dumps(item, ensure_ascii=False),)
+
+def write_children(conn: sqlite3.Connection, records: Iterable) -> None:
+    """
+    Replace the child-table rows of each (screenshot_id, record) pair.
+    Must run inside the caller's transaction.
+    """
+    records = list(records)
+    ids = [(screenshot_id,) for screenshot_id, _ in records]
+    for field, (table, columns) in CHILD_TABLES.items():
+        conn.executemany(f"DELETE FROM {table} WHERE screenshot_id = ?", ids)
+        rows = [
+            (screenshot_id, position) + _child_values(field, item)
+            for screenshot_id, record in records
+            for position, item in enumerate(record.get(field) or [])
+        ]
+        if rows:
+            placeholders = ",".join("?" * (len(columns) + 2))
+            conn.executemany(
+                f"INSERT INTO {table} (screenshot_id, position, {', '.join(columns)}) VALUES ({placeholders})",
+                rows
+            )
+
+def delete_children(conn: sqlite3.Connection, ids: List[int]) -> None:
+    for table, _ in CHILD_TABLES.values():
+        conn.executemany(f"DELETE FROM {table} WHERE screenshot_id = ?", [(i,) for i in ids])
+
+def read_children(conn: sqlite3.Connection, ids: List[int],
+                  fields: Optional[Iterable[str]] = None) -> Dict[int, Dict[str, list]]:
+    """
+    Child-table lists of many screenshots, one query per table.
+    Args:
+        fields (Iterable[str]): Only read these list fields; default all of CHILD_TABLES.
+    Returns:
+        Dict: screenshot_id -> {"gestures": [...], "conditions": [...], ...}
+    """
+    fields = list(CHILD_TABLES) if fields is None else list(fields)
+    children = {i: {field: [] for field in fields} for i in ids}
+    for start in range(0, len(ids), 900):
+        chunk = ids[start:start + 900]
+        placeholders = ",".join("?" * len(chunk))
+        for field in fields:
+            table, columns = CHILD_TABLES[field]
+            cursor = conn.execute(
+                f"SELECT screenshot_id, {', '.join(columns)} FROM {table} "
+                f"WHERE screenshot_id IN ({placeholders}) ORDER BY screenshot_id, position",
+                chunk
+            )
+            for row in cursor:
+                children[row[0]][field].append(_child_item(field, row[1:]))
+    return children
+
+def _child_item(field: str, values: tuple):
+    if field == "gestures":
+        kind, target, bbox, confidence = values
+        return {"type": kind, "target": target, "bbox": json.loads(bbox) if bbox else [], "confidence": confidence}
+    if field == "text":
+        text, lang, bbox = values
+        item = {"text": text, "lang": lang}
+        if bbox:
+            item["bbox"] = json.loads(bbox)
+        return item
+    return values[0]
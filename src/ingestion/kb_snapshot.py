@@ -0,0 +1,383 @@
+import os
+import json
+import shutil
+import sqlite3
+import hashlib
+import logging
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import faiss
+import numpy as np
+
+from .kb_codec import KBCodec, compact_json, decode_embeddings
+from .kb_schema import (
+    CHILD_TABLES, SCHEMA_VERSION, data_version, derived_triggers, migrate, rebuild_derived,
+)
+from .metadata_log import DELETED
+from .vector_index import EMBEDDING_COLUMNS, VectorIndex, index_kind, index_path_for
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = "kb-snapshot"
+SNAPSHOT_FORMAT_VERSION = 1
+
+# Tables copied into a snapshot, parents first. The full-text index, screen graph and
+# kb_meta are derived from these and rebuilt on import; the ingestion manifest and
+# image hashes are optional and only copied if the KB has them.
+SNAPSHOT_TABLES = (
+    ("screenshots",) + tuple(table for table, _ in CHILD_TABLES.values()) + ("ingestion_manifest", "image_hashes")
+)
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("KB snapshots need pyarrow: pip install pyarrow") from e
+    return pyarrow, pyarrow.parquet
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _replace_file(source: Path, target: Path) -> None:
+    # Copy next to the target, fsync, then swap in, so readers never see a half-written file
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = target.with_suffix(target.suffix + ".tmp")
+    shutil.copyfile(source, tmp_path)
+    with open(tmp_path, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, target)
+
+class KBSnapshot:
+    """
+    Consistent point-in-time copies of a KB as one directory:
+    one Parquet file per table, the FAISS index, the metadata sidecar and a
+    manifest.json with row counts and checksums.
+    Exports read every table inside a single SQLite read transaction (a WAL
+    snapshot, so ingestion can keep writing) and stream them in batches.
+    Imports verify the bundle, then load every table in one write transaction
+    and rebuild the full-text index and screen graph with set-based statements.
+    screens/transitions are stored as JSON text and embeddings as fixed-size
+    float32 lists, so a snapshot does not depend on kb.storage on either side.
+    """
+
+    def __init__(self, config: dict):
+        self.config = config
+        kb_config = config["kb"]
+        self.sqlite_db_path = Path(kb_config["sqlite_db_path"])
+        self.faiss_index_path = Path(kb_config["faiss_index_path"])
+        self.metadata_jsonl_path = Path(kb_config.get("metadata_jsonl_path", "data/kb/metadata.jsonl"))
+        self.dim = int(kb_config.get("embedding_dim", 768))
+        snapshot_config = kb_config.get("snapshot", {})
+        self.batch_rows = int(snapshot_config.get("batch_rows", 10000))
+        self.compression = snapshot_config.get("compression", "zstd")
+        self.codec = KBCodec(config)
+
+    def _connect(self) -> sqlite3.Connection:
+        self.sqlite_db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.sqlite_db_path, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        self.codec.register(conn)
+        migrate(conn)
+        return conn
+
+    @staticmethod
+    def _columns(conn: sqlite3.Connection, table: str) -> List[tuple]:
+        # (name, declared type) of each column, in table order
+        return [(row[1], (row[2] or "").upper()) for row in conn.execute(f"PRAGMA table_info({table})")]
+
+    def _arrow_type(self, table: str, column: str, declared: str):
+        pa, _ = _pyarrow()
+        if table == "screenshots" and column in EMBEDDING_COLUMNS:
+            return pa.list_(pa.float32(), self.dim)
+        if table == "screenshots" and column in ("screens", "transitions"):
+            return pa.string()  # JSON text, whatever kb.storage encoding the row was written with
+        if "INT" in declared:
+            return pa.int64()
+        if declared in ("REAL", "FLOAT", "DOUBLE"):
+            return pa.float64()
+        if declared == "BLOB":
+            return pa.binary()
+        return pa.string()
+
+    def _embedding_array(self, blobs: List[Optional[bytes]]):
+        pa, _ = _pyarrow()
+        present = [i for i, blob in enumerate(blobs) if blob is not None]
+        positions, matrix = decode_embeddings([blobs[i] for i in present], self.dim)
+        values = np.zeros((len(blobs), self.dim), dtype="float32")
+        missing = np.ones(len(blobs), dtype=bool)
+        rows = np.array(present, dtype="int64")[positions] if len(positions) else np.zeros(0, dtype="int64")
+        values[rows] = matrix
+        missing[rows] = False
+        return pa.FixedSizeListArray.from_arrays(pa.array(values.reshape(-1)), self.dim, mask=pa.array(missing))
+
+    def _record_batch(self, table: str, columns: List[tuple], rows: List[tuple], schema):
+        pa, _ = _pyarrow()
+        arrays = []
+        for position, (column, _) in enumerate(columns):
+            values = [row[position] for row in rows]
+            if table == "screenshots" and column in EMBEDDING_COLUMNS:
+                arrays.append(self._embedding_array(values))
+                continue
+            if table == "screenshots" and column in ("screens", "transitions"):
+                values = [value if isinstance(value, str) or value is None
+                          else compact_json(self.codec.decode_payload(value)) for value in values]
+            arrays.append(pa.array(values, type=schema.field(column).type))
+        return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+    def _export_table(self, conn: sqlite3.Connection, table: str, path: Path) -> Dict:
+        pa, pq = _pyarrow()
+        columns = self._columns(conn, table)
+        schema = pa.schema([(column, self._arrow_type(table, column, declared)) for column, declared in columns])
+        names = ", ".join(column for column, _ in columns)
+        order = " ORDER BY id" if table == "screenshots" else ""
+        cursor = conn.execute(f"SELECT {names} FROM {table}{order}")
+        count, ids = 0, []
+        with pq.ParquetWriter(path, schema, compression=self.compression) as writer:
+            while True:
+                rows = cursor.fetchmany(self.batch_rows)
+                if not rows:
+                    break
+                writer.write_batch(self._record_batch(table, columns, rows, schema))
+                count += len(rows)
+                if table == "screenshots":
+                    ids.append(np.array([row[0] for row in rows], dtype="int64"))
+        sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()[0]
+        entry = {"file": path.name, "rows": count, "columns": [column for column, _ in columns], "sql": sql}
+        if table == "screenshots":
+            entry["_ids"] = np.concatenate(ids) if ids else np.zeros(0, dtype="int64")
+        return entry
+
+    def _export_index(self, conn: sqlite3.Connection, bundle: Path) -> Optional[Dict]:
+        # The persisted index trails SQLite by up to one debounce window; only ship it if it matches the snapshot
+        if not self.faiss_index_path.exists():
+            return None
+        embedded = np.array(
+            [row[0] for row in conn.execute("SELECT id FROM screenshots WHERE embedding IS NOT NULL ORDER BY id")],
+            dtype="int64"
+        )
+        try:
+            index = faiss.read_index(str(self.faiss_index_path))
+            indexed = np.sort(faiss.vector_to_array(index.id_map)) if isinstance(index, faiss.IndexIDMap2) else None
+        except RuntimeError as e:
+            logger.warning(f"Not copying unreadable {self.faiss_index_path.name}: {e}")
+            return None
+        if indexed is None or not np.array_equal(indexed, embedded):
+            logger.warning(f"{self.faiss_index_path.name} is not in step with the snapshot, import will rebuild it")
+            return None
+        faiss.write_index(index, str(bundle / "faiss.index"))
+        return {"file": "faiss.index", "kind": index_kind(index), "vectors": int(index.ntotal)}
+
+    def _export_metadata(self, ids: np.ndarray, path: Path) -> int:
+        # Live sidecar records of the exported rows, copied byte for byte; records written after the snapshot are left out
+        latest = {}  # id -> (offset, tombstone) of its last line
+        if self.metadata_jsonl_path.exists():
+            with open(self.metadata_jsonl_path, "rb") as f:
+                offset = 0
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        entry = None  # Torn or unreadable line
+                    if isinstance(entry, dict) and isinstance(entry.get("id"), int):
+                        latest[entry["id"]] = (offset, bool(entry.get(DELETED)))
+                    offset += len(line)
+        wanted = np.array(sorted(row_id for row_id, (_, deleted) in latest.items() if not deleted), dtype="int64")
+        keep = wanted[np.isin(wanted, ids)]
+        offsets = sorted(latest[int(row_id)][0] for row_id in keep)
+        with open(self.metadata_jsonl_path, "rb") if offsets else open(os.devnull, "rb") as source, \
+                open(path, "wb") as f:
+            for offset in offsets:
+                source.seek(offset)
+                line = source.readline()
+                f.write(line if line.endswith(b"\n") else line + b"\n")
+        return len(offsets)
+
+    def export(self, bundle_dir) -> Dict:
+        """
+        Write a snapshot of the KB to a new directory.
+        Args:
+            bundle_dir: Directory to create; it must not exist yet.
+        Returns:
+            Dict: The manifest written to bundle_dir/manifest.json.
+        Raises:
+            FileExistsError: If bundle_dir already exists.
+            ImportError: If pyarrow is not installed.
+        """
+        _pyarrow()
+        bundle = Path(bundle_dir)
+        if bundle.exists():
+            raise FileExistsError(f"{bundle} already exists")
+        # Build under a temporary name so an interrupted export never looks like a snapshot
+        partial = bundle.with_name(bundle.name + ".partial")
+        if partial.exists():
+            shutil.rmtree(partial)
+        partial.mkdir(parents=True)
+        started = time.perf_counter()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN")
+            version = data_version(conn)  # First read pins the snapshot every later query sees
+            present = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            tables = {}
+            for table in SNAPSHOT_TABLES:
+                if table in present:
+                    tables[table] = self._export_table(conn, table, partial / f"{table}.parquet")
+                    logger.info(f"Exported {tables[table]['rows']} rows of {table}")
+            index = self._export_index(conn, partial)
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        ids = tables["screenshots"].pop("_ids")
+        metadata_records = self._export_metadata(ids, partial / "metadata.jsonl")
+
+        files = [entry["file"] for entry in tables.values()] + ["metadata.jsonl"] + ([index["file"]] if index else [])
+        manifest = {
+            "format": SNAPSHOT_FORMAT,
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "source": str(self.sqlite_db_path),
+            "schema_version": SCHEMA_VERSION,
+            "data_version": version,
+            "embedding_dim": self.dim,
+            "tables": tables,
+            "index": index,
+            "metadata": {"file": "metadata.jsonl", "records": metadata_records},
+            "checksums": {name: _sha256(partial / name) for name in files},
+        }
+        with open(partial / "manifest.json", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(partial, bundle)
+        logger.info(
+            f"Snapshot of {tables['screenshots']['rows']} screenshots written to {bundle} "
+            f"in {time.perf_counter() - started:.1f}s"
+        )
+        return manifest
+
+    @staticmethod
+    def read_manifest(bundle_dir) -> Dict:
+        """
+        Load and verify a snapshot's manifest and file checksums.
+        Raises:
+            ValueError: If the directory is not a snapshot this version can load, or a file does not match.
+        """
+        bundle = Path(bundle_dir)
+        try:
+            with open(bundle / "manifest.json", "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            raise ValueError(f"{bundle} is not a KB snapshot: {e}") from e
+        if manifest.get("format") != SNAPSHOT_FORMAT or manifest.get("format_version", 0) > SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"{bundle} is not a KB snapshot this version can read")
+        if manifest["schema_version"] > SCHEMA_VERSION:
+            raise ValueError(
+                f"Snapshot has KB schema {manifest['schema_version']}, this install only knows {SCHEMA_VERSION}"
+            )
+        for name, checksum in manifest["checksums"].items():
+            if not (bundle / name).exists() or _sha256(bundle / name) != checksum:
+                raise ValueError(f"{name} in {bundle} is missing or does not match the manifest")
+        return manifest
+
+    def _batches(self, bundle: Path, entry: Dict) -> Iterator:
+        _, pq = _pyarrow()
+        yield from pq.ParquetFile(bundle / entry["file"]).iter_batches(batch_size=self.batch_rows)
+
+    def _rows(self, table: str, batch) -> Iterator[tuple]:
+        columns = {name: batch.column(name) for name in batch.schema.names}
+        values = {}
+        for name, array in columns.items():
+            if table == "screenshots" and name in EMBEDDING_COLUMNS:
+                missing = array.is_null().to_numpy(zero_copy_only=False)
+                matrix = np.asarray(array.values.to_numpy(zero_copy_only=False), dtype="float32")
+                matrix = matrix[array.offset * self.dim:(array.offset + len(array)) * self.dim].reshape(-1, self.dim)
+                values[name] = [None if missing[i] else self.codec.encode_embedding(matrix[i])
+                                for i in range(len(array))]
+            elif table == "screenshots" and name in ("screens", "transitions") and self.codec.payload_encoding != "json":
+                values[name] = [None if text is None else self.codec.encode_payload(json.loads(text))
+                                for text in array.to_pylist()]
+            else:
+                values[name] = array.to_pylist()
+        return zip(*(values[name] for name in batch.schema.names))
+
+    def load(self, bundle_dir, replace: bool = False) -> Dict:
+        """
+        Load a snapshot into the configured KB in one transaction, then install its FAISS index and sidecar.
+        Stop ingestion and the backend while loading: they hold the index and sidecar open.
+        Args:
+            bundle_dir: Snapshot directory written by export().
+            replace (bool): Delete the KB's current contents first; otherwise the KB must be empty.
+        Returns:
+            Dict: Rows loaded per table.
+        Raises:
+            ValueError: If the snapshot is invalid, its embedding size differs from kb.embedding_dim,
+                or the KB is not empty and replace is False.
+            ImportError: If pyarrow is not installed.
+        """
+        _pyarrow()
+        bundle = Path(bundle_dir)
+        manifest = self.read_manifest(bundle)
+        if manifest["embedding_dim"] != self.dim:
+            raise ValueError(f"Snapshot embeddings have {manifest['embedding_dim']} dimensions, KB has {self.dim}")
+        started = time.perf_counter()
+        loaded = {}
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if not replace and conn.execute("SELECT 1 FROM screenshots LIMIT 1").fetchone():
+                    raise ValueError("KB is not empty; pass replace=True to overwrite it")
+                # Per-row trigger work would dominate a bulk load; the derived tables are rebuilt once below
+                for name in derived_triggers():
+                    conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+                present = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+                for table in reversed(SNAPSHOT_TABLES):
+                    if table in present:
+                        conn.execute(f"DELETE FROM {table}")
+                for table in SNAPSHOT_TABLES:
+                    entry = manifest["tables"].get(table)
+                    if entry is None:
+                        continue
+                    if table not in present:
+                        conn.execute(entry["sql"])
+                    unknown = set(entry["columns"]) - {column for column, _ in self._columns(conn, table)}
+                    if unknown:
+                        raise ValueError(f"Snapshot columns {sorted(unknown)} of {table} do not exist in this KB")
+                    statement = (
+                        f"INSERT INTO {table} ({', '.join(entry['columns'])}) "
+                        f"VALUES ({', '.join('?' * len(entry['columns']))})"
+                    )
+                    for batch in self._batches(bundle, entry):
+                        conn.executemany(statement, self._rows(table, batch))
+                    loaded[table] = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                    if loaded[table] != entry["rows"]:
+                        raise ValueError(f"Loaded {loaded[table]} rows of {table}, manifest lists {entry['rows']}")
+                rebuild_derived(conn)
+                for name, body in derived_triggers().items():
+                    conn.execute(f"CREATE TRIGGER {name} {body}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+        logger.info(f"Loaded {loaded.get('screenshots', 0)} screenshots in {time.perf_counter() - started:.1f}s")
+
+        _replace_file(bundle / manifest["metadata"]["file"], self.metadata_jsonl_path)
+        if manifest["index"] is not None:
+            _replace_file(bundle / manifest["index"]["file"], self.faiss_index_path)
+        elif self.faiss_index_path.exists():
+            self.faiss_index_path.unlink()
+        # The image index is not shipped; it is rebuilt from the loaded image_embedding column
+        index_path_for(self.config, "image_embedding").unlink(missing_ok=True)
+        # Loading checks the index against SQLite (and kb.faiss_index_type) and rebuilds it if needed
+        VectorIndex(self.config).close()
+        VectorIndex(self.config, column="image_embedding").close()
+        return loaded
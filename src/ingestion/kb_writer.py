@@ -1,10 +1,14 @@
 import sqlite3
+import threading
 import faiss
 import numpy as np
-import json
 import logging
 from pathlib import Path
-from typing import Dict
+from typing import Dict, List, Optional
+from .metadata_log import MetadataLog
+from .vector_index import VectorIndex
+from .kb_schema import delete_children, migrate, refresh_fulltext, write_children
+from .kb_codec import KBCodec
 
 logger = logging.getLogger(__name__)
 
@@ -13,84 +17,262 @@ class KBWriter:
         self.config = config
         self.sqlite_db_path = Path(config["kb"]["sqlite_db_path"])
         self.faiss_index_path = Path(config["kb"]["faiss_index_path"])
-        self.metadata_json_path = Path(config["kb"]["metadata_json_path"])
+        # Append-only JSONL sidecar; the legacy metadata.json is migrated on first use
+        self.metadata_log = MetadataLog(config)
+        # Encodings of screens/transitions and embeddings (kb.storage)
+        self.codec = KBCodec(config)
+        # One long-lived WAL connection; transactions are opened explicitly per batch
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._init_db()
+        self._init_faiss()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.sqlite_db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.sqlite_db_path, isolation_level=None, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("PRAGMA busy_timeout=5000")
+            self.codec.register(self._conn)
+        return self._conn
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        self.metadata_log.close()
+        self.vector_index.close()
+        self.image_index.close()
+
     def _init_db(self) -> None:
-        self.sqlite_db_path.parent.mkdir(parents=True, exist_ok=True)
-        conn = sqlite3.connect(self.sqlite_db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS screenshots (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                filename TEXT NOT NULL,
-                feature_name TEXT,
-                screens TEXT,
-                transitions TEXT,
-                image_path TEXT,
-                version INTEGER DEFAULT 1,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                embedding BLOB
-            )
-            """
-        )
-        conn.commit()
-        conn.close()
+        # Versioned migrations (PRAGMA user_version), shared with KBService
+        migrate(self._connect())
 
     def _init_faiss(self) -> None:
-        self.faiss_index_path.parent.mkdir(parents=True, exist_ok=True)
-        d = 768  # LayoutLMv3 embedding dim
-        self.index = faiss.IndexFlatIP(d)  # Inner product for cosine similarity
-        self.ids = []
+        # Loads the persisted indexes (or rebuilds them from SQLite); vector IDs are screenshots.id
+        self.vector_index = VectorIndex(self.config)
+        self.image_index = VectorIndex(self.config, column="image_embedding")
 
     def write(self, metadata: Dict) -> None:
         """
         Write metadata to SQLite + FAISS.
+        If metadata carries an existing "id", that row is updated in place
+        and its version bumped instead of inserting a new row.
         Args:
             metadata (Dict): Structured metadata to store.
         """
-        embedding = metadata.get("embedding")
-        if embedding is not None:
-            embedding = np.array(embedding, dtype='float32')
-            faiss.normalize_L2(embedding.reshape(1, -1))
-
-        # Insert into SQLite
-        conn = sqlite3.connect(self.sqlite_db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO screenshots (
-                filename, feature_name, screens, transitions, image_path, version, embedding
-            ) VALUES (?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                metadata["filename"],
-                metadata["feature_name"],
-                json.dumps(metadata["screens"]),
-                json.dumps(metadata["transitions"]),
-                metadata["image_path"],
-                metadata["version"],
-                embedding.tobytes() if embedding is not None else None
-            )
-        )
-        metadata["id"] = cursor.lastrowid
-        conn.commit()
-        conn.close()
-
-        # Add to FAISS if embedding exists
-        if embedding is not None:
-            self.index.add(embedding.reshape(1, -1))
-            self.ids.append(metadata["id"])
-            faiss.write_index(self.index, str(self.faiss_index_path))
-
-        # Save metadata to JSON
-        metadata_json = self.metadata_json_path
-        if metadata_json.exists():
-            with open(metadata_json, "r", encoding="utf-8") as f:
-                all_metadata = json.load(f)
+        self.write_batch([metadata])
+
+    def write_batch(self, records: List[Dict]) -> None:
+        """
+        Write many metadata records in one SQLite transaction, then flush
+        FAISS and the JSON sidecar once for the whole batch.
+        Records with an existing "id" are updated in place (version bump);
+        the others are inserted and get their new "id"/"version" set.
+        An update that changes screens/transitions puts the row back to
+        "pending" and clears its Gherkin and review fields.
+        Args:
+            records (List[Dict]): Structured metadata to store.
+        """
+        if not records:
+            return
+        embeddings = [self._prepare_embedding(m) for m in records]
+        image_embeddings = [self._prepare_embedding(m, "image_embedding") for m in records]
+
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                requested = [m["id"] for m in records if m.get("id") is not None]
+                versions, layouts = {}, {}
+                if requested:
+                    placeholders = ",".join("?" * len(requested))
+                    for row_id, version, screens, transitions in conn.execute(
+                        f"SELECT id, COALESCE(version, 1), screens, transitions FROM screenshots "
+                        f"WHERE id IN ({placeholders})",
+                        requested
+                    ):
+                        versions[row_id] = version
+                        layouts[row_id] = (screens, transitions)
+
+                # Explicit ids let executemany insert the whole batch while we still know every row id
+                next_id = self._next_id(conn)
+                assigned = []
+                update_rows, insert_rows, changed_layouts = [], [], []
+                for metadata, embedding, image_embedding in zip(records, embeddings, image_embeddings):
+                    values = self._row_values(metadata, embedding, image_embedding)
+                    row_id = metadata.get("id")
+                    if row_id in versions:
+                        version = versions[row_id] + 1
+                        update_rows.append(values + (version, row_id))
+                        if self._layout_changed(layouts[row_id], metadata):
+                            changed_layouts.append((row_id,))
+                    else:
+                        row_id, next_id = next_id, next_id + 1
+                        version = metadata.get("version") or 1
+                        insert_rows.append((row_id,) + values + (version,))
+                    assigned.append((row_id, version))
+
+                if update_rows:
+                    conn.executemany(
+                        """
+                        UPDATE screenshots SET
+                            filename = ?, feature_name = ?, screens = ?, transitions = ?, image_path = ?,
+                            width = ?, height = ?, embedding = ?, image_embedding = ?, version = ?
+                        WHERE id = ?
+                        """,
+                        update_rows
+                    )
+                if changed_layouts:
+                    # Gherkin and its review describe the old image; the new layout goes back to review
+                    conn.executemany(
+                        """
+                        UPDATE screenshots SET
+                            status = 'pending', gherkin = NULL, rejection_reason = NULL, comment = NULL,
+                            generation_fingerprint = NULL
+                        WHERE id = ?
+                        """,
+                        changed_layouts
+                    )
+                if insert_rows:
+                    conn.executemany(
+                        """
+                        INSERT INTO screenshots (
+                            id, filename, feature_name, screens, transitions, image_path, width, height,
+                            embedding, image_embedding, version, created_at
+                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                        """,
+                        insert_rows
+                    )
+                # Gestures, conditions, errors, languages and text live in child tables
+                write_children(conn, [(row_id, m) for m, (row_id, _) in zip(records, assigned)])
+                # One full-text refresh per record, now that its layout and text rows are both written
+                refresh_fulltext(conn)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        # Only hand out ids once the transaction is durable, so a failed batch can be retried as-is
+        for metadata, (row_id, version) in zip(records, assigned):
+            metadata["id"] = row_id
+            metadata["version"] = version
+
+        # Keep FAISS in step with the rows: replace changed vectors, drop cleared ones
+        for index, column_embeddings in ((self.vector_index, embeddings), (self.image_index, image_embeddings)):
+            vectors = [(m["id"], e) for m, e in zip(records, column_embeddings) if e is not None]
+            if vectors:
+                index.upsert([row_id for row_id, _ in vectors], np.vstack([e for _, e in vectors]))
+            index.remove([m["id"] for m, e in zip(records, column_embeddings) if e is None])
+
+        # The sidecar mirrors the text embedding only; image vectors stay in SQLite
+        sidecar = [{key: value for key, value in m.items() if key != "image_embedding"} for m in records]
+        if self.codec.sidecar_embeddings == "list":
+            self.metadata_log.append(sidecar)
         else:
-            all_metadata = []
-        all_metadata.append(metadata)
-        with open(metadata_json, "w", encoding="utf-8") as f:
-            json.dump(all_metadata, f, indent=2, ensure_ascii=False)
+            self.metadata_log.append([
+                dict(m, embedding=self.codec.sidecar_embedding(e)) for m, e in zip(sidecar, embeddings)
+            ])
+        logger.info(f"Metadata written for {len(records)} screenshots ({len(update_rows)} updated)")
+
+    def set_embeddings(self, ids: List[int], vectors: np.ndarray, column: str = "embedding") -> None:
+        """
+        Store embeddings for existing rows without bumping their version.
+        Args:
+            ids (List[int]): Screenshot IDs.
+            vectors (np.ndarray): float32 array of shape (len(ids), dim), L2-normalized.
+            column (str): "embedding" (text) or "image_embedding".
+        """
+        if not len(ids):
+            return
+        index = {"embedding": self.vector_index, "image_embedding": self.image_index}[column]
+        vectors = np.ascontiguousarray(vectors, dtype="float32").reshape(len(ids), -1)
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    f"UPDATE screenshots SET {index.column} = ? WHERE id = ?",
+                    [(self.codec.encode_embedding(vector), row_id) for row_id, vector in zip(ids, vectors)]
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        index.upsert(list(ids), vectors)
+
+    def delete(self, ids: List[int]) -> int:
+        """
+        Remove screenshots from SQLite, FAISS and the metadata log.
+        Their manifest and perceptual-hash rows are dropped too, so the
+        files are ingested again on the next run.
+        Args:
+            ids (List[int]): Screenshot IDs.
+        Returns:
+            int: Number of rows deleted.
+        """
+        ids = list(ids)
+        if not ids:
+            return 0
+        placeholders = ",".join("?" * len(ids))
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                deleted = conn.execute(f"DELETE FROM screenshots WHERE id IN ({placeholders})", ids).rowcount
+                delete_children(conn, ids)
+                refresh_fulltext(conn)
+                tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+                for table, column in (("ingestion_manifest", "screenshot_id"), ("image_hashes", "screenshot_id")):
+                    if table in tables:
+                        conn.execute(f"DELETE FROM {table} WHERE {column} IN ({placeholders})", ids)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        self.vector_index.remove(ids)
+        self.image_index.remove(ids)
+        self.metadata_log.delete(ids)
+        logger.info(f"Deleted {deleted} screenshots")
+        return deleted
+
+    @staticmethod
+    def _prepare_embedding(metadata: Dict, column: str = "embedding") -> Optional[np.ndarray]:
+        embedding = metadata.get(column)
+        if embedding is None:
+            return None
+        embedding = np.array(embedding, dtype='float32').reshape(1, -1)
+        faiss.normalize_L2(embedding)
+        return embedding
+
+    def _layout_changed(self, stored: tuple, metadata: Dict) -> bool:
+        screens, transitions = (self.codec.decode_payload(value) for value in stored)
+        return screens != metadata["screens"] or transitions != metadata["transitions"]
+
+    def _row_values(self, metadata: Dict, embedding: Optional[np.ndarray],
+                    image_embedding: Optional[np.ndarray] = None) -> tuple:
+        return (
+            metadata["filename"],
+            metadata["feature_name"],
+            self.codec.encode_payload(metadata["screens"]),
+            self.codec.encode_payload(metadata["transitions"]),
+            metadata["image_path"],
+            metadata.get("width"),
+            metadata.get("height"),
+            self.codec.encode_embedding(embedding) if embedding is not None else None,
+            self.codec.encode_embedding(image_embedding) if image_embedding is not None else None,
+        )
 
-        logger.info(f"Metadata written for {metadata['filename']}")
\ No newline at end of file
+    @staticmethod
+    def _next_id(conn: sqlite3.Connection) -> int:
+        # Respect AUTOINCREMENT's high-water mark so ids of deleted rows are never reused
+        next_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM screenshots").fetchone()[0]
+        try:
+            row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'screenshots'").fetchone()
+            if row is not None:
+                next_id = max(next_id, row[0])
+        except sqlite3.OperationalError:
+            pass  # Table created without AUTOINCREMENT
+        return next_id + 1
@@ -2,9 +2,18 @@ import ollama
 from PIL import Image
 import io
 import json
+import time
+import hashlib
+import logging
+
+from .response_cache import ResponseCache
+from .image_preprocessor import merge_layouts
+from .stream_validator import IncrementalJSONValidator, SchemaDivergence
+
+logger = logging.getLogger(__name__)
 
 # Configuration
-# Use 'qwen2.5vl:32b' (7B) for speed testing, switch to 'qwen2.5vl:32b:72b' for max accuracy
+# Default model; ingestion.cascade in settings.yaml can try a faster model first
 MODEL_NAME = "qwen2.5vl:32b" 
 
 PROMPT = """
@@ -42,17 +51,82 @@ Output strictly valid JSON with this structure:
 }
 """
 
-def process_image(image_path):
-    print(f"--- Processing {image_path} on {MODEL_NAME} ---")
+PROMPT_HASH = hashlib.sha256(PROMPT.encode("utf-8")).hexdigest()
+
+def cache_key(image_bytes, preprocessor=None, model=MODEL_NAME):
+    # Content-addressed: the same image, model, prompt and preprocessing always map to the same entry
+    parts = [hashlib.sha256(image_bytes).hexdigest(), model, PROMPT_HASH]
+    if preprocessor is not None:
+        parts.append(preprocessor.signature())
+    return ResponseCache.make_key(*parts)
+
+def process_image(image_path, cache=None, preprocessor=None, stream=False, max_chars=None, stats=None,
+                  model=MODEL_NAME):
+    """
+    Extract screens/transitions JSON from a flowchart image.
+    Args:
+        image_path (str): Path to the image.
+        cache (ResponseCache): Optional cache of previous answers.
+        preprocessor (ImagePreprocessor): Optional resize/tiling stage.
+        stream (bool): Stream tokens and validate the JSON shape as it arrives.
+        max_chars (int): Abort a streamed answer longer than this.
+        stats (dict): Optional dict filled with per-image timing
+                      (time_to_first_token, tokens_per_second, ...).
+        model (str): Ollama vision model to use.
+    Returns:
+        dict: Parsed model output, or None if the model did not return valid JSON.
+    Raises:
+        SchemaDivergence: If a streamed answer diverged from the expected schema.
+    """
+    logger.info(f"Processing {image_path} on {model}")
+    stats = stats if stats is not None else {}
+    stats["cache_hit"] = False
     
     # 1. Load image as bytes
     with open(image_path, "rb") as f:
         image_bytes = f.read()
 
-    # 2. Call Local Ollama
-    # stream=False ensures we get the full JSON at once
-    response = ollama.chat(
-        model=MODEL_NAME,
+    # Reuse a previous answer for an identical image/model/prompt
+    if cache is not None:
+        key = cache_key(image_bytes, preprocessor, model)
+        cached = cache.get(key)
+        if cached is not None:
+            logger.info(f"Vision cache hit for {image_path}")
+            stats["cache_hit"] = True
+            return cached
+
+    # Normalize resolution and split oversized flowcharts into tiles
+    images = preprocessor.prepare(image_bytes) if preprocessor is not None else [image_bytes]
+    stats["tiles"] = len(images)
+
+    # 2. Call Local Ollama once per image/tile
+    outputs = []
+    tile_stats = []
+    for tile_bytes in images:
+        tile_stat = {}
+        if stream:
+            json_output = _analyze_stream(tile_bytes, max_chars, tile_stat, model)
+        else:
+            json_output = _analyze_bytes(tile_bytes, tile_stat, model)
+        tile_stats.append(tile_stat)
+        if json_output is not None:
+            outputs.append(json_output)
+    _combine_stats(stats, tile_stats)
+    if len(outputs) < len(images):
+        # A partial merge would be cached as the whole image's answer; fail so the image is retried
+        if len(images) > 1:
+            logger.warning(f"{len(images) - len(outputs)}/{len(images)} tiles of {image_path} returned invalid JSON")
+        return None
+    json_output = outputs[0] if len(images) == 1 else merge_layouts(outputs)
+
+    # Only valid answers are cached so bad generations get another chance
+    if cache is not None:
+        cache.put(key, json_output)
+    return json_output
+
+def _chat(image_bytes, stream, model=MODEL_NAME):
+    return ollama.chat(
+        model=model,
         messages=[
             {
                 'role': 'user',
@@ -64,18 +138,82 @@ def process_image(image_path):
         options={
             'temperature': 0.1, # Keep it factual
             'num_ctx': 8192     # Vision models need high context window
-        }
+        },
+        stream=stream
     )
 
+def _analyze_bytes(image_bytes, stats, model=MODEL_NAME):
+    # stream=False ensures we get the full JSON at once
+    started = time.perf_counter()
+    response = _chat(image_bytes, stream=False, model=model)
+    elapsed = time.perf_counter() - started
+    # Ollama reports durations in nanoseconds; prompt evaluation ends at the first token
+    first_token = (response.get('load_duration') or 0) + (response.get('prompt_eval_duration') or 0)
+    stats["time_to_first_token"] = first_token / 1e9 if first_token else None
+    stats["tokens_per_second"] = _tokens_per_second(response, elapsed)
+
     # 3. Parse and Return
     try:
-        json_output = json.loads(response['message']['content'])
-        return json_output
+        return json.loads(response['message']['content'])
+    except json.JSONDecodeError:
+        logger.warning(f"Model did not return valid JSON. Raw output:\n{response['message']['content']}")
+        return None
+
+def _analyze_stream(image_bytes, max_chars, stats, model=MODEL_NAME):
+    # Validate the JSON shape token by token so a diverging answer is abandoned early
+    validator = IncrementalJSONValidator(max_chars=max_chars)
+    started = time.perf_counter()
+    first_token_at = None
+    chunks = 0
+    final = {}
+    stream = _chat(image_bytes, stream=True, model=model)
+    try:
+        for chunk in stream:
+            piece = chunk['message']['content']
+            if piece:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                chunks += 1
+                validator.feed(piece)
+            if chunk.get('done'):
+                final = chunk
+            if validator.complete:
+                break
+    except SchemaDivergence as e:
+        elapsed = time.perf_counter() - started
+        logger.warning(f"Aborted vision stream after {validator.length} chars ({elapsed:.1f}s): {e}")
+        raise
+    finally:
+        # Closing the stream drops the HTTP connection, which stops generation server-side
+        if hasattr(stream, "close"):
+            stream.close()
+    finished = time.perf_counter()
+    stats["time_to_first_token"] = first_token_at - started if first_token_at else None
+    generation_time = finished - (first_token_at or started)
+    stats["tokens_per_second"] = _tokens_per_second(final, generation_time, chunks)
+
+    try:
+        return json.loads(validator.text)
     except json.JSONDecodeError:
-        print("Model did not return valid JSON. Raw output:")
-        print(response['message']['content'])
+        logger.warning(f"Model did not return valid JSON. Raw output:\n{validator.text}")
         return None
 
+def _tokens_per_second(response, elapsed, chunks=None):
+    eval_count = response.get('eval_count') if response else None
+    eval_duration = response.get('eval_duration') if response else None
+    if eval_count and eval_duration:
+        return round(eval_count / (eval_duration / 1e9), 2)
+    if chunks and elapsed > 0:
+        # Each streamed chunk carries one token
+        return round(chunks / elapsed, 2)
+    return None
+
+def _combine_stats(stats, tile_stats):
+    first_tokens = [s["time_to_first_token"] for s in tile_stats if s.get("time_to_first_token") is not None]
+    rates = [s["tokens_per_second"] for s in tile_stats if s.get("tokens_per_second") is not None]
+    stats["time_to_first_token"] = round(first_tokens[0], 3) if first_tokens else None
+    stats["tokens_per_second"] = round(sum(rates) / len(rates), 2) if rates else None
+
 # --- Main Execution ---
 if __name__ == "__main__":
     # Test with one of your images
@@ -0,0 +1,128 @@
+import sqlite3
+import hashlib
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class IngestionManifest:
+    """
+    Tracks which input files are already in the KB (path, size, mtime, content hash)
+    so repeated ingests only touch new or modified screenshots.
+    """
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.sqlite_db_path = Path(config["kb"]["sqlite_db_path"])
+        self._init_db()
+
+    def _init_db(self) -> None:
+        self.sqlite_db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.sqlite_db_path)
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ingestion_manifest (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                sha256 TEXT NOT NULL,
+                screenshot_id INTEGER,
+                ingested_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+        conn.commit()
+        conn.close()
+
+    def inspect(self, path: Path) -> Dict:
+        """
+        Compare a file against its manifest row.
+        Args:
+            path (Path): Screenshot path.
+        Returns:
+            Dict: Entry with size, mtime, sha256, screenshot_id and a status of
+                  "new", "modified" or "unchanged".
+        """
+        stat = path.stat()
+        entry = {
+            "path": str(path.resolve()),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "sha256": None,
+            "screenshot_id": None,
+            "status": "new",
+        }
+        conn = sqlite3.connect(self.sqlite_db_path)
+        row = conn.execute(
+            "SELECT size, mtime, sha256, screenshot_id FROM ingestion_manifest WHERE path = ?",
+            (entry["path"],)
+        ).fetchone()
+        if row is None:
+            conn.close()
+            entry["sha256"] = file_sha256(path)
+            return entry
+
+        size, mtime, sha256, screenshot_id = row
+        entry["screenshot_id"] = screenshot_id
+        if size == entry["size"] and mtime == entry["mtime"]:
+            # Cheap path: size and mtime unchanged, trust the stored hash
+            conn.close()
+            entry["sha256"] = sha256
+            entry["status"] = "unchanged"
+            return entry
+
+        entry["sha256"] = file_sha256(path)
+        if entry["sha256"] == sha256:
+            # Touched but identical content; refresh stat so the next scan is cheap
+            conn.execute(
+                "UPDATE ingestion_manifest SET size = ?, mtime = ? WHERE path = ?",
+                (entry["size"], entry["mtime"], entry["path"])
+            )
+            conn.commit()
+            entry["status"] = "unchanged"
+        else:
+            entry["status"] = "modified"
+        conn.close()
+        return entry
+
+    def changed(self, screenshots: List[Path]) -> List[Dict]:
+        """
+        Return manifest entries for new or modified screenshots only.
+        """
+        entries = [self.inspect(path) for path in screenshots]
+        changed = [e for e in entries if e["status"] != "unchanged"]
+        logger.info(
+            f"Manifest: {sum(e['status'] == 'new' for e in changed)} new, "
+            f"{sum(e['status'] == 'modified' for e in changed)} modified, "
+            f"{len(entries) - len(changed)} unchanged"
+        )
+        return changed
+
+    def record(self, entry: Dict, screenshot_id: Optional[int]) -> None:
+        """
+        Upsert the manifest row after a successful KB write.
+        """
+        conn = sqlite3.connect(self.sqlite_db_path)
+        conn.execute(
+            """
+            INSERT INTO ingestion_manifest (path, size, mtime, sha256, screenshot_id, ingested_at)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(path) DO UPDATE SET
+                size = excluded.size,
+                mtime = excluded.mtime,
+                sha256 = excluded.sha256,
+                screenshot_id = excluded.screenshot_id,
+                ingested_at = excluded.ingested_at
+            """,
+            (entry["path"], entry["size"], entry["mtime"], entry["sha256"], screenshot_id)
+        )
+        conn.commit()
+        conn.close()
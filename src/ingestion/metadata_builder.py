@@ -35,6 +35,8 @@ class MetadataBuilder:
                 "errors": [],
                 "languages": [],
                 "text": [],
+                "screens": [],
+                "transitions": [],
                 "image_path": str(screenshot_path),
                 "width": None,
                 "height": None,
@@ -94,6 +96,8 @@ class MetadataBuilder:
             "errors": errors,
             "languages": languages,
             "text": text_elements,
+            "screens": layout_data.get("screens", []),
+            "transitions": layout_data.get("transitions", []),
             "image_path": str(screenshot_path),
             "width": width,
             "height": height,
@@ -0,0 +1,212 @@
+import os
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DELETED = "_deleted"
+
+def iter_log(path: Path) -> Iterator[Dict]:
+    """
+    Stream raw entries of a JSONL metadata log, oldest first.
+    A torn last line (crash mid-append) is skipped.
+    Args:
+        path (Path): Log file.
+    Yields:
+        Dict: One log entry per line.
+    """
+    path = Path(path)
+    if not path.exists():
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping unreadable line {number} of {path.name}")
+
+def iter_records(path: Path) -> Iterator[Dict]:
+    """
+    Stream the live records of a JSONL metadata log: the latest entry of
+    each id, in log order, without tombstoned ids.
+    Only one line offset per id is kept in memory, not the records themselves.
+    Args:
+        path (Path): Log file.
+    Yields:
+        Dict: Current metadata record.
+    """
+    latest = {}
+    for position, entry in enumerate(iter_log(path)):
+        latest[entry.get("id")] = position
+    for position, entry in enumerate(iter_log(path)):
+        if latest.get(entry.get("id")) == position and not entry.get(DELETED):
+            yield entry
+
+class MetadataLog:
+    """
+    Append-only JSONL sidecar of the KB metadata.
+    Updated records are appended again (the latest line of an id wins) and
+    deletions are appended as tombstones. Appends are fsynced in batches, and
+    the log is compacted once superseded lines outnumber live ones.
+    """
+
+    def __init__(self, config: dict):
+        self.config = config
+        kb_config = config["kb"]
+        self.path = Path(kb_config.get("metadata_jsonl_path", "data/kb/metadata.jsonl"))
+        # Legacy JSON array sidecar, migrated once
+        self.legacy_path = Path(kb_config["metadata_json_path"]) if kb_config.get("metadata_json_path") else None
+        log_config = kb_config.get("metadata_log", {})
+        self.fsync_every = max(1, int(log_config.get("fsync_every", 64)))
+        self.compact_ratio = float(log_config.get("compact_ratio", 2.0))
+        self.compact_min_lines = int(log_config.get("compact_min_lines", 1000))
+        self._lock = threading.Lock()
+        self._file = None
+        self._unsynced = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._migrate()
+        self._repair_tail()
+        self._lines, self._live = self._count()
+
+    def _migrate(self) -> None:
+        if self.path.exists() or self.legacy_path is None or not self.legacy_path.exists():
+            return
+        try:
+            with open(self.legacy_path, "r", encoding="utf-8") as f:
+                records = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"❌ Could not migrate {self.legacy_path}: {e}")
+            return
+        self._rewrite(records)
+        logger.info(f"Migrated {len(records)} records from {self.legacy_path.name} to {self.path.name}")
+
+    def _repair_tail(self) -> None:
+        # Drop a torn last line so the next append starts on a fresh line
+        if not self.path.exists():
+            return
+        with open(self.path, "rb+") as f:
+            size = f.seek(0, os.SEEK_END)
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            f.seek(max(0, size - 65536))
+            tail = f.read()
+            cut = tail.rfind(b"\n")
+            keep = size - len(tail) + cut + 1 if cut >= 0 else 0
+            if cut < 0 and size > len(tail):
+                return  # Single huge line, leave it to the reader
+            f.truncate(keep)
+            logger.warning(f"Dropped {size - keep} bytes of a torn record at the end of {self.path.name}")
+
+    def _count(self):
+        ids = set()
+        lines = 0
+        for entry in iter_log(self.path):
+            lines += 1
+            if entry.get(DELETED):
+                ids.discard(entry.get("id"))
+            else:
+                ids.add(entry.get("id"))
+        return lines, ids
+
+    def append(self, records: List[Dict]) -> None:
+        """
+        Append records to the log. An existing id is superseded by the new line.
+        Args:
+            records (List[Dict]): Metadata records, each with an "id".
+        """
+        with self._lock:
+            for record in records:
+                self._append(record)
+                self._live.add(record.get("id"))
+            self._after_append(len(records))
+
+    def delete(self, ids: List[int]) -> None:
+        """
+        Append tombstones for removed records.
+        """
+        with self._lock:
+            for record_id in ids:
+                self._append({"id": record_id, DELETED: True})
+                self._live.discard(record_id)
+            self._after_append(len(ids))
+
+    def _append(self, entry: Dict) -> None:
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def _after_append(self, count: int) -> None:
+        self._lines += count
+        self._unsynced += count
+        self._file.flush()
+        if self._unsynced >= self.fsync_every:
+            self._sync()
+        if self._lines >= self.compact_min_lines and self._lines > self.compact_ratio * max(len(self._live), 1):
+            self._compact()
+
+    def _sync(self) -> None:
+        if self._file is not None and self._unsynced:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+
+    def sync(self) -> None:
+        """
+        Force pending appends to disk.
+        """
+        with self._lock:
+            self._sync()
+
+    def compact(self, transform: Optional[Callable[[Dict], Dict]] = None) -> None:
+        """
+        Rewrite the log with only the live records.
+        Args:
+            transform (Callable): Optional rewrite applied to every live record (e.g. re-encoding embeddings).
+        """
+        with self._lock:
+            self._compact(transform)
+
+    def _compact(self, transform: Optional[Callable[[Dict], Dict]] = None) -> None:
+        self._sync()
+        before = self._lines
+        self._close()
+        records = iter_records(self.path)
+        self._rewrite(map(transform, records) if transform else records)
+        self._lines, self._live = self._count()
+        logger.info(f"Compacted {self.path.name}: {before} -> {self._lines} lines")
+
+    def _rewrite(self, records) -> None:
+        # Write the new log next to the old one and swap atomically
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def records(self) -> Iterator[Dict]:
+        """
+        Stream the live records.
+        """
+        self.sync()
+        return iter_records(self.path)
+
+    def _close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self) -> None:
+        with self._lock:
+            self._sync()
+            self._close()
@@ -0,0 +1,122 @@
+import time
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SCREEN_FIELDS = ("id", "description", "text_content")
+TRANSITION_FIELDS = ("from_screen", "to_screen", "trigger_element", "action")
+
+def score_layout(layout: Optional[Dict]) -> float:
+    """
+    Heuristic confidence for a vision answer, in [0, 1].
+    Weighs schema completeness, screen/transition counts and how well
+    transitions and annotations link back to the extracted screens.
+    Args:
+        layout (Dict): Parsed model output.
+    Returns:
+        float: Confidence score.
+    """
+    if not isinstance(layout, dict):
+        return 0.0
+    screens = [s for s in layout.get("screens") or [] if isinstance(s, dict)]
+    transitions = [t for t in layout.get("transitions") or [] if isinstance(t, dict)]
+    if not screens:
+        return 0.0
+
+    # Completeness: share of expected fields that are filled in
+    filled = sum(1 for s in screens for f in SCREEN_FIELDS if s.get(f))
+    filled += sum(1 for t in transitions for f in TRANSITION_FIELDS if t.get(f))
+    expected = len(screens) * len(SCREEN_FIELDS) + len(transitions) * len(TRANSITION_FIELDS)
+    completeness = filled / expected
+
+    # Counts: a flowchart with several screens should have arrows between them
+    counts = 1.0 if len(screens) == 1 or transitions else 0.3
+
+    # Linkage: transitions point at known screens, annotations carry an explanation
+    screen_ids = {s.get("id") for s in screens}
+    links = [t.get("from_screen") in screen_ids and t.get("to_screen") in screen_ids for t in transitions]
+    annotations = [a for s in screens for a in s.get("annotations") or [] if isinstance(a, dict)]
+    links.extend(bool(a.get("explanation")) for a in annotations)
+    linkage = sum(links) / len(links) if links else 1.0
+
+    return round(0.4 * completeness + 0.3 * counts + 0.3 * linkage, 3)
+
+class ModelCascade:
+    """
+    Runs a cheap vision model first and escalates to larger models only when
+    the answer scores below `ingestion.cascade.escalate_below`.
+    """
+
+    def __init__(self, config: dict):
+        self.config = config
+        cascade_config = config["ingestion"].get("cascade", {})
+        self.models: List[str] = cascade_config.get("models", [])
+        self.enabled = cascade_config.get("enabled", False) and bool(self.models)
+        self.threshold = cascade_config.get("escalate_below", 0.75)
+        self._lock = threading.Lock()
+        self._stats = {model: {"calls": 0, "accepted": 0, "errors": 0, "seconds": 0.0} for model in self.models}
+        self.escalations = 0
+
+    def analyze(self, name: str, call: Callable[[str], Optional[Dict]]) -> Tuple[Optional[Dict], Dict]:
+        """
+        Run the cascade for one image.
+        Args:
+            name (str): Image name, for logging.
+            call (Callable): Runs the vision model given a model name.
+        Returns:
+            Tuple: (best layout, cascade info with model, confidence and escalated flag).
+        """
+        best, best_score, best_model = None, -1.0, None
+        last_error = None
+        for position, model in enumerate(self.models):
+            started = time.perf_counter()
+            try:
+                layout = call(model)
+            except Exception as e:
+                # A missing or failing model escalates instead of failing the image
+                last_error = e
+                self._record(model, time.perf_counter() - started, error=True)
+                logger.warning(f"{model} failed on {name}: {e}")
+                continue
+            score = score_layout(layout)
+            self._record(model, time.perf_counter() - started)
+            if score > best_score:
+                best, best_score, best_model = layout, score, model
+            if score >= self.threshold:
+                break
+            if position < len(self.models) - 1:
+                with self._lock:
+                    self.escalations += 1
+                logger.info(f"{model} scored {score:.2f} on {name}, escalating")
+
+        if best_model is None:
+            raise last_error or RuntimeError(f"No cascade model produced output for {name}")
+        with self._lock:
+            self._stats[best_model]["accepted"] += 1
+        return best, {"model": best_model, "confidence": best_score, "escalated": best_model != self.models[0]}
+
+    def _record(self, model: str, seconds: float, error: bool = False) -> None:
+        with self._lock:
+            stats = self._stats[model]
+            stats["calls"] += 1
+            stats["seconds"] += seconds
+            if error:
+                stats["errors"] += 1
+
+    def stats(self) -> Dict:
+        """
+        Per-model call counts, accepted answers and average latency.
+        """
+        with self._lock:
+            models = {
+                model: {
+                    "calls": s["calls"],
+                    "accepted": s["accepted"],
+                    "errors": s["errors"],
+                    "avg_latency_seconds": round(s["seconds"] / s["calls"], 3) if s["calls"] else None,
+                }
+                for model, s in self._stats.items()
+            }
+            return {"threshold": self.threshold, "escalations": self.escalations, "models": models}
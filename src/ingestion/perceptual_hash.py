@@ -0,0 +1,163 @@
+import sqlite3
+import logging
+import numpy as np
+from PIL import Image
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from .kb_codec import KBCodec
+
+logger = logging.getLogger(__name__)
+
+def dhash(image: Image.Image, hash_size: int = 8) -> int:
+    """
+    Difference hash: compares horizontally adjacent pixels of a downscaled grayscale image.
+    """
+    pixels = np.asarray(
+        image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS), dtype=np.int16
+    )
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+def phash(image: Image.Image, hash_size: int = 8) -> int:
+    """
+    Perceptual hash: low-frequency DCT coefficients compared against their median.
+    """
+    size = hash_size * 4
+    pixels = np.asarray(image.convert("L").resize((size, size), Image.LANCZOS), dtype=np.float64)
+    # DCT-II basis; 32x32 is small enough that a dense matrix product is cheap
+    n = np.arange(size)
+    basis = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * size))
+    dct = basis @ pixels @ basis.T
+    low = dct[:hash_size, :hash_size].flatten()[1:]  # drop the DC term
+    bits = low > np.median(low)
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+HASH_FUNCTIONS = {"dhash": dhash, "phash": phash}
+
+# Both hashes fit in 64 bits
+HASH_BITS = 64
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+class PerceptualHashIndex:
+    """
+    KB-side index of perceptual image hashes used to spot near-identical
+    screenshots before paying for vision inference.
+    Hashes are split into threshold + 1 bands; two hashes within the
+    threshold agree exactly on at least one band, so `find` only compares
+    the hashes sharing a band with the query instead of scanning them all.
+    """
+
+    def __init__(self, config: dict):
+        self.config = config
+        dedup_config = config["ingestion"].get("near_duplicate", {})
+        self.enabled = dedup_config.get("enabled", False)
+        self.algorithm = dedup_config.get("algorithm", "dhash")
+        self.threshold = dedup_config.get("hamming_threshold", 4)
+        self.sqlite_db_path = Path(config["kb"]["sqlite_db_path"])
+        self._hashes = {}  # screenshot_id -> hash
+        count = min(self.threshold + 1, HASH_BITS)
+        self._band_bounds = [(HASH_BITS * i // count, HASH_BITS * (i + 1) // count) for i in range(count)]
+        self._buckets: Dict[Tuple[int, int], Set[int]] = {}  # (band, band bits) -> screenshot ids
+        if self.enabled:
+            self._init_db()
+            self._load()
+
+    def _init_db(self) -> None:
+        conn = sqlite3.connect(self.sqlite_db_path)
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS image_hashes (
+                screenshot_id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL,
+                algorithm TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                duplicate_of INTEGER
+            )
+            """
+        )
+        conn.commit()
+        conn.close()
+
+    def _load(self) -> None:
+        conn = sqlite3.connect(self.sqlite_db_path)
+        rows = conn.execute(
+            "SELECT screenshot_id, hash FROM image_hashes WHERE algorithm = ?", (self.algorithm,)
+        ).fetchall()
+        conn.close()
+        self._hashes, self._buckets = {}, {}
+        for screenshot_id, value in rows:
+            self._index(screenshot_id, int(value, 16))
+
+    def _bands(self, value: int) -> List[Tuple[int, int]]:
+        return [(band, (value >> low) & ((1 << (high - low)) - 1))
+                for band, (low, high) in enumerate(self._band_bounds)]
+
+    def _index(self, screenshot_id: int, value: int) -> None:
+        previous = self._hashes.get(screenshot_id)
+        if previous is not None:
+            for key in self._bands(previous):
+                self._buckets[key].discard(screenshot_id)
+        self._hashes[screenshot_id] = value
+        for key in self._bands(value):
+            self._buckets.setdefault(key, set()).add(screenshot_id)
+
+    def compute(self, image_path: Path) -> Optional[int]:
+        """
+        Hash an image file, or return None if it cannot be decoded.
+        """
+        try:
+            with Image.open(image_path) as image:
+                return HASH_FUNCTIONS[self.algorithm](image)
+        except Exception as e:
+            logger.warning(f"Could not compute {self.algorithm} for {image_path}: {e}")
+            return None
+
+    def find(self, value: int, exclude: Optional[int] = None) -> Optional[Tuple[int, int]]:
+        """
+        Find the closest indexed screenshot within the Hamming threshold.
+        Args:
+            value (int): Hash of the image being ingested.
+            exclude (int): Screenshot ID never to match, e.g. the file's own row when it was modified.
+        Returns:
+            Tuple: (screenshot_id, distance), or None if nothing is close enough.
+        """
+        candidates = set()
+        for key in self._bands(value):
+            candidates.update(self._buckets.get(key, ()))
+        candidates.discard(exclude)
+        best = None
+        for screenshot_id in candidates:
+            distance = hamming(value, self._hashes[screenshot_id])
+            if distance <= self.threshold and (best is None or distance < best[1]):
+                best = (screenshot_id, distance)
+        return best
+
+    def add(self, screenshot_id: int, image_path: Path, value: int, duplicate_of: Optional[int] = None) -> None:
+        conn = sqlite3.connect(self.sqlite_db_path)
+        conn.execute(
+            "INSERT OR REPLACE INTO image_hashes (screenshot_id, path, algorithm, hash, duplicate_of) VALUES (?, ?, ?, ?, ?)",
+            (screenshot_id, str(image_path), self.algorithm, format(value, "016x"), duplicate_of)
+        )
+        conn.commit()
+        conn.close()
+        self._index(screenshot_id, value)
+
+    def layout_for(self, screenshot_id: int) -> Optional[Dict]:
+        """
+        Rebuild the vision-model layout (screens/transitions) stored for a screenshot.
+        """
+        conn = sqlite3.connect(self.sqlite_db_path)
+        row = conn.execute(
+            "SELECT screens, transitions FROM screenshots WHERE id = ?", (screenshot_id,)
+        ).fetchone()
+        conn.close()
+        if row is None:
+            return None
+        codec = KBCodec(self.config)
+        return {
+            "screens": codec.decode_payload(row[0]),
+            "transitions": codec.decode_payload(row[1]),
+        }
@@ -1,11 +1,20 @@
 import os
+import time
 import logging
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
 
 from .layoutlm_analyzer import process_image
 from .metadata_builder import MetadataBuilder
 from .kb_writer import KBWriter
+from .response_cache import ResponseCache
+from .manifest import IngestionManifest
+from .perceptual_hash import PerceptualHashIndex, hamming
+from .image_preprocessor import ImagePreprocessor
+from .model_cascade import ModelCascade
+from .checkpoint import StageCheckpointer
+from .embedder import Embedder
 
 logger = logging.getLogger(__name__)
 
@@ -15,38 +24,413 @@ class ScreenshotIngestor:
         self.input_folder = Path(config["ingestion"]["input_folder"])
         self.supported_exts = set(config["ingestion"]["supported_extensions"])
         self.max_retries = config["ingestion"]["max_retries"]
+        # Number of vision requests kept in flight; 1 keeps the sequential path
+        self.batch_size = max(1, int(config["ingestion"].get("batch_size", 1)))
+        # Records per KB write transaction
+        self.write_batch_size = max(1, int(config["ingestion"].get("write_batch_size", 16)))
+        self._written_ids = {}
         self.kb_writer = KBWriter(config)
+        cache_config = config["ingestion"].get("vision_cache", {})
+        self.vision_cache = None
+        if cache_config.get("enabled", False):
+            self.vision_cache = ResponseCache(cache_config["path"], cache_config.get("max_size_mb", 256))
+        self.preprocessor = None
+        if config["ingestion"].get("preprocessing", {}).get("enabled", False):
+            self.preprocessor = ImagePreprocessor(config)
+        streaming = config["ingestion"].get("streaming", {})
+        self.stream = streaming.get("enabled", False)
+        self.stream_max_chars = streaming.get("max_chars")
+        self._inference_stats = {}
+        # Try a small vision model first and escalate low-confidence answers
+        self.cascade = ModelCascade(config)
+        # Persist each stage's output so retries and interrupted runs resume where they failed
+        self.checkpoints = StageCheckpointer(config)
+        # CPU text and image embeddings (separate vectors), computed once per KB write batch
+        self.embedder = Embedder(config)
+        self._embedding_stats = {"rows": 0, "seconds": 0.0}
         # Removed legacy LayoutLMAnalyzer reference
         self.metadata_builder = MetadataBuilder(config)
+        # Skip files whose size/mtime/content hash already match the manifest
+        self.incremental = config["ingestion"].get("incremental", True)
+        self.manifest = IngestionManifest(config)
+        self._manifest_entries = {}
+        # Reuse layouts of near-identical screenshots instead of re-running the vision model
+        self.phash_index = PerceptualHashIndex(config)
+        self._near_duplicates = {}
 
-    def run(self) -> None:
+    def run(self) -> Dict:
+        """
+        Ingest every screenshot in the input folder.
+        Vision inference runs on up to `ingestion.batch_size` worker threads,
+        while KB writes stay on the calling thread in folder order.
+        Returns:
+            Dict: Run summary with per-file timings and overall throughput.
+        """
         logger.info(f"Starting ingestion from {self.input_folder}")
-        screenshots = self._get_screenshots()
-        for screenshot in screenshots:
-            self._process_screenshot(screenshot)
+        try:
+            screenshots = self._get_screenshots()
+            found = len(screenshots)
+            if self.incremental:
+                entries = self.manifest.changed(screenshots)
+                self._manifest_entries = {Path(e["path"]): e for e in entries}
+                screenshots = [s for s in screenshots if s.resolve() in self._manifest_entries]
+            started = time.perf_counter()
+            self._near_duplicates = self._near_duplicate_stage(screenshots)
+            timings = self._run_pipeline(screenshots)
+            summary = self._summarize(timings, time.perf_counter() - started)
+        finally:
+            # Persist the FAISS index and fsync the sidecar now; the debounce timer dies with a CLI process
+            self.close()
+        summary["skipped_unchanged"] = found - len(screenshots)
+        summary["skipped_inferences"] = sum(1 for t in timings if "reused_from" in t)
+        logger.info(f"Near-duplicate stage skipped {summary['skipped_inferences']} vision inferences")
         logger.info("Ingestion completed.")
+        return summary
+
+    def close(self) -> None:
+        """
+        Flush and close the KB writer (SQLite, metadata sidecar, FAISS index) and the vision cache.
+        """
+        self.kb_writer.close()
+        if self.vision_cache is not None:
+            self.vision_cache.close()
+
+    def _near_duplicate_stage(self, screenshots: List[Path]) -> Dict[Path, Dict]:
+        """
+        Hash every screenshot before inference and find near-identical sources,
+        either already in the KB or earlier in this run.
+        Args:
+            screenshots (List[Path]): Screenshots about to be ingested.
+        Returns:
+            Dict: Per-path hash and optional source_id (KB row) or source_path (this run).
+        """
+        plan = {}
+        if not self.phash_index.enabled:
+            return plan
+        leaders = []
+        for screenshot in screenshots:
+            value = self.phash_index.compute(screenshot)
+            if value is None:
+                continue
+            entry = {"hash": value, "source_id": None, "source_path": None}
+            # A modified file must not match its own previous row and reuse the stale layout
+            own_id = self._manifest_entry(screenshot)["screenshot_id"]
+            match = self.phash_index.find(value, exclude=own_id)
+            if match is not None:
+                entry["source_id"] = match[0]
+                logger.info(f"{screenshot.name} is a near-duplicate of KB row {match[0]} (distance {match[1]})")
+            else:
+                for leader, leader_hash in leaders:
+                    if hamming(value, leader_hash) <= self.phash_index.threshold:
+                        entry["source_path"] = leader
+                        logger.info(f"{screenshot.name} is a near-duplicate of {leader.name}")
+                        break
+                else:
+                    leaders.append((screenshot, value))
+            plan[screenshot] = entry
+        return plan
+
+    def _run_pipeline(self, screenshots: List[Path]) -> List[Dict]:
+        plan = self._near_duplicates
+        reused = {s for s, e in plan.items() if e["source_id"] is not None or e["source_path"] is not None}
+        to_infer = [s for s in screenshots if s not in reused]
+        concurrent = self.batch_size > 1 and len(to_infer) > 1
+        if concurrent:
+            logger.info(f"Running concurrent ingestion with {self.batch_size} in-flight vision requests")
+        timings = []
+        layouts = {}
+        pending = []
+        with ThreadPoolExecutor(max_workers=self.batch_size) as executor:
+            futures = {s: executor.submit(self._analyze, s) for s in to_infer} if concurrent else {}
+            # Consume results in folder order so KB writes are serialized and ordered
+            for screenshot in screenshots:
+                source_path = plan.get(screenshot, {}).get("source_path")
+                if any(item["path"] == source_path for item in pending):
+                    self._flush(pending)  # The link needs the source's row id
+                layout_data, source_id = None, None
+                if screenshot in reused:
+                    layout_data, source_id = self._reuse_layout(plan[screenshot], layouts, self._written_ids)
+                if layout_data is not None:
+                    result = (layout_data, 0.0, None)
+                elif screenshot in futures:
+                    result = futures[screenshot].result()
+                else:
+                    # Sequential mode, or the near-duplicate source had nothing to reuse
+                    result = self._analyze(screenshot)
+                    source_id = None
+                timing, item = self._prepare_write(screenshot, *result, reused_from=source_id)
+                layouts[screenshot] = result[0]
+                timings.append(timing)
+                if item is not None:
+                    pending.append(item)
+                if len(pending) >= self.write_batch_size:
+                    self._flush(pending)
+            self._flush(pending)
+        return timings
+
+    def _reuse_layout(self, entry: Dict, layouts: Dict, written_ids: Dict) -> Tuple[Optional[dict], Optional[int]]:
+        if entry["source_id"] is not None:
+            return self.phash_index.layout_for(entry["source_id"]), entry["source_id"]
+        return layouts.get(entry["source_path"]), written_ids.get(entry["source_path"])
 
     def _get_screenshots(self) -> List[Path]:
         screenshots = []
-        for file in self.input_folder.iterdir():
+        for file in sorted(self.input_folder.iterdir()):
             if file.suffix.lower() in self.supported_exts:
                 screenshots.append(file)
         logger.info(f"Found {len(screenshots)} screenshots.")
         return screenshots
 
-    def _process_screenshot(self, screenshot_path: str) -> None:
+    def _process_screenshot(self, screenshot_path: str) -> Dict:
         # Convert string to Path if needed
         if isinstance(screenshot_path, str):
             screenshot_path = Path(screenshot_path)
+        layout_data, inference_seconds, error = self._analyze(screenshot_path)
+        timing, item = self._prepare_write(screenshot_path, layout_data, inference_seconds, error)
+        if item is not None:
+            self._flush([item])
+        return timing
+
+    def _analyze(self, screenshot_path: Path) -> Tuple[Optional[dict], float, Optional[str]]:
+        """
+        Run vision inference for one screenshot, retrying on errors.
+        Args:
+            screenshot_path (Path): Path to the screenshot file.
+        Returns:
+            Tuple: (layout_data, inference seconds, last error or None).
+        """
+        started = time.perf_counter()
+        key = StageCheckpointer.key_for(self._manifest_entry(screenshot_path))
+        layout_data = self.checkpoints.load(key, "layout")
+        if layout_data is not None:
+            logger.info(f"Resuming {screenshot_path.name} from its layout checkpoint")
+            self._inference_stats[screenshot_path] = {"resumed_from": "layout"}
+            return layout_data, time.perf_counter() - started, None
+
+        error = None
         for attempt in range(1, self.max_retries + 1):
             try:
                 logger.info(f"Processing {screenshot_path} (Attempt {attempt})")
-                layout_data = process_image(str(screenshot_path))
-                metadata = self.metadata_builder.build(screenshot_path, layout_data)
-                self.kb_writer.write(metadata)
-                logger.info(f"✅ {screenshot_path.name} ingested successfully.")
-                break
+                stats = {}
+
+                def run_model(model=None):
+                    kwargs = {"model": model} if model else {}
+                    return process_image(
+                        str(screenshot_path), cache=self.vision_cache, preprocessor=self.preprocessor,
+                        stream=self.stream, max_chars=self.stream_max_chars, stats=stats, **kwargs
+                    )
+
+                if self.cascade.enabled:
+                    layout_data, cascade_info = self.cascade.analyze(screenshot_path.name, run_model)
+                    stats.update(cascade_info)
+                else:
+                    layout_data = run_model()
+                stats["attempts"] = attempt
+                self._inference_stats[screenshot_path] = stats
+                if layout_data is None:
+                    # Invalid JSON from the model is a failed inference, not an empty screenshot
+                    raise ValueError(f"No valid layout returned for {screenshot_path.name}")
+                self.checkpoints.save(key, "layout", layout_data)
+                return layout_data, time.perf_counter() - started, None
             except Exception as e:
+                error = str(e)
                 logger.error(f"❌ Failed to process {screenshot_path} (Attempt {attempt}): {e}")
-                if attempt == self.max_retries:
-                    logger.critical(f"💥 Giving up on {screenshot_path.name} after {self.max_retries} attempts.")
+        logger.critical(f"💥 Giving up on {screenshot_path.name} after {self.max_retries} attempts.")
+        return None, time.perf_counter() - started, error
+
+    def _prepare_write(self, screenshot_path: Path, layout_data: Optional[dict],
+                       inference_seconds: float, error: Optional[str] = None,
+                       reused_from: Optional[int] = None) -> Tuple[Dict, Optional[Dict]]:
+        """
+        Build metadata for one screenshot and queue it for the next KB batch.
+        Args:
+            screenshot_path (Path): Path to the screenshot file.
+            layout_data (dict): Parsed output from the vision model.
+            inference_seconds (float): Time spent in vision inference.
+            error (str): Inference error, if every inference attempt failed.
+            reused_from (int): KB row whose layout was reused instead of running inference.
+        Returns:
+            Tuple: (per-file timing record, pending write or None if the file failed).
+        """
+        timing = {
+            "filename": screenshot_path.name,
+            "status": "failed",
+            "inference_seconds": round(inference_seconds, 3),
+            "write_seconds": 0.0,
+            "total_seconds": round(inference_seconds, 3),
+        }
+        timing.update(self._inference_stats.pop(screenshot_path, {}))
+        if reused_from is not None:
+            timing["reused_from"] = reused_from
+        if error is None and layout_data is None:
+            error = f"No valid layout for {screenshot_path.name}"
+        if error is not None:
+            timing["error"] = error
+            return timing, None
+
+        entry = self._manifest_entry(screenshot_path)
+        key = StageCheckpointer.key_for(entry)
+        try:
+            # Each stage is skipped when its checkpoint exists, so a retry resumes at the failed stage
+            metadata = self.checkpoints.load(key, "metadata")
+            if metadata is None:
+                metadata = self.metadata_builder.build(screenshot_path, layout_data)
+                # A modified file replaces its existing KB row (version bump) instead of adding one
+                metadata["id"] = entry["screenshot_id"]
+                # Link to the near-identical source (a re-export of the same file is not a link)
+                if reused_from is not None and reused_from != entry["screenshot_id"]:
+                    metadata["duplicate_of"] = reused_from
+                self.checkpoints.save(key, "metadata", metadata)
+        except Exception as e:
+            timing["error"] = str(e)
+            logger.error(f"❌ Failed to build metadata for {screenshot_path}: {e}")
+            return timing, None
+        return timing, {"path": screenshot_path, "entry": entry, "key": key, "metadata": metadata, "timing": timing}
+
+    def _flush(self, pending: List[Dict]) -> None:
+        """
+        Write queued records to the KB as one batch, then record them in the manifest.
+        A batch that keeps failing is retried record by record so one bad file
+        does not take the others down with it.
+        """
+        if not pending:
+            return
+        started = time.perf_counter()
+        to_write = []
+        for item in pending:
+            written = self.checkpoints.load(item["key"], "kb")
+            if written is None:
+                to_write.append(item)
+            else:
+                item["metadata"]["id"] = written["id"]
+
+        self._embed(to_write)
+        failed = []
+        if to_write and not self._write_with_retries(to_write):
+            if len(to_write) > 1:
+                logger.warning(f"Batch of {len(to_write)} failed, retrying records one at a time")
+                failed = [item for item in to_write if not self._write_with_retries([item])]
+            else:
+                failed = to_write
+        for item in to_write:
+            if item not in failed:
+                metadata = item["metadata"]
+                self._index_hash(item["path"], metadata["id"], metadata.get("duplicate_of"))
+                self.checkpoints.save(item["key"], "kb", {"id": metadata["id"]})
+
+        write_seconds = (time.perf_counter() - started) / len(pending)
+        for item in pending:
+            timing = item["timing"]
+            timing["write_seconds"] = round(write_seconds, 3)
+            timing["total_seconds"] = round(timing["inference_seconds"] + write_seconds, 3)
+            if item in failed:
+                logger.critical(f"💥 Giving up on {item['path'].name} after {self.max_retries} attempts.")
+                continue
+            try:
+                self.manifest.record(item["entry"], item["metadata"]["id"])
+                self.checkpoints.clear(item["key"])
+            except Exception as e:
+                timing["error"] = str(e)
+                logger.error(f"❌ Failed to record {item['path']} in the manifest: {e}")
+                continue
+            timing.pop("error", None)
+            timing["screenshot_id"] = item["metadata"]["id"]
+            timing["status"] = "ok"
+            self._written_ids[item["path"]] = item["metadata"]["id"]
+            logger.info(f"✅ {item['path'].name} ingested successfully.")
+        pending.clear()
+
+    def _embed(self, items: List[Dict]) -> None:
+        if not self.embedder.enabled or not items:
+            return
+        started = time.perf_counter()
+        records = [item["metadata"] for item in items]
+        try:
+            vectors = self.embedder.embed(records)
+            images = self.embedder.embed_images(records) if self.embedder.images else [None] * len(records)
+        except Exception as e:
+            # Rows keep NULL embeddings and are picked up by the backfill job
+            logger.error(f"❌ Failed to embed {len(items)} records: {e}")
+            return
+        for metadata, vector, image in zip(records, vectors, images):
+            metadata["embedding"] = vector.tolist()
+            if image is not None:
+                metadata["image_embedding"] = image.tolist()
+        self._embedding_stats["rows"] += len(items)
+        self._embedding_stats["seconds"] += time.perf_counter() - started
+
+    def _write_with_retries(self, items: List[Dict]) -> bool:
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                self.kb_writer.write_batch([item["metadata"] for item in items])
+                return True
+            except Exception as e:
+                for item in items:
+                    item["timing"]["error"] = str(e)
+                logger.error(f"❌ Failed to write {len(items)} records (Attempt {attempt}): {e}")
+        return False
+
+    def _manifest_entry(self, screenshot_path: Path) -> Dict:
+        entry = self._manifest_entries.get(screenshot_path.resolve())
+        if entry is None:
+            entry = self.manifest.inspect(screenshot_path)
+            self._manifest_entries[screenshot_path.resolve()] = entry
+        return entry
+
+    def _index_hash(self, screenshot_path: Path, screenshot_id: Optional[int], duplicate_of: Optional[int]) -> None:
+        if not self.phash_index.enabled or screenshot_id is None:
+            return
+        entry = self._near_duplicates.get(screenshot_path)
+        value = entry["hash"] if entry else self.phash_index.compute(screenshot_path)
+        if value is not None:
+            self.phash_index.add(screenshot_id, screenshot_path, value, duplicate_of)
+
+    def _summarize(self, timings: List[Dict], elapsed: float) -> Dict:
+        for timing in timings:
+            streaming = ""
+            if timing.get("tokens_per_second") is not None:
+                streaming = f", ttft {timing['time_to_first_token'] or 0:.2f}s, {timing['tokens_per_second']:.1f} tok/s"
+            logger.info(
+                f"⏱️ {timing['filename']}: {timing['status']} "
+                f"(inference {timing['inference_seconds']:.2f}s, write {timing['write_seconds']:.2f}s{streaming})"
+            )
+        succeeded = sum(1 for t in timings if t["status"] == "ok")
+        files_per_minute = len(timings) / elapsed * 60 if elapsed > 0 else 0.0
+        logger.info(
+            f"Ingested {succeeded}/{len(timings)} screenshots in {elapsed:.2f}s "
+            f"({files_per_minute:.2f} files/min, concurrency={self.batch_size})"
+        )
+        if self.vision_cache is not None:
+            cache_stats = self.vision_cache.stats()
+            logger.info(f"Vision cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+        else:
+            cache_stats = None
+        cascade_stats = None
+        if self.cascade.enabled:
+            cascade_stats = self.cascade.stats()
+            for model, model_stats in cascade_stats["models"].items():
+                logger.info(
+                    f"Cascade {model}: {model_stats['calls']} calls, {model_stats['accepted']} accepted, "
+                    f"avg {model_stats['avg_latency_seconds'] or 0:.2f}s"
+                )
+        embedding_stats = None
+        if self.embedder.enabled:
+            rows, seconds = self._embedding_stats["rows"], self._embedding_stats["seconds"]
+            embedding_stats = {
+                "rows": rows,
+                "seconds": round(seconds, 3),
+                "rows_per_second": round(rows / seconds, 2) if seconds else None,
+            }
+            logger.info(f"Embedded {rows} records ({embedding_stats['rows_per_second']} rows/sec)")
+        return {
+            "files": len(timings),
+            "succeeded": succeeded,
+            "failed": len(timings) - succeeded,
+            "concurrency": self.batch_size,
+            "elapsed_seconds": round(elapsed, 3),
+            "files_per_minute": round(files_per_minute, 2),
+            "vision_cache": cache_stats,
+            "cascade": cascade_stats,
+            "embedding": embedding_stats,
+            "timings": timings,
+        }
@@ -0,0 +1,128 @@
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class ResponseCache:
+    """
+    Persistent, size-bounded LRU cache for parsed model responses.
+    Entries live in a small SQLite file so they survive restarts. The file is
+    opened in WAL mode with a busy timeout, so several worker processes can
+    share one cache; entries older than `ttl_seconds` (if set) count as misses.
+    """
+
+    def __init__(self, db_path: str, max_size_mb: float = 256, ttl_seconds: Optional[float] = None,
+                 busy_timeout_ms: int = 5000):
+        self.db_path = Path(db_path)
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=busy_timeout_ms / 1000)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_last_access ON cache_entries(last_access)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_created_at ON cache_entries(created_at)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(*parts: str) -> str:
+        """
+        Build a cache key from its parts (e.g. content hash, model, prompt hash).
+        """
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Return the cached value for key, or None on a miss.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM cache_entries WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl_seconds is not None and now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM cache_entries WHERE key = ? AND created_at = ?", (key, row[1]))
+                self._conn.commit()
+                self.evictions += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE cache_entries SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Any) -> None:
+        """
+        Store value under key, evicting least recently used entries past the size cap.
+        """
+        payload = json.dumps(value, ensure_ascii=False)
+        size = len(payload.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (key, value, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, payload, size, now, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float) -> None:
+        if self.ttl_seconds is not None:
+            expired = self._conn.execute(
+                "DELETE FROM cache_entries WHERE created_at < ?", (now - self.ttl_seconds,)
+            ).rowcount
+            self.evictions += expired
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache_entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        stale = []
+        for key, size in self._conn.execute("SELECT key, size FROM cache_entries ORDER BY last_access"):
+            if total <= self.max_bytes:
+                break
+            stale.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM cache_entries WHERE key = ?", stale)
+        self.evictions += len(stale)
+        logger.info(f"Evicted {len(stale)} entries from {self.db_path.name}")
+
+    def stats(self) -> Dict:
+        """
+        Get hit/miss counters and current cache size.
+        """
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "size_bytes": size,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,129 @@
+from typing import List, Optional
+
+class SchemaDivergence(ValueError):
+    """
+    Raised as soon as a streamed model answer can no longer match the expected schema.
+    """
+
+class IncrementalJSONValidator:
+    """
+    Character-level validator for the vision model's streamed JSON answer.
+    It checks the document shape as tokens arrive, without waiting for the end:
+    a single root object whose keys are "screens"/"transitions", each holding a
+    list of objects. Anything deeper is only checked for balanced brackets.
+    """
+
+    ROOT_KEYS = {"screens", "transitions"}
+
+    def __init__(self, max_chars: Optional[int] = None):
+        self.max_chars = max_chars
+        self.length = 0
+        self.complete = False
+        self.keys_seen: List[str] = []
+        self._pieces: List[str] = []
+        self._stack: List[list] = []  # [bracket, state]
+        self._in_string = False
+        self._escape = False
+        self._key_chars: Optional[List[str]] = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self._pieces)
+
+    def feed(self, piece: str) -> None:
+        """
+        Consume the next streamed chunk.
+        Raises:
+            SchemaDivergence: If the output has diverged from the expected structure.
+        """
+        self._pieces.append(piece)
+        self.length += len(piece)
+        if self.max_chars and self.length > self.max_chars:
+            raise SchemaDivergence(f"output exceeded {self.max_chars} characters")
+        for ch in piece:
+            self._consume(ch)
+
+    def _consume(self, ch: str) -> None:
+        if self.complete:
+            if not ch.isspace():
+                raise SchemaDivergence("unexpected data after the JSON document")
+            return
+        if self._in_string:
+            self._consume_string(ch)
+            return
+        if ch.isspace():
+            return
+        if not self._stack:
+            if ch != "{":
+                raise SchemaDivergence(f"expected '{{' at start of output, got {ch!r}")
+            self._stack.append(["{", "key"])
+            return
+
+        depth = len(self._stack)
+        frame = self._stack[-1]
+        if depth == 1:
+            self._consume_root(frame, ch)
+        elif depth == 2:
+            self._consume_list(frame, ch)
+        else:
+            self._consume_nested(ch)
+
+    def _consume_string(self, ch: str) -> None:
+        if self._escape:
+            self._escape = False
+        elif ch == "\\":
+            self._escape = True
+        elif ch == '"':
+            self._in_string = False
+            if self._key_chars is not None:
+                key = "".join(self._key_chars)
+                self._key_chars = None
+                if key not in self.ROOT_KEYS:
+                    raise SchemaDivergence(f"unexpected top-level key {key!r}")
+                self.keys_seen.append(key)
+                self._stack[0][1] = "colon"
+            return
+        if self._key_chars is not None:
+            self._key_chars.append(ch)
+
+    def _consume_root(self, frame: list, ch: str) -> None:
+        state = frame[1]
+        if state == "key" and ch == '"':
+            self._in_string = True
+            self._key_chars = []
+        elif state in ("key", "comma") and ch == "}":
+            self._stack.pop()
+            self.complete = True
+        elif state == "colon" and ch == ":":
+            frame[1] = "value"
+        elif state == "value" and ch == "[":
+            frame[1] = "comma"
+            self._stack.append(["[", "item"])
+        elif state == "comma" and ch == ",":
+            frame[1] = "key"
+        elif state == "value":
+            raise SchemaDivergence(f"'{self.keys_seen[-1]}' must be a list, got {ch!r}")
+        else:
+            raise SchemaDivergence(f"unexpected {ch!r} in top-level object")
+
+    def _consume_list(self, frame: list, ch: str) -> None:
+        state = frame[1]
+        if state == "item" and ch == "{":
+            frame[1] = "separator"
+            self._stack.append(["{", None])
+        elif ch == "]" and state in ("item", "separator"):
+            self._stack.pop()
+        elif state == "separator" and ch == ",":
+            frame[1] = "item"
+        else:
+            raise SchemaDivergence(f"'{self.keys_seen[-1]}' items must be objects, got {ch!r}")
+
+    def _consume_nested(self, ch: str) -> None:
+        if ch == '"':
+            self._in_string = True
+        elif ch in "{[":
+            self._stack.append([ch, None])
+        elif ch in "}]":
+            opening = self._stack.pop()[0]
+            if (opening, ch) not in (("{", "}"), ("[", "]")):
+                raise SchemaDivergence(f"mismatched {ch!r}")
@@ -0,0 +1,431 @@
+import os
+import math
+import time
+import sqlite3
+import logging
+import threading
+import faiss
+import numpy as np
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .kb_codec import decode_embedding
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("FlatIP", "IVFFlat", "IVFPQ", "HNSW")
+
+DEFAULT_PARAMS = {
+    "nlist": None,           # IVF cells; None = 4 * sqrt(n)
+    "nprobe": 16,            # IVF cells visited per query
+    "pq_m": 64,              # PQ sub-quantizers (must divide the dimension)
+    "pq_nbits": 8,           # Bits per PQ code
+    "hnsw_m": 32,            # HNSW graph degree
+    "ef_construction": 200,
+    "ef_search": 64,
+    "hnsw_compact_ratio": 0.2,    # Rebuild the HNSW graph once this share of its vectors is removed or replaced
+    "train_points_per_list": 39,  # Below this many vectors per IVF cell, stay on FlatIP
+}
+
+def index_kind(index: faiss.Index) -> str:
+    """
+    Name of the ANN structure inside an (ID-mapped) index, one of INDEX_TYPES.
+    """
+    inner = faiss.downcast_index(index.index if isinstance(index, faiss.IndexIDMap) else index)
+    if isinstance(inner, faiss.IndexHNSW):
+        return "HNSW"
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return "IVFPQ"
+    if isinstance(inner, faiss.IndexIVFFlat):
+        return "IVFFlat"
+    return "FlatIP"
+
+def resolve_kind(index_type: str, n: int, params: Dict) -> Tuple[str, Optional[int]]:
+    """
+    Index type to build for n vectors, and its IVF cell count.
+    IVF types need enough vectors to train; smaller collections stay on FlatIP.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown kb.faiss_index_type {index_type!r}, expected one of {INDEX_TYPES}")
+    if not index_type.startswith("IVF"):
+        return index_type, None
+    nlist = params["nlist"] or max(1, int(4 * math.sqrt(max(n, 1))))
+    needed = nlist * params["train_points_per_list"]
+    if index_type == "IVFPQ":
+        needed = max(needed, 2 ** params["pq_nbits"] * params["train_points_per_list"])
+    if n < needed:
+        return "FlatIP", None
+    return index_type, nlist
+
+def build_index(index_type: str, dim: int, vectors: np.ndarray, ids: np.ndarray,
+                params: Optional[Dict] = None) -> faiss.Index:
+    """
+    Build and fill an ID-mapped inner-product index, training it on the vectors if needed.
+    Args:
+        index_type (str): One of INDEX_TYPES.
+        dim (int): Vector dimension.
+        vectors (np.ndarray): float32 array of shape (n, dim), L2-normalized.
+        ids (np.ndarray): int64 screenshot IDs.
+        params (Dict): Overrides of DEFAULT_PARAMS.
+    Returns:
+        faiss.Index: IndexIDMap2 around the requested structure.
+    """
+    params = dict(DEFAULT_PARAMS, **(params or {}))
+    kind, nlist = resolve_kind(index_type, len(ids), params)
+    if kind != index_type:
+        logger.info(f"{len(ids)} vectors are too few to train {index_type}, using FlatIP for now")
+    metric = faiss.METRIC_INNER_PRODUCT
+    if kind == "HNSW":
+        inner = faiss.IndexHNSWFlat(dim, params["hnsw_m"], metric)
+        inner.hnsw.efConstruction = params["ef_construction"]
+    elif kind == "IVFFlat":
+        inner = faiss.IndexIVFFlat(faiss.IndexFlatIP(dim), dim, nlist, metric)
+    elif kind == "IVFPQ":
+        inner = faiss.IndexIVFPQ(faiss.IndexFlatIP(dim), dim, nlist, params["pq_m"], params["pq_nbits"], metric)
+    else:
+        inner = faiss.IndexFlatIP(dim)
+    index = faiss.IndexIDMap2(inner)
+    if len(ids):
+        if not index.is_trained:
+            started = time.perf_counter()
+            index.train(vectors)
+            logger.info(f"Trained {kind} (nlist={nlist}) on {len(ids)} vectors in {time.perf_counter() - started:.1f}s")
+        index.add_with_ids(vectors, ids)
+    tune_index(index, params)
+    return index
+
+def tune_index(index: faiss.Index, params: Optional[Dict] = None) -> None:
+    """
+    Apply query-time parameters (IVF nprobe, HNSW efSearch), which are not stored in the index file.
+    """
+    params = dict(DEFAULT_PARAMS, **(params or {}))
+    kind = index_kind(index)
+    inner = faiss.downcast_index(index.index if isinstance(index, faiss.IndexIDMap) else index)
+    if kind == "HNSW":
+        inner.hnsw.efSearch = params["ef_search"]
+    elif kind.startswith("IVF"):
+        inner.nprobe = params["nprobe"]
+
+# screenshots columns holding vectors; each gets its own index file (see VectorIndex)
+EMBEDDING_COLUMNS = ("embedding", "image_embedding")
+
+def index_path_for(config: dict, column: str = "embedding") -> Path:
+    """
+    Index file of an embedding column: `kb.faiss_index_path`, or `<name>_image<suffix>` next to it.
+    """
+    path = Path(config["kb"]["faiss_index_path"])
+    return path.with_name(f"{path.stem}_image{path.suffix}") if column == "image_embedding" else path
+
+class VectorIndex:
+    """
+    Persistent FAISS index whose vector IDs are SQLite `screenshots.id`.
+    One index per embedding column: `embedding` (text) lives in
+    `kb.faiss_index_path`, `image_embedding` next to it as `<name>_image<suffix>`.
+    Vectors are added, replaced and removed in place; the index is written
+    back atomically, at most once per debounce window.
+    `kb.faiss_index_type` selects the structure. IVF indexes are trained on
+    the stored embeddings once there are enough of them. HNSW cannot delete
+    in place: a replaced vector is appended and the old copy, like a removed
+    one, is excluded from searches by graph position. The graph is rebuilt
+    from SQLite once `hnsw_compact_ratio` of it is stale, or on `compact()`.
+    A `read_only` index (search-side consumers such as KBService) rebuilds a
+    missing or stale file in memory only and never writes it; persisting
+    is left to the ingest writer.
+    """
+
+    def __init__(self, config: dict, column: str = "embedding", read_only: bool = False):
+        if column not in EMBEDDING_COLUMNS:
+            raise ValueError(f"Unknown embedding column: {column}")
+        self.config = config
+        self.column = column
+        self.read_only = read_only
+        kb_config = config["kb"]
+        self.index_path = index_path_for(config, column)
+        self.sqlite_db_path = Path(kb_config["sqlite_db_path"])
+        self.dim = int(kb_config.get("embedding_dim", 768))
+        self.index_type = kb_config.get("faiss_index_type", "FlatIP")
+        self.params = dict(DEFAULT_PARAMS, **(kb_config.get("faiss_params") or {}))
+        resolve_kind(self.index_type, 0, self.params)  # Fail fast on a typo in the config
+        persist_config = kb_config.get("faiss_persist", {})
+        self.debounce_seconds = float(persist_config.get("debounce_seconds", 2.0))
+        self.max_pending = int(persist_config.get("max_pending", 256))
+        self._lock = threading.RLock()
+        self._timer = None
+        self._pending = 0
+        self._positions: Dict[int, int] = {}  # HNSW only: live ID -> graph position
+        self._stale = set()  # HNSW only: graph positions of removed or replaced vectors
+        self._selector = None  # HNSW only: search filter over _stale, rebuilt when it changes
+        self._needs_rebuild = False
+        self.index = self._load()
+        self._loaded_mtime = self._mtime()
+
+    @property
+    def kind(self) -> str:
+        return index_kind(self.index)
+
+    def _load(self) -> faiss.Index:
+        self._positions, self._stale, self._selector = {}, set(), None
+        if self.index_path.exists():
+            try:
+                index = faiss.read_index(str(self.index_path))
+            except RuntimeError as e:
+                logger.error(f"❌ Unreadable FAISS index {self.index_path}, rebuilding: {e}")
+                index = None
+            if index is not None and not isinstance(index, faiss.IndexIDMap2):
+                # Older indexes stored vectors by position with no link back to SQLite rows
+                logger.warning(f"{self.index_path.name} is not ID-mapped, rebuilding from SQLite")
+                index = None
+            if index is not None and index.d != self.dim:
+                logger.warning(f"{self.index_path.name} has dimension {index.d}, expected {self.dim}, rebuilding")
+                index = None
+            if index is not None and index_kind(index) != resolve_kind(self.index_type, index.ntotal, self.params)[0]:
+                logger.info(f"{self.index_path.name} is {index_kind(index)}, configured {self.index_type}, rebuilding")
+                index = None
+            if index is not None and self._in_sync(index):
+                tune_index(index, self.params)
+                logger.info(f"Loaded {index_kind(index)} FAISS index {self.index_path.name} with {index.ntotal} vectors")
+                return index
+        elif not self._stored_ids():
+            return build_index(self.index_type, self.dim, *self._empty(), params=self.params)
+        return self.rebuild()
+
+    def _mtime(self) -> Optional[float]:
+        return self.index_path.stat().st_mtime_ns if self.index_path.exists() else None
+
+    def refresh(self) -> bool:
+        """
+        Reload the index if another process (e.g. an ingest) persisted a newer one.
+        Returns:
+            bool: True if the index was reloaded.
+        """
+        with self._lock:
+            mtime = self._mtime()
+            if mtime == self._loaded_mtime or self._pending or self._needs_rebuild:
+                return False
+            self.index = self._load()
+            self._loaded_mtime = self._mtime()
+            return True
+
+    def _empty(self):
+        return np.zeros((0, self.dim), dtype="float32"), np.zeros(0, dtype="int64")
+
+    def _in_sync(self, index: faiss.Index) -> bool:
+        # A crash between the SQLite commit and the next persist leaves the file behind
+        stored = self._stored_ids()
+        if index_kind(index) == "HNSW":
+            if set(self._track(index, stored)) == stored:
+                return True
+        else:
+            indexed = faiss.vector_to_array(index.id_map)
+            if len(indexed) == len(set(indexed.tolist())) and set(indexed.tolist()) == stored:
+                return True
+        logger.warning(f"{self.index_path.name} is out of sync with SQLite, rebuilding")
+        return False
+
+    def _track(self, index: faiss.Index, live_ids: Optional[set] = None) -> Dict[int, int]:
+        # HNSW only: the last copy of each live ID is its current vector, every other position is stale
+        indexed = faiss.vector_to_array(index.id_map).tolist()
+        positions = {row_id: position for position, row_id in enumerate(indexed)}
+        if live_ids is not None:
+            positions = {row_id: position for row_id, position in positions.items() if row_id in live_ids}
+        self._positions = positions
+        self._stale = set(range(len(indexed))) - set(positions.values())
+        self._selector = None
+        return positions
+
+    def _stored_ids(self) -> set:
+        if not self.sqlite_db_path.exists():
+            return set()
+        conn = sqlite3.connect(self.sqlite_db_path)
+        try:
+            return {row[0] for row in conn.execute(f"SELECT id FROM screenshots WHERE {self.column} IS NOT NULL")}
+        except sqlite3.OperationalError:
+            return set()  # No screenshots table yet
+        finally:
+            conn.close()
+
+    def _stored_vectors(self) -> Tuple[np.ndarray, np.ndarray]:
+        ids, vectors = [], []
+        if self.sqlite_db_path.exists():
+            conn = sqlite3.connect(self.sqlite_db_path)
+            try:
+                rows = conn.execute(f"SELECT id, {self.column} FROM screenshots WHERE {self.column} IS NOT NULL")
+                for row_id, blob in rows:
+                    vector = decode_embedding(blob, self.dim)
+                    if vector is None:
+                        logger.warning(f"Skipping {self.column} of screenshot {row_id}: not a {self.dim}-d vector")
+                        continue
+                    ids.append(row_id)
+                    vectors.append(vector)
+            except sqlite3.OperationalError:
+                pass
+            finally:
+                conn.close()
+        if not ids:
+            return self._empty()
+        return np.vstack(vectors), np.array(ids, dtype="int64")
+
+    def rebuild(self, index_type: Optional[str] = None) -> faiss.Index:
+        """
+        Recreate (and retrain) the index from the embeddings stored in SQLite, then persist it
+        unless the index is read-only.
+        Args:
+            index_type (str): Structure to build; defaults to `kb.faiss_index_type`.
+        Returns:
+            faiss.Index: The new index.
+        """
+        with self._lock:
+            started = time.perf_counter()
+            vectors, ids = self._stored_vectors()
+            index = build_index(index_type or self.index_type, self.dim, vectors, ids, self.params)
+            logger.info(
+                f"Rebuilt {index_kind(index)} FAISS index {self.index_path.name} with {index.ntotal} vectors from SQLite "
+                f"in {time.perf_counter() - started:.1f}s"
+            )
+            self.index = index
+            self._positions, self._stale, self._selector = {}, set(), None
+            if index_kind(index) == "HNSW":
+                self._track(index)
+            self._needs_rebuild = False
+            if not self.read_only:
+                self.flush(force=True)
+            return index
+
+    def compact(self) -> bool:
+        """
+        Rebuild an HNSW graph now, dropping its removed and replaced vectors.
+        Returns:
+            bool: True if there was anything to drop.
+        """
+        with self._lock:
+            if not self._stale:
+                return False
+            self.rebuild()
+            return True
+
+    def _check_compaction(self) -> None:
+        if len(self._stale) > self.params["hnsw_compact_ratio"] * self.index.ntotal:
+            self._needs_rebuild = True
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal - len(self._stale)
+
+    def upsert(self, ids: List[int], vectors: np.ndarray) -> None:
+        """
+        Add vectors, replacing any existing vector with the same ID.
+        Args:
+            ids (List[int]): SQLite screenshot IDs.
+            vectors (np.ndarray): float32 array of shape (len(ids), dim), L2-normalized.
+        """
+        if not ids:
+            return
+        vectors = np.ascontiguousarray(vectors, dtype="float32").reshape(len(ids), -1)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dimensional embeddings, got {vectors.shape[1]}")
+        id_array = np.array(ids, dtype="int64")
+        with self._lock:
+            if self.kind == "HNSW":
+                start = self.index.ntotal
+                self.index.add_with_ids(vectors, id_array)
+                for offset, row_id in enumerate(ids):
+                    previous = self._positions.get(row_id)
+                    if previous is not None:
+                        self._stale.add(previous)
+                    self._positions[row_id] = start + offset
+                self._selector = None
+                self._check_compaction()
+            else:
+                self.index.remove_ids(id_array)
+                self.index.add_with_ids(vectors, id_array)
+                # Retrain once a FlatIP stand-in has enough vectors for the configured IVF index
+                if self.kind != resolve_kind(self.index_type, self.index.ntotal, self.params)[0]:
+                    self._needs_rebuild = True
+            self._mark_dirty(len(ids))
+
+    def remove(self, ids: Iterable[int]) -> int:
+        """
+        Remove vectors by screenshot ID.
+        Returns:
+            int: Number of vectors removed.
+        """
+        id_array = np.array(list(ids), dtype="int64")
+        if not id_array.size:
+            return 0
+        with self._lock:
+            if self.kind == "HNSW":
+                positions = [self._positions.pop(row_id, None) for row_id in id_array.tolist()]
+                removed_positions = [position for position in positions if position is not None]
+                self._stale.update(removed_positions)
+                self._selector = None
+                removed = len(removed_positions)
+                self._check_compaction()
+            else:
+                removed = self.index.remove_ids(id_array)
+            if removed:
+                self._mark_dirty(removed)
+            return removed
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Nearest neighbours by cosine similarity.
+        Args:
+            queries (np.ndarray): float32 array of shape (n, dim), L2-normalized.
+            k (int): Neighbours per query.
+        Returns:
+            Tuple: (scores, screenshot IDs), each of shape (n, k); missing hits have ID -1.
+        """
+        queries = np.ascontiguousarray(queries, dtype="float32").reshape(-1, self.dim)
+        with self._lock:
+            if not self._stale:
+                return self.index.search(queries, k)
+            # Search the graph itself, skipping stale positions, then map positions back to IDs
+            if self._selector is None:
+                stale = faiss.IDSelectorBatch(np.fromiter(self._stale, dtype="int64", count=len(self._stale)))
+                self._selector = (stale, faiss.IDSelectorNot(stale))  # The batch must outlive the Not
+            params = faiss.SearchParametersHNSW(sel=self._selector[1], efSearch=self.params["ef_search"])
+            scores, positions = self.index.index.search(queries, k, params=params)
+            labels = faiss.rev_swig_ptr(self.index.id_map.data(), self.index.id_map.size())
+            ids = np.where(positions >= 0, labels[np.maximum(positions, 0)], -1)
+        return scores, ids
+
+    def _mark_dirty(self, count: int) -> None:
+        self._pending += count
+        if self._pending >= self.max_pending or self.debounce_seconds <= 0:
+            self.flush()
+        elif self._timer is None:
+            self._timer = threading.Timer(self.debounce_seconds, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self, force: bool = False) -> None:
+        """
+        Persist pending changes: write to a temporary file, fsync, then swap it in.
+        A pending HNSW compaction or IVF (re)training happens here as a rebuild.
+        Read-only indexes only apply that rebuild in memory.
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._needs_rebuild:
+                self.rebuild()
+                return
+            if self.read_only:
+                self._pending = 0
+                return
+            if not self._pending and not force:
+                return
+            started = time.perf_counter()
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.index_path.with_suffix(self.index_path.suffix + ".tmp")
+            faiss.write_index(self.index, str(tmp_path))
+            with open(tmp_path, "rb") as f:
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.index_path)
+            self._loaded_mtime = self._mtime()
+            logger.debug(f"Persisted {self.index.ntotal} vectors in {time.perf_counter() - started:.3f}s")
+            self._pending = 0
+
+    def close(self) -> None:
+        self.flush()
@@ -1,6 +1,23 @@
 import unittest
+import copy
+import importlib.util
+import threading
+import time
+from unittest import mock
+import json
+import tempfile
+from pathlib import Path
+import numpy as np
 from fastapi.testclient import TestClient
 from src.backend.main import app
+from src.backend.services.kb_service import KBService
+from src.backend.services.generation_service import GenerationService
+from src.generation.llm_adapter import LLM_CACHE_LOOKUPS, LLM_CACHE_SAVED_SECONDS, LLMAdapter
+from src.backend.utils.db import SQLitePool
+from concurrent.futures import ThreadPoolExecutor
+from src.ingestion.kb_writer import KBWriter
+from src.ingestion.kb_schema import SCHEMA_VERSION
+import sqlite3
 
 client = TestClient(app)
 
@@ -36,5 +53,778 @@ class TestBackend(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn("message", response.json())
 
+class TestSearch(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        tmp = Path(self.tmp.name)
+        self.config = copy.deepcopy(app.state.config)
+        for key, name in (("sqlite_db_path", "kb.sqlite"), ("faiss_index_path", "faiss.index"),
+                          ("metadata_json_path", "metadata.json"), ("metadata_jsonl_path", "metadata.jsonl")):
+            self.config["kb"][key] = str(tmp / name)
+        self.config["kb"]["embedding_dim"] = 4
+        writer = KBWriter(self.config)
+        vectors = [[1, 0, 0, 0], [0.9, 0.1, 0, 0], [0.8, 0, 0.2, 0], [0.5, 0, 0, 0.5]]
+        writer.write_batch([
+            {"filename": f"{i}.png", "feature_name": "Flash" if i < 2 else "Timer", "screens": [],
+             "transitions": [], "image_path": f"{i}.png", "embedding": vector, "status": None}
+            for i, vector in enumerate(vectors)
+        ])
+        writer.close()
+        self.kb_service = KBService(self.config)
+
+    def tearDown(self):
+        app.state.kb_service = None
+        self.tmp.cleanup()
+
+    def test_search_by_id_excludes_the_query_entry(self):
+        results = self.kb_service.search([{"id": 1}, {"id": 4}], k=2)
+        self.assertEqual([hit["id"] for hit in results[0]], [2, 3])
+        self.assertEqual(results[1][0]["id"], 1)
+        self.assertGreater(results[0][0]["score"], results[0][1]["score"])
+
+    def test_search_filters_on_feature_name(self):
+        results = self.kb_service.search([{"id": 1}], k=3, feature_name="Timer")
+        self.assertEqual([hit["id"] for hit in results[0]], [3, 4])
+        self.assertTrue(all(hit["feature_name"] == "Timer" for hit in results[0]))
+
+    def test_broad_filters_search_the_index(self):
+        # Above exact_filter_max the rows are not decoded; the ANN index is over-fetched instead
+        self.kb_service.exact_filter_max = 1
+        with mock.patch.object(self.kb_service.index, "search", wraps=self.kb_service.index.search) as ann:
+            results = self.kb_service.search([{"id": 1}], k=3, feature_name="Timer")
+        ann.assert_called()
+        self.assertEqual([hit["id"] for hit in results[0]], [3, 4])
+        self.kb_service.exact_filter_max = 2000
+        self.assertEqual(self.kb_service.search([{"id": 1}], k=3, feature_name="Missing"), [[]])
+
+    def test_image_queries_search_the_image_vectors(self):
+        # Image vectors point the other way round from the text vectors: 4.png looks most like the query
+        writer = KBWriter(self.config)
+        writer.set_embeddings([1, 2, 3, 4], np.eye(4, dtype="float32")[::-1], "image_embedding")
+        writer.close()
+        kb_service = KBService(self.config)
+        with mock.patch.object(kb_service.embedder, "encode_images",
+                               return_value=np.array([[0.9, 0, 0, 0.1]], dtype="float32")):
+            by_image, by_id = kb_service.search([{"image": b"png bytes"}, {"id": 2}], k=1)
+        self.assertEqual(by_image[0]["id"], 4)
+        self.assertEqual(by_id[0]["id"], 1)
+        with mock.patch.object(kb_service.embedder, "encode_images",
+                               return_value=np.array([[0.9, 0, 0, 0.1]], dtype="float32")):
+            filtered = kb_service.search([{"image": b"png bytes"}], k=1, feature_name="Flash")
+        self.assertEqual(filtered[0][0]["id"], 1)
+
+    def test_search_endpoint(self):
+        app.state.kb_service = self.kb_service
+        response = client.post("/api/v1/search", json={"queries": [{"id": 1}], "k": 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"][0][0]["filename"], "1.png")
+
+        response = client.post("/api/v1/search", json={"queries": [{"id": 99}]})
+        self.assertEqual(response.status_code, 400)
+
+class TestKBSchema(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        tmp = Path(self.tmp.name)
+        self.config = copy.deepcopy(app.state.config)
+        for key, name in (("sqlite_db_path", "kb.sqlite"), ("faiss_index_path", "faiss.index"),
+                          ("metadata_json_path", "metadata.json"), ("metadata_jsonl_path", "metadata.jsonl")):
+            self.config["kb"][key] = str(tmp / name)
+        self.config["kb"]["embedding_dim"] = 4
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_legacy_json_columns_are_migrated(self):
+        conn = sqlite3.connect(self.config["kb"]["sqlite_db_path"])
+        conn.execute(
+            "CREATE TABLE screenshots (id INTEGER PRIMARY KEY AUTOINCREMENT, filename TEXT NOT NULL, "
+            "feature_name TEXT, gesture TEXT, conditions TEXT, errors TEXT, languages TEXT, text TEXT, "
+            "image_path TEXT, version INTEGER DEFAULT 1, status TEXT DEFAULT 'pending', "
+            "created_at DATETIME DEFAULT CURRENT_TIMESTAMP)"
+        )
+        conn.execute(
+            "INSERT INTO screenshots (filename, feature_name, gesture, conditions, errors, languages, text, image_path) "
+            "VALUES ('a.png', 'Flash', ?, ?, '[]', '[\"ko\"]', ?, 'a.png')",
+            ('[{"type": "tap", "target": "flash_button", "bbox": [1, 2, 3, 4], "confidence": 0.9}]',
+             '["flash_on"]', '[{"text": "Flash", "lang": "en"}]')
+        )
+        conn.commit()
+        conn.close()
+
+        kb_service = KBService(self.config)
+        screenshot = kb_service.get_screenshot_by_id(1)
+        kb_service.close()
+        self.assertEqual(screenshot["gestures"][0]["target"], "flash_button")
+        self.assertEqual(screenshot["gestures"][0]["bbox"], [1, 2, 3, 4])
+        self.assertEqual(screenshot["conditions"], ["flash_on"])
+        self.assertEqual(screenshot["languages"], ["ko"])
+        self.assertEqual(screenshot["text"], [{"text": "Flash", "lang": "en"}])
+
+        conn = sqlite3.connect(self.config["kb"]["sqlite_db_path"])
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(screenshots)")}
+        self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0], SCHEMA_VERSION)
+        conn.close()
+        self.assertFalse({"gesture", "conditions", "errors", "languages", "text"} & columns)
+        # Migrations are idempotent
+        KBService(self.config).close()
+
+    def test_lists_round_trip_and_filter_in_sql(self):
+        writer = KBWriter(self.config)
+        writer.write_batch([
+            {"filename": f"{i}.png", "feature_name": "Flash" if i < 2 else "Timer", "screens": [],
+             "transitions": [], "image_path": f"{i}.png", "embedding": None,
+             "gestures": [{"type": "tap", "target": f"button_{i}", "bbox": [0, 0, 1, 1], "confidence": 1.0}],
+             "conditions": ["flash_on"] if i == 0 else [], "languages": ["en"]}
+            for i in range(3)
+        ])
+        writer.close()
+
+        kb_service = KBService(self.config)
+        kb_service.update_screenshot(3, {"status": "accepted", "gherkin": "Feature: Timer"})
+        accepted = kb_service.get_all_screenshots(status="accepted")
+        flash = kb_service.get_all_screenshots(feature_name="Flash")
+        counts = kb_service.count_by_feature()
+        with self.assertRaises(ValueError):
+            kb_service.update_screenshot(1, {"filename": "other.png"})
+        with self.assertRaises(ValueError):
+            kb_service.update_screenshots([(1, {"status": "accepted"}), (2, {})])
+        unchanged = kb_service.get_screenshot_by_id(1)["status"]
+        kb_service.close()
+        self.assertIsNone(unchanged)
+
+        self.assertEqual([s["id"] for s in accepted], [3])
+        self.assertEqual(accepted[0]["gestures"][0]["target"], "button_2")
+        self.assertNotIn("screens", accepted[0])
+        self.assertEqual(sorted(s["id"] for s in flash), [1, 2])
+        self.assertEqual(next(s for s in flash if s["id"] == 1)["conditions"], ["flash_on"])
+        self.assertEqual(counts, {"Flash": 2, "Timer": 1})
+
+class TestListing(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        tmp = Path(self.tmp.name)
+        self.config = copy.deepcopy(app.state.config)
+        for key, name in (("sqlite_db_path", "kb.sqlite"), ("faiss_index_path", "faiss.index"),
+                          ("metadata_json_path", "metadata.json"), ("metadata_jsonl_path", "metadata.jsonl")):
+            self.config["kb"][key] = str(tmp / name)
+        self.config["kb"]["embedding_dim"] = 4
+        writer = KBWriter(self.config)
+        writer.write_batch([
+            {"filename": f"{i}.png", "feature_name": "Flash" if i % 2 else "Timer", "screens": [],
+             "transitions": [], "image_path": f"{i}.png", "embedding": [1, 0, 0, i], "conditions": [f"c{i}"]}
+            for i in range(7)
+        ])
+        writer.close()
+        self.kb_service = KBService(self.config)
+
+    def tearDown(self):
+        app.state.kb_service = None
+        self.kb_service.close()
+        self.tmp.cleanup()
+
+    def test_pages_cover_every_row_once(self):
+        ids, cursor = [], None
+        while True:
+            rows, cursor = self.kb_service.list_screenshots(limit=3, cursor=cursor)
+            ids += [row["id"] for row in rows]
+            if cursor is None:
+                break
+        self.assertEqual(ids, [7, 6, 5, 4, 3, 2, 1])
+        streamed = self.kb_service.iter_screenshots(status=None, feature_name="Flash", page_size=2)
+        self.assertEqual([row["id"] for row in streamed], [6, 4, 2])
+
+    def test_projection(self):
+        rows, _ = self.kb_service.list_screenshots(fields=["filename", "conditions"])
+        self.assertEqual(rows[0], {"id": 7, "filename": "6.png", "conditions": ["c6"]})
+        rows, _ = self.kb_service.list_screenshots(include_embedding=True)
+        self.assertEqual(rows[0]["embedding"].shape, (4,))
+        self.assertNotIn("embedding", self.kb_service.get_all_screenshots()[0])
+        with self.assertRaises(ValueError):
+            self.kb_service.iter_screenshots(fields=["secret"])
+
+    def test_ndjson_endpoint(self):
+        app.state.kb_service = self.kb_service
+        response = client.get("/api/v1/screenshots", params={"limit": 4, "fields": "filename"})
+        self.assertEqual(response.status_code, 200)
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual([line["id"] for line in lines], [7, 6, 5, 4])
+        response = client.get("/api/v1/screenshots", params={"cursor": response.headers["X-Next-Cursor"]})
+        self.assertEqual([json.loads(line)["id"] for line in response.text.splitlines()], [3, 2, 1])
+        self.assertNotIn("X-Next-Cursor", response.headers)
+        response = client.get("/api/v1/screenshots", params={"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, 400)
+
+class TestRecordCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        tmp = Path(self.tmp.name)
+        self.config = copy.deepcopy(app.state.config)
+        for key, name in (("sqlite_db_path", "kb.sqlite"), ("faiss_index_path", "faiss.index"),
+                          ("metadata_json_path", "metadata.json"), ("metadata_jsonl_path", "metadata.jsonl")):
+            self.config["kb"][key] = str(tmp / name)
+        self.config["kb"]["embedding_dim"] = 4
+        self.writer = KBWriter(self.config)
+        self.writer.write_batch([
+            {"filename": f"{i}.png", "feature_name": "Flash", "screens": [{"id": "screen_home"}],
+             "transitions": [], "image_path": f"{i}.png", "embedding": None, "conditions": ["flash_on"]}
+            for i in range(2)
+        ])
+        self.kb_service = KBService(self.config)
+
+    def tearDown(self):
+        self.kb_service.close()
+        self.writer.close()
+        self.tmp.cleanup()
+
+    def test_hits_return_private_copies(self):
+        first = self.kb_service.get_screenshot_by_id(1)
+        first["conditions"].append("mutated")
+        second = self.kb_service.get_screenshot_by_id(1)
+        self.assertEqual(second["conditions"], ["flash_on"])
+        self.assertEqual(self.kb_service.cache.stats()["hits"], 1)
+        self.assertGreater(self.kb_service.cache.stats()["size_bytes"], 0)
+
+    def test_own_update_only_drops_that_record(self):
+        self.kb_service.get_screenshot_by_id(1)
+        self.kb_service.get_screenshot_by_id(2)
+        self.kb_service.update_screenshot(1, {"status": "accepted"})
+        self.assertEqual(self.kb_service.get_screenshot_by_id(1)["status"], "accepted")
+        self.kb_service.get_screenshot_by_id(2)
+        self.assertEqual(self.kb_service.cache.stats()["hits"], 1)
+
+    def test_writes_from_other_processes_invalidate(self):
+        self.kb_service.get_screenshot_by_id(1)
+        self.writer.write_batch([
+            {"id": 1, "filename": "0.png", "feature_name": "Timer", "screens": [], "transitions": [],
+             "image_path": "0.png", "embedding": None}
+        ])
+        self.assertEqual(self.kb_service.get_screenshot_by_id(1)["feature_name"], "Timer")
+        other = KBService(self.config)
+        other.update_screenshot(1, {"gherkin": "Feature: Timer"})
+        other.close()
+        self.assertEqual(self.kb_service.get_screenshot_by_id(1)["gherkin"], "Feature: Timer")
+
+    def test_lru_bound_and_metrics(self):
+        self.kb_service.cache.max_entries = 1
+        self.kb_service.get_screenshot_by_id(1)
+        self.kb_service.get_screenshot_by_id(2)
+        self.assertEqual(self.kb_service.cache.stats()["entries"], 1)
+        self.assertEqual(self.kb_service.cache.stats()["evictions"], 1)
+        response = client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("camera_testgen_kb_cache_hit_ratio", response.text)
+
+class TestTextSearch(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        tmp = Path(self.tmp.name)
+        self.config = copy.deepcopy(app.state.config)
+        for key, name in (("sqlite_db_path", "kb.sqlite"), ("faiss_index_path", "faiss.index"),
+                          ("metadata_json_path", "metadata.json"), ("metadata_jsonl_path", "metadata.jsonl")):
+            self.config["kb"][key] = str(tmp / name)
+        self.config["kb"]["embedding_dim"] = 4
+        writer = KBWriter(self.config)
+        writer.write_batch([
+            {"filename": "timer.png", "feature_name": "Timer", "image_path": "timer.png", "embedding": None,
+             "screens": [{"id": "screen_timer", "description": "Timer settings",
+                          "text_content": ["타이머 설정", "3초"],
+                          "annotations": [{"number": "1", "explanation": "Countdown starts after tap"}]}],
+             "transitions": [{"from_screen": "screen_home", "to_screen": "screen_timer",
+                              "trigger_element": "Timer icon", "action": "Tap"}]},
+            {"filename": "flash.png", "feature_name": "Flash", "image_path": "flash.png", "embedding": None,
+             "screens": [{"id": "screen_flash", "text_content": ["플래시 켜짐"]}], "transitions": [],
+             "text": [{"text": "Flash auto mode", "lang": "en"}]},
+        ])
+        writer.close()
+        self.kb_service = KBService(self.config)
+
+    def tearDown(self):
+        app.state.kb_service = None
+        self.kb_service.close()
+        self.tmp.cleanup()
+
+    def test_korean_and_english_terms(self):
+        self.assertEqual([hit["id"] for hit in self.kb_service.text_search("타이머")], [1])
+        hits = self.kb_service.text_search("countdown 플래시")
+        self.assertEqual(sorted(hit["id"] for hit in hits), [1, 2])
+        self.assertIn("<mark>플래시</mark>", next(hit for hit in hits if hit["id"] == 2)["snippet"])
+        self.assertEqual([hit["id"] for hit in self.kb_service.text_search("timer countdown", match="all")], [1])
+        self.assertEqual([hit["id"] for hit in self.kb_service.text_search("auto mode")], [2])
+
+    def test_short_terms_and_filters(self):
+        hits = self.kb_service.text_search("설정")
+        self.assertEqual([hit["id"] for hit in hits], [1])
+        self.assertIn("<mark>설정</mark>", hits[0]["snippet"])
+        self.assertEqual(self.kb_service.text_search("timer", feature_name="Flash"), [])
+
+    def test_short_terms_page_in_score_order(self):
+        writer = KBWriter(self.config)
+        writer.write_batch([{"filename": "grid.png", "feature_name": "Grid", "image_path": "grid.png",
+                             "embedding": None, "screens": [{"id": "screen_grid", "text_content": ["격자 설정"]}],
+                             "transitions": []}])
+        writer.close()
+        first, second = (self.kb_service.text_search("3초 설정", limit=1, offset=offset)[0] for offset in (0, 1))
+        self.assertEqual((first["id"], first["score"]), (1, 1.0))
+        self.assertEqual((second["id"], second["score"]), (3, 0.5))
+
+    def test_index_follows_updates_and_deletes(self):
+        self.kb_service.update_screenshot(2, {"gherkin": "Scenario: Flash turns on in low light"})
+        self.assertEqual([hit["id"] for hit in self.kb_service.text_search("low light")], [2])
+        writer = KBWriter(self.config)
+        writer.delete([1])
+        writer.close()
+        self.assertEqual(self.kb_service.text_search("타이머"), [])
+
+    def test_rewritten_records_are_indexed_once(self):
+        # Re-ingested with OCR text copied from text_content, as MetadataBuilder does
+        writer = KBWriter(self.config)
+        writer.write_batch([
+            {"id": 2, "filename": "flash.png", "feature_name": "Flash", "image_path": "flash.png", "embedding": None,
+             "screens": [{"id": "screen_flash", "text_content": ["플래시 꺼짐"]}], "transitions": [],
+             "text": [{"text": "플래시 꺼짐", "lang": "en"}, {"text": "Night mode", "lang": "en"}]},
+        ])
+        writer.close()
+        with self.kb_service.pool.connection() as conn:
+            screen_text = conn.execute("SELECT screen_text FROM screenshots_fts WHERE rowid = 2").fetchone()[0]
+        self.assertEqual(sorted(screen_text.split("\n")), ["Night mode", "플래시 꺼짐"])
+        self.assertEqual(self.kb_service.text_search("auto"), [])
+        self.assertEqual([hit["id"] for hit in self.kb_service.text_search("night")], [2])
+
+    def test_other_writers_are_indexed_before_searching(self):
+        with self.kb_service.pool.connection() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM screenshots_fts_dirty").fetchone()[0], 0)
+        conn = sqlite3.connect(self.config["kb"]["sqlite_db_path"])
+        conn.execute("INSERT INTO screenshot_texts (screenshot_id, position, text) VALUES (1, 0, 'Macro lens')")
+        conn.commit()
+        conn.close()
+        self.assertEqual([hit["id"] for hit in self.kb_service.text_search("macro")], [1])
+        self.assertEqual([hit["id"] for hit in self.kb_service.text_search("타이머")], [1])
+
+    def test_endpoint(self):
+        app.state.kb_service = self.kb_service
+        response = client.get("/api/v1/search/text", params={"q": "Timer icon"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"][0]["filename"], "timer.png")
+        self.assertEqual(client.get("/api/v1/search/text", params={"q": " "}).status_code, 400)
+
+class TestScreenGraph(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        tmp = Path(self.tmp.name)
+        self.config = copy.deepcopy(app.state.config)
+        for key, name in (("sqlite_db_path", "kb.sqlite"), ("faiss_index_path", "faiss.index"),
+                          ("metadata_json_path", "metadata.json"), ("metadata_jsonl_path", "metadata.jsonl")):
+            self.config["kb"][key] = str(tmp / name)
+        self.config["kb"]["embedding_dim"] = 4
+
+        def flow(*steps):
+            return [{"from_screen": a, "to_screen": b, "trigger_element": f"{b} button", "action": "Tap"}
+                    for a, b in steps]
+        self.writer = KBWriter(self.config)
+        self.writer.write_batch([
+            {"filename": "a.png", "feature_name": "Settings", "image_path": "a.png", "embedding": None,
+             "screens": [{"id": "screen_home"}, {"id": "screen_menu"}, {"id": "screen_settings"}],
+             "transitions": flow(("screen_home", "screen_menu"), ("screen_menu", "screen_settings"))},
+            {"filename": "b.png", "feature_name": "Timer", "image_path": "b.png", "embedding": None,
+             "screens": [{"id": "screen_home"}, {"id": "screen_timer"}],
+             "transitions": flow(("screen_home", "screen_timer"), ("screen_timer", "screen_settings"),
+                                 ("screen_settings", "screen_home"))},
+        ])
+        self.kb_service = KBService(self.config)
+
+    def tearDown(self):
+        app.state.kb_service = None
+        self.kb_service.close()
+        self.writer.close()
+        self.tmp.cleanup()
+
+    def test_neighbors(self):
+        out = self.kb_service.graph.neighbors("screen_home")
+        self.assertEqual(sorted(edge["to_screen"] for edge in out), ["screen_menu", "screen_timer"])
+        incoming = self.kb_service.graph.neighbors("screen_settings", direction="in", feature_name="Timer")
+        self.assertEqual([(edge["from_screen"], edge["screenshot_ids"]) for edge in incoming], [("screen_timer", [2])])
+
+    def test_paths(self):
+        graph = self.kb_service.graph
+        path = graph.shortest_path("screen_home", "screen_settings")
+        self.assertEqual(len(path), 2)
+        self.assertEqual(path[0]["triggers"][0]["action"], "Tap")
+        paths = graph.paths("screen_home", "screen_settings", max_depth=3)
+        self.assertEqual(
+            [[hop["to_screen"] for hop in p] for p in paths],
+            [["screen_menu", "screen_settings"], ["screen_timer", "screen_settings"]]
+        )
+        self.assertEqual(len(graph.paths("screen_home", "screen_settings", feature_name="Settings")), 1)
+        self.assertIsNone(graph.shortest_path("screen_home", "screen_settings", max_depth=1))
+
+    def test_graph_follows_writes(self):
+        self.assertEqual(len(self.kb_service.graph.shortest_path("screen_settings", "screen_timer")), 2)
+        self.writer.write_batch([
+            {"filename": "c.png", "feature_name": "Timer", "image_path": "c.png", "embedding": None, "screens": [],
+             "transitions": [{"from_screen": "screen_settings", "to_screen": "screen_timer", "action": "Tap"}]}
+        ])
+        self.assertEqual(len(self.kb_service.graph.shortest_path("screen_settings", "screen_timer")), 1)
+        self.writer.delete([3])
+        app.state.kb_service = self.kb_service
+        response = client.get("/api/v1/graph/path", params={"source": "screen_settings", "target": "screen_timer"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([hop["to_screen"] for hop in response.json()["path"]],
+                         ["screen_home", "screen_timer"])
+
+class TestKBStorage(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        tmp = Path(self.tmp.name)
+        self.config = copy.deepcopy(app.state.config)
+        for key, name in (("sqlite_db_path", "kb.sqlite"), ("faiss_index_path", "faiss.index"),
+                          ("metadata_json_path", "metadata.json"), ("metadata_jsonl_path", "metadata.jsonl")):
+            self.config["kb"][key] = str(tmp / name)
+        self.config["kb"]["embedding_dim"] = 4
+        self.vectors = np.eye(4, dtype="float32")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def record(self, i, feature_name="Camera"):
+        return {"filename": f"{i}.png", "feature_name": feature_name, "image_path": f"{i}.png",
+                "embedding": self.vectors[i].tolist(),
+                "screens": [{"id": f"screen_{i}", "description": "카메라 미리보기", "text_content": [f"Shutter{i}"]}],
+                "transitions": [{"from_screen": f"screen_{i}", "to_screen": "screen_home", "action": "Tap"}]}
+
+    def test_codec_round_trips(self):
+        from src.ingestion.kb_codec import KBCodec, decode_embedding, encode_embedding
+        vector = self.vectors[1] * 0.6 + self.vectors[2] * 0.8
+        for dtype, size, tolerance in (("float32", 16, 0), ("float16", 12, 1e-3), ("int8", 12, 1e-2)):
+            blob = encode_embedding(vector, dtype)
+            self.assertEqual(len(blob), size)
+            np.testing.assert_allclose(decode_embedding(blob, 4), vector, atol=tolerance)
+        self.assertIsNone(decode_embedding(b"\x00" * 10, 4))
+
+        KBWriter(self.config).close()  # Creates kb_dictionaries
+        self.config["kb"]["storage"] = {"payload_encoding": "zlib"}
+        codec = KBCodec(self.config)
+        payload = [self.record(i)["screens"] for i in range(3)]
+        plain = codec.encode_payload(payload)
+        conn = sqlite3.connect(self.config["kb"]["sqlite_db_path"])
+        codec.add_dictionary(conn, "zlib", codec.train_dictionary(payload))
+        conn.commit()
+        conn.close()
+        with_dictionary = codec.encode_payload(payload)
+        self.assertLess(len(with_dictionary), len(plain))
+        # A new codec finds the dictionary in the KB
+        fresh = KBCodec(self.config)
+        self.assertEqual(fresh.decode_payload(with_dictionary), payload)
+        self.assertEqual(fresh.decode_payload(plain), payload)
+        self.assertEqual(fresh.decode_payload(json.dumps(payload)), payload)
+
+    def test_encoded_kb_is_searchable(self):
+        writer = KBWriter(self.config)
+        writer.write_batch([self.record(0)])  # Plain JSON / float32
+        writer.close()
+        self.config["kb"]["storage"] = {"payload_encoding": "zlib", "embedding_dtype": "int8",
+                                        "sidecar_embeddings": "omit"}
+        writer = KBWriter(self.config)
+        writer.write_batch([self.record(1), self.record(2, "Timer")])
+        writer.close()
+        conn = sqlite3.connect(self.config["kb"]["sqlite_db_path"])
+        kinds = conn.execute("SELECT typeof(screens), length(embedding) FROM screenshots ORDER BY id").fetchall()
+        conn.close()
+        self.assertEqual(kinds, [("text", 16), ("blob", 12), ("blob", 12)])
+        with open(self.config["kb"]["metadata_jsonl_path"], encoding="utf-8") as f:
+            self.assertIsNone(json.loads(f.readlines()[-1])["embedding"])
+
+        kb_service = KBService(self.config)
+        try:
+            self.assertEqual(kb_service.get_screenshot_by_id(2)["screens"], self.record(1)["screens"])
+            results = kb_service.search([{"id": 2}], k=3)[0]
+            self.assertEqual(len(results), 2)
+            self.assertEqual([hit["id"] for hit in kb_service.search([{"id": 3}], k=1, feature_name="Timer")[0]], [])
+            hits = kb_service.text_search("Shutter2")
+            self.assertEqual([hit["id"] for hit in hits], [3])
+            self.assertEqual(
+                [edge["screenshot_ids"] for edge in kb_service.graph.neighbors("screen_home", direction="in")],
+                [[1], [2], [3]]
+            )
+            rows = {row["id"]: row for row in kb_service.iter_screenshots(include_embedding=True)}
+            np.testing.assert_allclose(rows[3]["embedding"], self.vectors[2], atol=1e-2)
+            kb_service.update_screenshot(3, {"gherkin": "Feature: Timer"})  # Refreshes the FTS row through kb_json
+            self.assertEqual([hit["id"] for hit in kb_service.text_search("Feature: Timer")], [3])
+        finally:
+            kb_service.close()
+
+
+@unittest.skipUnless(importlib.util.find_spec("pyarrow"), "KB snapshots need pyarrow")
+class TestKBSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.configs = []
+        for side in ("source", "target"):
+            tmp = Path(self.tmp.name) / side
+            config = copy.deepcopy(app.state.config)
+            for key, name in (("sqlite_db_path", "kb.sqlite"), ("faiss_index_path", "faiss.index"),
+                              ("metadata_json_path", "metadata.json"), ("metadata_jsonl_path", "metadata.jsonl")):
+                config["kb"][key] = str(tmp / name)
+            config["kb"]["embedding_dim"] = 4
+            config["kb"]["snapshot"] = {"batch_rows": 2}
+            self.configs.append(config)
+        self.configs[0]["kb"]["storage"] = {"payload_encoding": "zlib", "embedding_dtype": "float16"}
+        writer = KBWriter(self.configs[0])
+        writer.write_batch([
+            {"filename": f"{i}.png", "feature_name": "Camera", "image_path": f"{i}.png",
+             "embedding": np.eye(4)[i].tolist() if i < 3 else None,
+             "screens": [{"id": f"screen_{i}", "text_content": [f"Shutter{i}"]}],
+             "transitions": [{"from_screen": f"screen_{i}", "to_screen": "screen_home", "action": "Tap"}],
+             "gestures": [{"type": "tap", "target": "Shutter", "confidence": 0.5}], "text": [{"text": f"ocr{i}"}]}
+            for i in range(5)
+        ])
+        writer.delete([5])
+        writer.close()
+        self.bundle = Path(self.tmp.name) / "bundle"
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_round_trip(self):
+        from src.ingestion.kb_snapshot import KBSnapshot
+        manifest = KBSnapshot(self.configs[0]).export(self.bundle)
+        self.assertEqual(manifest["tables"]["screenshots"]["rows"], 4)
+        self.assertEqual(manifest["metadata"]["records"], 4)
+        self.assertEqual(manifest["index"]["vectors"], 3)
+        with self.assertRaises(FileExistsError):
+            KBSnapshot(self.configs[0]).export(self.bundle)
+
+        loaded = KBSnapshot(self.configs[1]).load(self.bundle)
+        self.assertEqual((loaded["screenshots"], loaded["screenshot_gestures"]), (4, 4))
+        with self.assertRaises(ValueError):
+            KBSnapshot(self.configs[1]).load(self.bundle)  # Target is no longer empty
+        source, target = KBService(self.configs[0]), KBService(self.configs[1])
+        try:
+            for screenshot_id in (1, 4):
+                self.assertEqual(target.get_screenshot_by_id(screenshot_id), source.get_screenshot_by_id(screenshot_id))
+            self.assertEqual([hit["id"] for hit in target.text_search("ocr2")], [3])
+            self.assertEqual(len(target.graph.neighbors("screen_home", direction="in")), 4)
+            self.assertEqual(target.index.ntotal, 3)
+            self.assertEqual([hit["id"] for hit in target.search([{"id": 2}], k=1)[0]],
+                             [hit["id"] for hit in source.search([{"id": 2}], k=1)[0]])
+        finally:
+            source.close()
+            target.close()
+        self.assertEqual(KBSnapshot(self.configs[1]).load(self.bundle, replace=True)["screenshots"], 4)
+
+    def test_corrupt_bundle_is_rejected(self):
+        from src.ingestion.kb_snapshot import KBSnapshot
+        KBSnapshot(self.configs[0]).export(self.bundle)
+        with open(self.bundle / "screenshots.parquet", "ab") as f:
+            f.write(b"x")
+        with self.assertRaises(ValueError):
+            KBSnapshot(self.configs[1]).load(self.bundle)
+        self.assertFalse(Path(self.configs[1]["kb"]["sqlite_db_path"]).exists())
+
+
+class TestGeneration(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        tmp = Path(self.tmp.name)
+        self.config = copy.deepcopy(app.state.config)
+        for key, name in (("sqlite_db_path", "kb.sqlite"), ("faiss_index_path", "faiss.index"),
+                          ("metadata_json_path", "metadata.json"), ("metadata_jsonl_path", "metadata.jsonl")):
+            self.config["kb"][key] = str(tmp / name)
+        self.config["kb"]["embedding_dim"] = 4
+        self.config["generation"].update({"rule_priority": False, "workers": 4, "llm_concurrency": 2,
+                                          "write_batch_size": 3})
+        self.config["generation"]["llm_cache"] = {"enabled": False}
+        writer = KBWriter(self.config)
+        writer.write_batch([
+            {"filename": f"{i}.png", "feature_name": "Camera", "image_path": f"{i}.png", "embedding": None,
+             "screens": [], "transitions": [], "gestures": [{"type": "tap", "target": "Shutter"}]}
+            for i in range(10)
+        ])
+        writer.close()
+        self.kb_service = KBService(self.config)
+        self.generation_service = GenerationService(self.config)
+        # Rules find nothing for even IDs, which sends them to the LLM
+        rule_engine = self.generation_service.generator.rule_engine
+        generate = rule_engine.generate
+        self.rules = mock.patch.object(rule_engine, "generate", side_effect=lambda metadata, fallback=False: (
+            [] if metadata["id"] % 2 == 0 and not fallback else generate(metadata, fallback)
+        ))
+        self.rules.start()
+
+    def tearDown(self):
+        self.rules.stop()
+        app.state.kb_service = None
+        app.state.generation_service = None
+        self.kb_service.close()
+        self.tmp.cleanup()
+
+    def screenshots(self):
+        # As the /generate route reads them: the fingerprint needs the layout
+        return self.kb_service.iter_screenshots(include_layout=True)
+
+    def test_llm_calls_are_bounded(self):
+        lock = threading.Lock()
+        active, peak = [0], [0]
+
+        def fake_llm(metadata):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.05)
+            with lock:
+                active[0] -= 1
+            return f"Feature: {metadata['filename']}"
+
+        with mock.patch.object(self.generation_service.generator.llm_adapter, "generate", side_effect=fake_llm):
+            run = self.generation_service.generate_all(self.kb_service, self.screenshots())
+        self.assertEqual(peak[0], 2)
+        self.assertEqual(len(run["results"]), 10)
+        self.assertEqual(sorted(r["source"] for r in run["results"]), ["llm"] * 5 + ["rule"] * 5)
+        self.assertEqual(run["timing"]["generated"], 10)
+        self.assertGreater(run["timing"]["stages"]["llm_seconds"], 0.2)
+        stored = {row["id"]: row for row in self.kb_service.iter_screenshots()}
+        self.assertTrue(all(row["status"] == "generated" for row in stored.values()))
+        self.assertEqual(stored[2]["gherkin"], "Feature: 1.png")
+        self.assertIn("Scenario: User tap on Shutter", stored[1]["gherkin"])
+
+    def test_unchanged_rows_are_skipped(self):
+        def run(service=None, force=False, llm=lambda metadata: "Feature: LLM"):
+            service = service or self.generation_service
+            with mock.patch.object(service.generator.llm_adapter, "generate", side_effect=llm) as adapter:
+                timing = service.generate_all(self.kb_service, self.screenshots(), force=force)["timing"]
+            return timing["generated"], timing["skipped_unchanged"], adapter.call_count
+
+        self.assertEqual(run(), (10, 0, 5))
+        self.assertEqual(run(), (0, 10, 0))
+        # Review state only, with the version bump /feedback makes on rejection
+        self.kb_service.update_screenshot(3, {"status": "rejected", "comment": "Too vague", "version": 2})
+        self.kb_service.update_screenshot(4, {"feature_name": "Timer"})
+        self.assertEqual(run(), (1, 9, 1))
+        self.assertEqual(self.kb_service.get_screenshot_by_id(3)["status"], "rejected")
+        self.assertEqual(run(force=True), (10, 0, 5))
+
+        # A new prompt template invalidates every row (this service has the real rules, so no LLM calls)
+        config = copy.deepcopy(self.config)
+        config["generation"]["prompt_template"] += "\nBe brief."
+        self.assertEqual(run(service=GenerationService(config)), (10, 0, 0))
+
+    def test_changed_transitions_force_regeneration(self):
+        with mock.patch.object(self.generation_service.generator.llm_adapter, "generate", return_value="Feature: LLM"):
+            self.generation_service.generate_all(self.kb_service, self.screenshots())
+            # Only the layout changes: no version bump, no other column
+            transitions = [{"from_screen": "screen_home", "to_screen": "screen_timer", "action": "Tap"}]
+            with self.kb_service.pool.connection() as conn:
+                conn.execute("UPDATE screenshots SET transitions = ? WHERE id = 3", (json.dumps(transitions),))
+            timing = self.generation_service.generate_all(self.kb_service, self.screenshots())["timing"]
+        self.assertEqual((timing["generated"], timing["skipped_unchanged"]), (1, 9))
+        with self.assertRaises(ValueError):
+            self.generation_service.generator.fingerprint({"id": 3, "filename": "3.png", "screens": []})
+
+    def test_degraded_results_are_retried(self):
+        def failing(metadata):
+            raise RuntimeError("Ollama is down")
+        with mock.patch.object(self.generation_service.generator.llm_adapter, "generate", side_effect=failing):
+            self.generation_service.generate_all(self.kb_service, self.screenshots())
+        self.assertIsNone(self.kb_service.get_screenshot_by_id(2)["generation_fingerprint"])
+        self.assertIsNotNone(self.kb_service.get_screenshot_by_id(1)["generation_fingerprint"])
+        with mock.patch.object(self.generation_service.generator.llm_adapter, "generate", return_value="Feature: LLM"):
+            timing = self.generation_service.generate_all(self.kb_service, self.screenshots())["timing"]
+        self.assertEqual((timing["generated"], timing["skipped_unchanged"]), (5, 5))
+        self.assertEqual(self.kb_service.get_screenshot_by_id(2)["gherkin"], "Feature: LLM")
+
+    def test_generate_endpoint(self):
+        app.state.kb_service = self.kb_service
+        app.state.generation_service = self.generation_service
+        with mock.patch.object(self.generation_service.generator.llm_adapter, "generate",
+                               side_effect=RuntimeError("Ollama is down")) as adapter:
+            response = client.post("/api/v1/generate")
+        self.assertEqual(response.status_code, 200)
+        # The layout reaches the LLM prompt
+        self.assertEqual(adapter.call_args[0][0]["transitions"], [])
+        body = response.json()
+        self.assertEqual([r["id"] for r in body["results"]], [row["id"] for row in self.kb_service.iter_screenshots()])
+        self.assertEqual([r["source"] for r in body["results"]], ["fallback", "rule"] * 5)
+        self.assertIn("Scenario: User tap on Shutter", self.kb_service.get_screenshot_by_id(10)["gherkin"])
+        self.assertEqual(set(body["timing"]["stages"]), {"read_seconds", "write_seconds", "rule_seconds",
+                                                          "llm_wait_seconds", "llm_seconds", "fallback_seconds"})
+
+
+class TestLLMCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.config = copy.deepcopy(app.state.config)
+        self.config["generation"]["llm_cache"] = {"enabled": True, "path": str(Path(self.tmp.name) / "llm_cache.sqlite"),
+                                                  "max_size_mb": 1, "ttl_seconds": 3600}
+        self.metadata = {"id": 1, "filename": "1.png", "feature_name": "Camera", "status": "pending",
+                         "gestures": [{"type": "tap", "target": "Shutter"}]}
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def post(self, adapter, metadata):
+        response = mock.Mock()
+        response.json.return_value = {"response": "Feature: Camera\n"}
+        with mock.patch("src.generation.llm_adapter.requests.post", return_value=response) as post:
+            output = adapter.generate(metadata)
+        self.assertEqual(output, "Feature: Camera")
+        return post.call_count
+
+    def test_identical_prompts_hit_the_cache(self):
+        hits = LLM_CACHE_LOOKUPS.labels(result="hit")._value.get()
+        saved = LLM_CACHE_SAVED_SECONDS._value.get()
+        adapter = LLMAdapter(self.config)
+        self.assertEqual(self.post(adapter, self.metadata), 1)
+        # Same UI metadata on another screenshot, with review state that is not part of the prompt
+        self.assertEqual(self.post(adapter, dict(self.metadata, id=2, filename="2.png", status="rejected")), 0)
+        self.assertEqual(self.post(LLMAdapter(self.config), self.metadata), 0)  # Another worker, same file
+        self.assertEqual(self.post(adapter, dict(self.metadata, feature_name="Timer")), 1)
+        self.assertEqual(LLM_CACHE_LOOKUPS.labels(result="hit")._value.get() - hits, 2)
+        self.assertGreaterEqual(LLM_CACHE_SAVED_SECONDS._value.get(), saved)
+
+        config = copy.deepcopy(self.config)
+        config["generation"]["llm_temperature"] = 0.9
+        self.assertEqual(self.post(LLMAdapter(config), self.metadata), 1)
+
+    def test_empty_answers_are_not_cached(self):
+        adapter = LLMAdapter(self.config)
+        response = mock.Mock()
+        response.json.return_value = {"response": "  "}
+        with mock.patch("src.generation.llm_adapter.requests.post", return_value=response):
+            self.assertEqual(adapter.generate(self.metadata), "")
+        self.assertEqual(self.post(adapter, self.metadata), 1)
+
+
+class TestSQLitePool(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.pool = SQLitePool(Path(self.tmp.name) / "kb.sqlite", size=2)
+        with self.pool.connection() as conn:
+            conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, value TEXT)")
+
+    def tearDown(self):
+        self.pool.close()
+        self.tmp.cleanup()
+
+    def test_connections_are_reused_and_capped(self):
+        def insert(i):
+            with self.pool.connection() as conn:
+                conn.execute("INSERT INTO t (value) VALUES (?)", (str(i),))
+                return id(conn)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            connections = set(executor.map(insert, range(50)))
+        self.assertLessEqual(len(connections), 2)
+        with self.pool.connection() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM t").fetchone()[0], 50)
+            self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+
+    def test_failed_block_rolls_back(self):
+        with self.assertRaises(RuntimeError):
+            with self.pool.connection() as conn:
+                conn.execute("INSERT INTO t (value) VALUES ('lost')")
+                raise RuntimeError("boom")
+        with self.pool.connection() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM t").fetchone()[0], 0)
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -1,6 +1,26 @@
 import unittest
+import copy
+import io
+import json
+import sqlite3
+import tempfile
+import time
 from pathlib import Path
+from unittest import mock
+from PIL import Image, ImageDraw
 from src.ingestion.processor import ScreenshotIngestor
+from src.ingestion.kb_writer import KBWriter
+from src.ingestion.metadata_log import MetadataLog, iter_records
+from src.ingestion.vector_index import VectorIndex
+from src.ingestion.embedder import Embedder, EmbeddingBackfill, embedding_text
+import faiss
+import numpy as np
+from src.ingestion.layoutlm_analyzer import process_image
+from src.ingestion.response_cache import ResponseCache
+from src.ingestion.image_preprocessor import ImagePreprocessor, merge_layouts
+from src.ingestion.model_cascade import score_layout
+from src.ingestion.stream_validator import IncrementalJSONValidator, SchemaDivergence
+from src.ingestion.perceptual_hash import PerceptualHashIndex, hamming
 from src.generation.generator import GherkinGenerator
 import yaml
 
@@ -55,5 +75,783 @@ class TestIngestion(unittest.TestCase):
             # Clean up the temporary file
             test_screenshot.unlink()
 
+class TestIngestionPipeline(unittest.TestCase):
+    def setUp(self):
+        with open("config/settings.yaml", "r", encoding="utf-8") as f:
+            self.config = copy.deepcopy(yaml.safe_load(f))
+        self.tmp = tempfile.TemporaryDirectory()
+        tmp = Path(self.tmp.name)
+        input_folder = tmp / "input"
+        input_folder.mkdir()
+        for name in ["a.png", "b.png", "c.png", "d.png"]:
+            (input_folder / name).write_bytes(name.encode())
+        self.config["ingestion"]["input_folder"] = str(input_folder)
+        self.config["ingestion"]["batch_size"] = 3
+        self.config["kb"]["sqlite_db_path"] = str(tmp / "kb.sqlite")
+        self.config["kb"]["faiss_index_path"] = str(tmp / "faiss.index")
+        self.config["kb"]["metadata_json_path"] = str(tmp / "metadata.json")
+        self.config["kb"]["metadata_jsonl_path"] = str(tmp / "metadata.jsonl")
+        self.config["ingestion"]["vision_cache"]["path"] = str(tmp / "vision_cache.sqlite")
+        self.config["ingestion"]["cascade"]["enabled"] = False
+        self.config["ingestion"]["checkpoints"]["dir"] = str(tmp / "checkpoints")
+        self.config["ingestion"]["embedding"]["enabled"] = False
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_writes_stay_ordered(self):
+        # Earlier files finish inference last, writes must still follow folder order
+        delays = {"a.png": 0.2, "b.png": 0.1, "c.png": 0.0, "d.png": 0.05}
+
+        def fake_process_image(path, **kwargs):
+            time.sleep(delays[Path(path).name])
+            return {"screens": [], "transitions": []}
+
+        ingestor = ScreenshotIngestor(self.config)
+        written = []
+        with mock.patch("src.ingestion.processor.process_image", side_effect=fake_process_image), \
+                mock.patch.object(ingestor.kb_writer, "write_batch",
+                                  side_effect=lambda records: written.extend(m["filename"] for m in records)):
+            summary = ingestor.run()
+
+        self.assertEqual(written, ["a.png", "b.png", "c.png", "d.png"])
+        self.assertEqual(summary["succeeded"], 4)
+        self.assertEqual(summary["concurrency"], 3)
+        self.assertEqual([t["filename"] for t in summary["timings"]], written)
+
+    def test_inference_failure_is_reported(self):
+        def fake_process_image(path, **kwargs):
+            if Path(path).name == "b.png":
+                raise RuntimeError("ollama unavailable")
+            return {"screens": [], "transitions": []}
+
+        ingestor = ScreenshotIngestor(self.config)
+        with mock.patch("src.ingestion.processor.process_image", side_effect=fake_process_image), \
+                mock.patch.object(ingestor.kb_writer, "write_batch"):
+            summary = ingestor.run()
+
+        self.assertEqual(summary["failed"], 1)
+        failed = [t for t in summary["timings"] if t["status"] == "failed"]
+        self.assertEqual(failed[0]["filename"], "b.png")
+        self.assertIn("ollama unavailable", failed[0]["error"])
+
+    def test_invalid_layout_is_retried_and_not_recorded(self):
+        def fake_process_image(path, **kwargs):
+            if Path(path).name == "b.png":
+                return None  # Model answered with invalid JSON
+            return {"screens": [], "transitions": []}
+
+        with mock.patch("src.ingestion.processor.process_image", side_effect=fake_process_image) as analyze:
+            summary = ScreenshotIngestor(self.config).run()
+            self.assertEqual(analyze.call_count, 3 + self.config["ingestion"]["max_retries"])
+            failed = [t for t in summary["timings"] if t["status"] == "failed"]
+            self.assertEqual([t["filename"] for t in failed], ["b.png"])
+            self.assertIn("No valid layout", failed[0]["error"])
+            # Not in the manifest, so the next run tries it again
+            second = ScreenshotIngestor(self.config).run()
+        self.assertEqual(second["files"], 1)
+
+        conn = sqlite3.connect(self.config["kb"]["sqlite_db_path"])
+        filenames = [row[0] for row in conn.execute("SELECT filename FROM screenshots ORDER BY id")]
+        conn.close()
+        self.assertEqual(filenames, ["a.png", "c.png", "d.png"])
+
+    def test_run_persists_and_closes_the_kb(self):
+        self.config["kb"]["embedding_dim"] = 4
+        self.config["kb"]["faiss_persist"]["debounce_seconds"] = 3600  # Only close() can write the index
+        ingestor = ScreenshotIngestor(self.config)
+        ingestor.embedder.enabled = True
+        layout = {"screens": [{"id": "screen_home"}], "transitions": []}
+        with mock.patch("src.ingestion.processor.process_image", return_value=layout), \
+                mock.patch.object(ingestor.embedder, "embed",
+                                  side_effect=lambda records: np.ones((len(records), 4), dtype="float32")), \
+                mock.patch.object(ingestor.embedder, "embed_images",
+                                  side_effect=lambda records: [np.ones(4, dtype="float32")] * len(records)):
+            summary = ingestor.run()
+        self.assertEqual(summary["succeeded"], 4)
+        self.assertEqual(faiss.read_index(self.config["kb"]["faiss_index_path"]).ntotal, 4)
+        self.assertEqual(faiss.read_index(str(ingestor.kb_writer.image_index.index_path)).ntotal, 4)
+        self.assertEqual(len(list(iter_records(self.config["kb"]["metadata_jsonl_path"]))), 4)
+        self.assertIsNone(ingestor.kb_writer._conn)
+        with self.assertRaises(sqlite3.ProgrammingError):
+            ingestor.vision_cache.stats()
+
+    def test_incremental_skips_unchanged_and_updates_in_place(self):
+        layout = {"screens": [{"id": "screen_home", "text_content": ["Flash"]}], "transitions": []}
+        with mock.patch("src.ingestion.processor.process_image", return_value=layout) as analyze:
+            first = ScreenshotIngestor(self.config).run()
+            second = ScreenshotIngestor(self.config).run()
+            self.assertEqual(first["succeeded"], 4)
+            self.assertEqual(second["files"], 0)
+            self.assertEqual(second["skipped_unchanged"], 4)
+            self.assertEqual(analyze.call_count, 4)
+
+            modified = Path(self.config["ingestion"]["input_folder"]) / "b.png"
+            modified.write_bytes(b"re-exported flowchart")
+            third = ScreenshotIngestor(self.config).run()
+        self.assertEqual(third["files"], 1)
+
+        conn = sqlite3.connect(self.config["kb"]["sqlite_db_path"])
+        rows = conn.execute("SELECT filename, version FROM screenshots ORDER BY id").fetchall()
+        conn.close()
+        self.assertEqual(rows, [("a.png", 1), ("b.png", 2), ("c.png", 1), ("d.png", 1)])
+
+    def test_near_duplicates_skip_inference(self):
+        self.config["ingestion"]["near_duplicate"]["enabled"] = True
+        input_folder = Path(self.config["ingestion"]["input_folder"])
+        for f in input_folder.iterdir():
+            f.unlink()
+        flowchart = Image.new("RGB", (320, 240), "white")
+        ImageDraw.Draw(flowchart).rectangle([40, 40, 140, 200], fill="black")
+        flowchart.save(input_folder / "flash_v1.png")
+        flowchart.putpixel((300, 10), (250, 250, 250))  # cosmetic re-export
+        flowchart.save(input_folder / "flash_v2.png")
+        other = Image.new("RGB", (320, 240), "white")
+        ImageDraw.Draw(other).rectangle([180, 20, 300, 120], fill="black")
+        other.save(input_folder / "timer.png")
+
+        layout = {"screens": [{"id": "screen_home"}], "transitions": []}
+        with mock.patch("src.ingestion.processor.process_image", return_value=layout) as analyze:
+            summary = ScreenshotIngestor(self.config).run()
+        self.assertEqual(analyze.call_count, 2)
+        self.assertEqual(summary["skipped_inferences"], 1)
+
+        conn = sqlite3.connect(self.config["kb"]["sqlite_db_path"])
+        links = conn.execute("SELECT path, duplicate_of FROM image_hashes ORDER BY screenshot_id").fetchall()
+        conn.close()
+        self.assertEqual([link[1] for link in links], [None, 1, None])
+
+    def test_modified_file_is_not_matched_to_its_own_row(self):
+        self.config["ingestion"]["near_duplicate"]["enabled"] = True
+        input_folder = Path(self.config["ingestion"]["input_folder"])
+        for f in input_folder.iterdir():
+            f.unlink()
+        flowchart = Image.new("RGB", (320, 240), "white")
+        ImageDraw.Draw(flowchart).rectangle([40, 40, 140, 200], fill="black")
+        flowchart.save(input_folder / "flash.png")
+        layout = {"screens": [{"id": "screen_home"}], "transitions": []}
+        with mock.patch("src.ingestion.processor.process_image", return_value=layout) as analyze:
+            ScreenshotIngestor(self.config).run()
+            flowchart.putpixel((300, 10), (250, 250, 250))  # A small edit, well within the Hamming threshold
+            flowchart.save(input_folder / "flash.png")
+            summary = ScreenshotIngestor(self.config).run()
+        self.assertEqual(analyze.call_count, 2)
+        self.assertEqual(summary["skipped_inferences"], 0)
+
+    def test_hash_buckets_find_what_a_full_scan_finds(self):
+        self.config["ingestion"]["near_duplicate"]["enabled"] = True
+        index = PerceptualHashIndex(self.config)
+        rng = np.random.default_rng(0)
+        hashes = [int(v) for v in rng.integers(0, 2 ** 63, size=200, dtype=np.int64)]
+        for screenshot_id, value in enumerate(hashes, 1):
+            index.add(screenshot_id, Path(f"{screenshot_id}.png"), value)
+        for value in hashes[:20]:
+            query = value ^ (1 << 3) ^ (1 << 40)  # Two bits away from an indexed hash
+            expected = min(((i, hamming(query, h)) for i, h in enumerate(hashes, 1)), key=lambda hit: hit[1])
+            self.assertEqual(index.find(query), expected)
+        self.assertIsNone(index.find(hashes[0], exclude=1))
+
+    def test_write_retry_resumes_after_inference(self):
+        layout = {"screens": [{"id": "screen_home"}], "transitions": []}
+        ingestor = ScreenshotIngestor(self.config)
+        real_write = ingestor.kb_writer.write_batch
+        failures = {"c.png": 1}
+
+        def flaky_write(records):
+            for metadata in records:
+                if failures.get(metadata["filename"]):
+                    failures[metadata["filename"]] -= 1
+                    raise sqlite3.OperationalError("database is locked")
+            real_write(records)
+
+        with mock.patch("src.ingestion.processor.process_image", return_value=layout) as analyze, \
+                mock.patch.object(ingestor.kb_writer, "write_batch", side_effect=flaky_write):
+            summary = ingestor.run()
+        self.assertEqual(summary["succeeded"], 4)
+        self.assertEqual(analyze.call_count, 4)
+        self.assertEqual(list(Path(self.config["ingestion"]["checkpoints"]["dir"]).iterdir()), [])
+
+    def test_failing_batch_falls_back_to_single_writes(self):
+        self.config["ingestion"]["write_batch_size"] = 4
+        self.config["ingestion"]["max_retries"] = 1
+        layout = {"screens": [{"id": "screen_home"}], "transitions": []}
+        ingestor = ScreenshotIngestor(self.config)
+        real_write = ingestor.kb_writer.write_batch
+        batches = []
+
+        def write_batch(records):
+            batches.append([m["filename"] for m in records])
+            if any(m["filename"] == "b.png" for m in records):
+                raise sqlite3.IntegrityError("bad record")
+            real_write(records)
+
+        with mock.patch("src.ingestion.processor.process_image", return_value=layout), \
+                mock.patch.object(ingestor.kb_writer, "write_batch", side_effect=write_batch):
+            summary = ingestor.run()
+        self.assertEqual(batches[0], ["a.png", "b.png", "c.png", "d.png"])
+        self.assertEqual(summary["succeeded"], 3)
+        self.assertEqual([t["status"] for t in summary["timings"]], ["ok", "failed", "ok", "ok"])
+
+    def test_embeddings_are_written_with_each_batch(self):
+        self.config["ingestion"]["embedding"]["enabled"] = True
+        layout = {"screens": [{"id": "screen_home", "text_content": ["Flash"]}], "transitions": []}
+        ingestor = ScreenshotIngestor(self.config)
+        with mock.patch("src.ingestion.processor.process_image", return_value=layout), \
+                mock.patch.object(Embedder, "encode_texts", side_effect=fake_encode), \
+                mock.patch.object(Embedder, "encode_images", side_effect=fake_encode):
+            summary = ingestor.run()
+        self.assertEqual(summary["embedding"]["rows"], 4)
+        self.assertEqual(ingestor.kb_writer.vector_index.ntotal, 4)
+
+    def test_interrupted_run_resumes_from_layout_checkpoint(self):
+        layout = {"screens": [{"id": "screen_home"}], "transitions": []}
+        ingestor = ScreenshotIngestor(self.config)
+        with mock.patch("src.ingestion.processor.process_image", return_value=layout), \
+                mock.patch.object(ingestor.kb_writer, "write_batch", side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                ingestor.run()
+
+        with mock.patch("src.ingestion.processor.process_image", return_value=layout) as analyze:
+            summary = ScreenshotIngestor(self.config).run()
+        self.assertEqual(summary["succeeded"], 4)
+        self.assertEqual(analyze.call_count, 0)
+        self.assertEqual(summary["timings"][0]["resumed_from"], "layout")
+
+    def test_cascade_escalates_low_confidence(self):
+        self.config["ingestion"]["cascade"] = {"enabled": True, "models": ["small", "large"], "escalate_below": 0.75}
+        good = {
+            "screens": [
+                {"id": "screen_home", "description": "Camera", "text_content": ["Flash"]},
+                {"id": "screen_flash", "description": "Flash menu", "text_content": ["Auto"]},
+            ],
+            "transitions": [{"from_screen": "screen_home", "to_screen": "screen_flash",
+                             "trigger_element": "Flash icon", "action": "Tap"}],
+        }
+        poor = {"screens": [{"id": "screen_home"}, {"id": "screen_x"}], "transitions": []}
+
+        def fake_process_image(path, model=None, **kwargs):
+            if model == "small" and Path(path).name in ("b.png", "d.png"):
+                return poor
+            return good
+
+        with mock.patch("src.ingestion.processor.process_image", side_effect=fake_process_image):
+            summary = ScreenshotIngestor(self.config).run()
+        models = summary["cascade"]["models"]
+        self.assertEqual(models["small"]["calls"], 4)
+        self.assertEqual(models["small"]["accepted"], 2)
+        self.assertEqual(models["large"]["calls"], 2)
+        self.assertEqual(summary["cascade"]["escalations"], 2)
+        self.assertEqual([t["model"] for t in summary["timings"]], ["small", "large", "small", "large"])
+        self.assertLess(score_layout(poor), 0.75)
+        self.assertGreaterEqual(score_layout(good), 0.75)
+
+class TestKBWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        tmp = Path(self.tmp.name)
+        self.config = {"kb": {
+            "sqlite_db_path": str(tmp / "kb.sqlite"),
+            "faiss_index_path": str(tmp / "faiss.index"),
+            "metadata_json_path": str(tmp / "metadata.json"),
+            "metadata_jsonl_path": str(tmp / "metadata.jsonl"),
+        }}
+        self.writer = KBWriter(self.config)
+
+    def tearDown(self):
+        self.writer.close()
+        self.tmp.cleanup()
+
+    @staticmethod
+    def _record(name, **extra):
+        return dict({"filename": name, "feature_name": "Camera", "screens": [], "transitions": [],
+                     "image_path": name}, **extra)
+
+    def test_write_batch_assigns_ids_and_bumps_versions(self):
+        records = [self._record(f"{i}.png") for i in range(3)]
+        self.writer.write_batch(records)
+        self.assertEqual([m["id"] for m in records], [1, 2, 3])
+
+        update = self._record("1b.png", id=2)
+        self.writer.write_batch([update, self._record("4.png")])
+        self.assertEqual((update["id"], update["version"]), (2, 2))
+
+        conn = sqlite3.connect(self.config["kb"]["sqlite_db_path"])
+        rows = conn.execute("SELECT id, filename, version FROM screenshots ORDER BY id").fetchall()
+        conn.close()
+        self.assertEqual(rows, [(1, "0.png", 1), (2, "1b.png", 2), (3, "2.png", 1), (4, "4.png", 1)])
+
+    def test_layout_change_resets_review_state(self):
+        records = [self._record(f"{i}.png", screens=[{"id": "home"}]) for i in range(2)]
+        self.writer.write_batch(records)
+        conn = sqlite3.connect(self.config["kb"]["sqlite_db_path"])
+        conn.execute("UPDATE screenshots SET status = 'rejected', gherkin = 'Feature: Camera', "
+                     "rejection_reason = 'wrong', comment = 'old'")
+        conn.commit()
+
+        self.writer.write_batch([
+            self._record("0.png", id=1, screens=[{"id": "home"}]),
+            self._record("1.png", id=2, screens=[{"id": "settings"}]),
+        ])
+        rows = conn.execute(
+            "SELECT id, status, gherkin, rejection_reason, comment FROM screenshots ORDER BY id"
+        ).fetchall()
+        conn.close()
+        self.assertEqual(rows, [(1, "rejected", "Feature: Camera", "wrong", "old"),
+                                (2, "pending", None, None, None)])
+
+    def test_failed_batch_rolls_back(self):
+        records = [self._record("a.png"), self._record("b.png", screens=object())]
+        with self.assertRaises(TypeError):
+            self.writer.write_batch(records)
+        self.assertNotIn("id", records[0])
+        conn = sqlite3.connect(self.config["kb"]["sqlite_db_path"])
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM screenshots").fetchone()[0], 0)
+        conn.close()
+
+class TestVectorIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        tmp = Path(self.tmp.name)
+        self.config = {"kb": {
+            "sqlite_db_path": str(tmp / "kb.sqlite"),
+            "faiss_index_path": str(tmp / "faiss.index"),
+            "metadata_json_path": str(tmp / "metadata.json"),
+            "metadata_jsonl_path": str(tmp / "metadata.jsonl"),
+            "embedding_dim": 8,
+            "faiss_persist": {"debounce_seconds": 60, "max_pending": 1000},
+        }}
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    @staticmethod
+    def _vector(seed):
+        vector = np.random.default_rng(seed).random(8).astype("float32")
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def _record(self, name, seed, **extra):
+        return dict({"filename": name, "feature_name": "Camera", "screens": [], "transitions": [],
+                     "image_path": name, "embedding": self._vector(seed)}, **extra)
+
+    def test_vector_ids_follow_sqlite_ids_across_restarts(self):
+        writer = KBWriter(self.config)
+        records = [self._record(f"{i}.png", i) for i in range(3)]
+        writer.write_batch(records)
+        writer.write_batch([self._record("1b.png", 10, id=records[1]["id"])])
+        writer.delete([records[0]["id"]])
+        writer.close()
+
+        index = VectorIndex(self.config)
+        self.assertEqual(index.ntotal, 2)
+        _, ids = index.search(np.array([self._vector(10)], dtype="float32"), 1)
+        self.assertEqual(ids[0][0], records[1]["id"])
+
+    def test_changes_are_persisted_once_per_debounce_window(self):
+        writer = KBWriter(self.config)
+        writer.write_batch([self._record("a.png", 1)])
+        self.assertFalse(Path(self.config["kb"]["faiss_index_path"]).exists())
+        writer.vector_index.flush()
+        self.assertEqual(faiss.read_index(self.config["kb"]["faiss_index_path"]).ntotal, 1)
+        writer.close()
+
+    def test_legacy_or_stale_index_is_rebuilt_from_sqlite(self):
+        writer = KBWriter(self.config)
+        writer.write_batch([self._record("a.png", 1), self._record("b.png", 2)])
+        writer.close()
+        faiss.write_index(faiss.IndexFlatIP(8), self.config["kb"]["faiss_index_path"])
+
+        index = VectorIndex(self.config)
+        self.assertIsInstance(index.index, faiss.IndexIDMap2)
+        self.assertEqual(sorted(faiss.vector_to_array(index.index.id_map).tolist()), [1, 2])
+
+    def test_read_only_index_rebuilds_in_memory_only(self):
+        writer = KBWriter(self.config)
+        writer.write_batch([self._record("a.png", 1), self._record("b.png", 2)])
+        writer.close()
+        index_path = Path(self.config["kb"]["faiss_index_path"])
+        faiss.write_index(faiss.IndexFlatIP(8), str(index_path))
+        mtime = index_path.stat().st_mtime_ns
+
+        index = VectorIndex(self.config, read_only=True)
+        self.assertEqual(index.ntotal, 2)
+        index.close()
+        self.assertEqual(index_path.stat().st_mtime_ns, mtime)
+        self.assertNotIsInstance(faiss.read_index(str(index_path)), faiss.IndexIDMap2)
+
+    def test_hnsw_hides_removed_vectors_until_rebuild(self):
+        self.config["kb"]["faiss_index_type"] = "HNSW"
+        writer = KBWriter(self.config)
+        records = [self._record(f"{i}.png", i) for i in range(4)]
+        writer.write_batch(records)
+        self.assertEqual(writer.vector_index.kind, "HNSW")
+        writer.delete([records[0]["id"]])
+        _, ids = writer.vector_index.search(np.array([self._vector(0)], dtype="float32"), 4)
+        self.assertNotIn(records[0]["id"], ids[0].tolist())
+        writer.close()
+
+        index = VectorIndex(self.config)
+        self.assertEqual((index.kind, index.ntotal), ("HNSW", 3))
+
+    def test_hnsw_replaces_in_place_and_compacts_past_the_ratio(self):
+        self.config["kb"]["faiss_index_type"] = "HNSW"
+        self.config["kb"]["faiss_params"] = {"hnsw_compact_ratio": 0.5}
+        writer = KBWriter(self.config)
+        records = [self._record(f"{i}.png", i) for i in range(10)]
+        writer.write_batch(records)
+        index = writer.vector_index
+        with mock.patch.object(index, "rebuild", wraps=index.rebuild) as rebuild:
+            # Row 1 now looks like row 9; the old vector is hidden, the new one is searchable at once
+            writer.write_batch([dict(records[1], embedding=self._vector(9))])
+            writer.delete([records[2]["id"]])
+            index.flush()
+            self.assertEqual(rebuild.call_count, 0)
+            self.assertEqual(index.ntotal, 9)
+            _, ids = index.search(np.array([self._vector(9)], dtype="float32"), 3)
+            self.assertEqual(sorted(ids[0][:2].tolist()), [records[1]["id"], records[9]["id"]])
+            _, ids = index.search(np.array([self._vector(1), self._vector(2)], dtype="float32"), 9)
+            self.assertTrue(set(ids.flatten().tolist()).isdisjoint({records[2]["id"], -1}))
+
+            # The persisted graph keeps its stale copies and still loads without a rebuild
+            reloaded = VectorIndex(self.config)
+            self.assertEqual((reloaded.kind, reloaded.ntotal, reloaded.index.ntotal), ("HNSW", 9, 11))
+
+            writer.delete([records[i]["id"] for i in range(3, 7)])  # 6 of 11 positions stale
+            index.flush()
+            self.assertEqual(rebuild.call_count, 1)
+            self.assertEqual((index.ntotal, index.index.ntotal), (5, 5))
+            self.assertFalse(index.compact())
+        writer.close()
+
+    def test_ivf_trains_once_enough_vectors_exist(self):
+        self.config["kb"]["faiss_index_type"] = "IVFFlat"
+        self.config["kb"]["faiss_params"] = {"nlist": 2, "train_points_per_list": 5}
+        writer = KBWriter(self.config)
+        writer.write_batch([self._record(f"{i}.png", i) for i in range(6)])
+        self.assertEqual(writer.vector_index.kind, "FlatIP")
+        writer.write_batch([self._record(f"{i}.png", i) for i in range(6, 12)])
+        writer.vector_index.flush()
+        self.assertEqual((writer.vector_index.kind, writer.vector_index.ntotal), ("IVFFlat", 12))
+        writer.close()
+
+def fake_encode(items):
+    # Deterministic stand-in for the CPU encoders
+    vectors = np.array([np.random.default_rng(abs(hash(str(i))) % 2**32).random(768) for i in items], dtype="float32")
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+class TestEmbedding(unittest.TestCase):
+    def setUp(self):
+        with open("config/settings.yaml", "r", encoding="utf-8") as f:
+            self.config = copy.deepcopy(yaml.safe_load(f))
+        self.tmp = tempfile.TemporaryDirectory()
+        tmp = Path(self.tmp.name)
+        for key, name in (("sqlite_db_path", "kb.sqlite"), ("faiss_index_path", "faiss.index"),
+                          ("metadata_json_path", "metadata.json"), ("metadata_jsonl_path", "metadata.jsonl")):
+            self.config["kb"][key] = str(tmp / name)
+        self.config["ingestion"]["embedding"]["batch_size"] = 2
+        self.patches = [
+            mock.patch.object(Embedder, "encode_texts", side_effect=fake_encode),
+            mock.patch.object(Embedder, "encode_images", side_effect=fake_encode),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.tmp.cleanup()
+
+    def test_embedding_text_covers_screens_annotations_and_transitions(self):
+        text = embedding_text({
+            "feature_name": "Flash",
+            "screens": [{"id": "home", "description": "Camera", "text_content": ["Auto"],
+                         "annotations": [{"number": 1, "explanation": "Tap flash icon"}]}],
+            "transitions": [{"from_screen": "home", "to_screen": "menu", "trigger_element": "flash", "action": "tap"}],
+        })
+        for expected in ("Flash", "home: Camera", "Auto", "(1) Tap flash icon", "home -> menu via flash (tap)"):
+            self.assertIn(expected, text)
+
+    def test_embed_returns_normalized_768d_vectors(self):
+        records = [{"feature_name": f"f{i}", "image_path": f"{i}.png"} for i in range(3)]
+        vectors = Embedder(self.config).embed(records)
+        self.assertEqual(vectors.shape, (3, 768))
+        np.testing.assert_allclose(np.linalg.norm(vectors, axis=1), 1.0, rtol=1e-5)
+
+    def test_text_and_image_vectors_are_stored_apart(self):
+        writer = KBWriter(self.config)
+        record = {"filename": "0.png", "feature_name": "Flash", "screens": [], "transitions": [], "image_path": "0.png"}
+        writer.write_batch([record])
+        stats = EmbeddingBackfill(self.config, writer).run()
+        self.assertEqual((stats["processed"], stats["remaining"]), (1, 0))
+        conn = sqlite3.connect(self.config["kb"]["sqlite_db_path"])
+        text, image = conn.execute("SELECT embedding, image_embedding FROM screenshots").fetchone()
+        conn.close()
+        np.testing.assert_allclose(np.frombuffer(text, dtype="float32"), fake_encode([embedding_text(record)])[0],
+                                   rtol=1e-6)
+        np.testing.assert_allclose(np.frombuffer(image, dtype="float32"), fake_encode(["0.png"])[0], rtol=1e-6)
+        self.assertEqual((writer.vector_index.ntotal, writer.image_index.ntotal), (1, 1))
+        writer.close()
+
+    def test_backfill_resumes_with_remaining_rows(self):
+        writer = KBWriter(self.config)
+        writer.write_batch([{"filename": f"{i}.png", "feature_name": "Camera", "screens": [], "transitions": [],
+                             "image_path": f"{i}.png"} for i in range(5)])
+        backfill = EmbeddingBackfill(self.config, writer)
+        real_embed = backfill.embedder.embed
+
+        def embed_then_stop(records):
+            backfill.stop(wait=False)  # Simulate the job being stopped after one batch
+            return real_embed(records)
+
+        with mock.patch.object(backfill.embedder, "embed", side_effect=embed_then_stop):
+            stats = backfill.run()
+        self.assertEqual((stats["processed"], stats["remaining"]), (2, 3))
+
+        stats = EmbeddingBackfill(self.config, writer).run()
+        self.assertEqual((stats["processed"], stats["remaining"]), (3, 0))
+        self.assertEqual(writer.vector_index.ntotal, 5)
+        writer.close()
+
+    def test_backfill_embeds_the_text_of_migrated_rows(self):
+        # A pre-v2 row: its OCR text column moves into screenshot_texts when the KB is migrated
+        conn = sqlite3.connect(self.config["kb"]["sqlite_db_path"])
+        conn.execute(
+            "CREATE TABLE screenshots (id INTEGER PRIMARY KEY AUTOINCREMENT, filename TEXT NOT NULL, "
+            "feature_name TEXT, gesture TEXT, conditions TEXT, errors TEXT, languages TEXT, text TEXT, "
+            "image_path TEXT, version INTEGER DEFAULT 1, status TEXT DEFAULT 'pending', "
+            "created_at DATETIME DEFAULT CURRENT_TIMESTAMP)"
+        )
+        conn.execute(
+            "INSERT INTO screenshots (filename, feature_name, gesture, conditions, errors, languages, text, image_path) "
+            "VALUES ('a.png', 'Flash', '[]', '[]', '[]', '[]', ?, 'a.png')",
+            ('[{"text": "Flash auto mode", "lang": "en"}]',)
+        )
+        conn.commit()
+        conn.close()
+
+        writer = KBWriter(self.config)
+        stats = EmbeddingBackfill(self.config, writer).run()
+        writer.close()
+        self.assertEqual((stats["processed"], stats["remaining"]), (1, 0))
+        conn = sqlite3.connect(self.config["kb"]["sqlite_db_path"])
+        embedding = conn.execute("SELECT embedding FROM screenshots").fetchone()[0]
+        conn.close()
+        expected = embedding_text({"feature_name": "Flash", "text": [{"text": "Flash auto mode", "lang": "en"}]})
+        self.assertIn("Flash auto mode", expected)
+        np.testing.assert_allclose(np.frombuffer(embedding, dtype="float32"), fake_encode([expected])[0], rtol=1e-6)
+
+class TestMetadataLog(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        tmp = Path(self.tmp.name)
+        self.config = {"kb": {
+            "metadata_json_path": str(tmp / "metadata.json"),
+            "metadata_jsonl_path": str(tmp / "metadata.jsonl"),
+            "metadata_log": {"fsync_every": 2, "compact_ratio": 2.0, "compact_min_lines": 6},
+        }}
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_migrates_legacy_json_array(self):
+        legacy = [{"id": 1, "filename": "a.png"}, {"id": 2, "filename": "b.png"}]
+        Path(self.config["kb"]["metadata_json_path"]).write_text(json.dumps(legacy), encoding="utf-8")
+        log = MetadataLog(self.config)
+        self.assertEqual(list(log.records()), legacy)
+        log.close()
+
+    def test_latest_entry_wins_and_tombstones_hide_records(self):
+        log = MetadataLog(self.config)
+        log.append([{"id": 1, "version": 1}, {"id": 2, "version": 1}])
+        log.append([{"id": 1, "version": 2}])
+        log.delete([2])
+        self.assertEqual(list(log.records()), [{"id": 1, "version": 2}])
+        log.close()
+
+    def test_compacts_superseded_lines(self):
+        log = MetadataLog(self.config)
+        for version in range(1, 7):
+            log.append([{"id": 1, "version": version}])
+        log.close()
+        lines = Path(self.config["kb"]["metadata_jsonl_path"]).read_text(encoding="utf-8").splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [{"id": 1, "version": 6}])
+
+    def test_torn_last_line_is_skipped(self):
+        path = Path(self.config["kb"]["metadata_jsonl_path"])
+        path.write_text('{"id": 1}\n{"id": 2, "filen', encoding="utf-8")
+        self.assertEqual(list(iter_records(path)), [{"id": 1}])
+        log = MetadataLog(self.config)
+        log.append([{"id": 3}])
+        self.assertEqual(list(log.records()), [{"id": 1}, {"id": 3}])
+        log.close()
+
+class TestVisionCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.image_path = Path(self.tmp.name) / "flash.png"
+        self.image_path.write_bytes(b"fake image bytes")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_hit_skips_ollama(self):
+        cache = ResponseCache(str(Path(self.tmp.name) / "cache.sqlite"))
+        response = {"message": {"content": '{"screens": [{"id": "screen_home"}], "transitions": []}'}}
+        with mock.patch("src.ingestion.layoutlm_analyzer.ollama.chat", return_value=response) as chat:
+            first = process_image(str(self.image_path), cache=cache)
+            second = process_image(str(self.image_path), cache=cache)
+        self.assertEqual(chat.call_count, 1)
+        self.assertEqual(first, second)
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+        cache.close()
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(str(Path(self.tmp.name) / "cache.sqlite"), max_size_mb=0.00015)  # room for two entries
+        cache.put("a", {"value": "x" * 40})
+        cache.put("b", {"value": "y" * 40})
+        cache.get("a")  # "b" is now least recently used
+        time.sleep(0.01)
+        cache.put("c", {"value": "z" * 40})
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertGreaterEqual(cache.stats()["evictions"], 1)
+        cache.close()
+
+    def test_ttl_expiry(self):
+        cache = ResponseCache(str(Path(self.tmp.name) / "cache.sqlite"), ttl_seconds=60)
+        cache.put("a", {"value": "x"})
+        self.assertEqual(cache.get("a"), {"value": "x"})
+        with mock.patch("src.ingestion.response_cache.time.time", return_value=time.time() + 120):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["entries"], 0)
+        cache.close()
+
+    def test_shared_between_connections(self):
+        path = str(Path(self.tmp.name) / "cache.sqlite")
+        first, second = ResponseCache(path), ResponseCache(path)  # As two worker processes would open it
+        first.put("a", {"value": "x"})
+        self.assertEqual(second.get("a"), {"value": "x"})
+        first.close()
+        second.close()
+
+class TestStreamingValidation(unittest.TestCase):
+    VALID = '{"screens": [{"id": "screen_home", "text_content": ["Flash {On}"], "annotations": []}], ' \
+            '"transitions": [{"from_screen": "screen_home", "to_screen": "screen_flash", "action": "Tap"}]}'
+
+    def _feed(self, text, size=7):
+        validator = IncrementalJSONValidator()
+        for i in range(0, len(text), size):
+            validator.feed(text[i:i + size])
+        return validator
+
+    def test_valid_document(self):
+        validator = self._feed(self.VALID)
+        self.assertTrue(validator.complete)
+        self.assertEqual(validator.keys_seen, ["screens", "transitions"])
+
+    def test_diverging_documents_abort(self):
+        for bad in ['Sure! Here is the JSON', '{"ui_elements": []}', '{"screens": "none"}',
+                    '{"screens": ["screen_home"]}', '{"screens": []} trailing']:
+            with self.assertRaises(SchemaDivergence, msg=bad):
+                self._feed(bad)
+
+    def test_stream_aborts_early(self):
+        consumed = []
+
+        def chunks():
+            for piece in ['{"scr', 'eens": [', '{"id": "a"}', '], "ui_tree": ', '{}', '}'] + ['x'] * 100:
+                consumed.append(piece)
+                yield {"message": {"content": piece}, "done": False}
+
+        with tempfile.NamedTemporaryFile(suffix=".png") as image:
+            with mock.patch("src.ingestion.layoutlm_analyzer.ollama.chat", return_value=chunks()):
+                with self.assertRaises(SchemaDivergence):
+                    process_image(image.name, stream=True)
+        self.assertLess(len(consumed), 10)
+
+    def test_stream_reports_timing(self):
+        pieces = [self.VALID[i:i + 5] for i in range(0, len(self.VALID), 5)]
+        stream = [{"message": {"content": p}, "done": False} for p in pieces]
+        stream.append({"message": {"content": ""}, "done": True, "eval_count": 40, "eval_duration": 2_000_000_000})
+        stats = {}
+        with tempfile.NamedTemporaryFile(suffix=".png") as image:
+            with mock.patch("src.ingestion.layoutlm_analyzer.ollama.chat", return_value=iter(stream)):
+                result = process_image(image.name, stream=True, stats=stats)
+        self.assertEqual(result["screens"][0]["id"], "screen_home")
+        self.assertIsNotNone(stats["time_to_first_token"])
+        self.assertIsNotNone(stats["tokens_per_second"])
+
+class TestImagePreprocessing(unittest.TestCase):
+    def setUp(self):
+        with open("config/settings.yaml", "r", encoding="utf-8") as f:
+            self.config = copy.deepcopy(yaml.safe_load(f))
+        self.config["ingestion"]["preprocessing"] = {
+            "enabled": True,
+            "max_side": 1000,
+            "tiling": {"enabled": True, "min_side": 3000, "tile_size": 1000, "overlap": 100, "max_tiles": 4},
+        }
+
+    def _png(self, width, height):
+        buffer = io.BytesIO()
+        Image.new("RGB", (width, height), "white").save(buffer, format="PNG")
+        return buffer.getvalue()
+
+    def test_downscales_to_max_side(self):
+        images = ImagePreprocessor(self.config).prepare(self._png(2000, 1000))
+        self.assertEqual(len(images), 1)
+        self.assertEqual(Image.open(io.BytesIO(images[0])).size, (1000, 500))
+
+    def test_tiles_respect_max_tiles(self):
+        tiles = ImagePreprocessor(self.config).prepare(self._png(6000, 1500))
+        self.assertLessEqual(len(tiles), 4)
+        self.assertGreater(len(tiles), 1)
+        for tile in tiles:
+            self.assertLessEqual(max(Image.open(io.BytesIO(tile)).size), 1000)
+
+    def test_merge_deduplicates_screen_ids(self):
+        left = {
+            "screens": [{"id": "screen_home", "text_content": ["Flash"]}, {"id": "screen_1", "text_content": ["Timer"]}],
+            "transitions": [{"from_screen": "screen_home", "to_screen": "screen_1", "trigger_element": "Timer", "action": "Tap"}],
+        }
+        right = {
+            "screens": [{"id": "screen_home", "text_content": ["Flash", "Auto"]}, {"id": "screen_1", "text_content": ["Ratio"]}],
+            "transitions": [
+                {"from_screen": "screen_home", "to_screen": "screen_1", "trigger_element": "Timer", "action": "Tap"},
+                {"from_screen": "screen_home", "to_screen": "screen_1", "trigger_element": "Ratio", "action": "Tap"},
+            ],
+        }
+        merged = merge_layouts([left, right])
+        ids = [screen["id"] for screen in merged["screens"]]
+        self.assertEqual(ids, ["screen_home", "screen_1", "screen_1_t2"])
+        self.assertEqual(merged["screens"][0]["text_content"], ["Flash", "Auto"])
+        self.assertEqual(len(merged["transitions"]), 3)
+        self.assertEqual(merged["transitions"][2]["to_screen"], "screen_1_t2")
+
+    def test_merge_renames_each_colliding_screen_of_a_tile(self):
+        left = {"screens": [{"id": "screen_1", "text_content": ["Timer"]}], "transitions": []}
+        right = {"screens": [{"id": "screen_1", "text_content": ["Ratio"]}, {"id": "screen_1", "text_content": ["Grid"]}],
+                 "transitions": []}
+        merged = merge_layouts([left, right])
+        self.assertEqual([screen["id"] for screen in merged["screens"]], ["screen_1", "screen_1_t2", "screen_1_t2_2"])
+        self.assertEqual(merged["screens"][2]["text_content"], ["Grid"])
+
+    def test_overlap_must_be_smaller_than_tiles(self):
+        self.config["ingestion"]["preprocessing"]["tiling"]["overlap"] = 1000
+        with self.assertRaises(ValueError):
+            ImagePreprocessor(self.config)
+
+    def test_failed_tile_fails_the_image(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            image_path = Path(tmp) / "wide.png"
+            image_path.write_bytes(self._png(6000, 1500))
+            cache = ResponseCache(str(Path(tmp) / "cache.sqlite"))
+            answers = iter(['{"screens": [{"id": "screen_home"}], "transitions": []}', "not json"] * 4)
+            with mock.patch("src.ingestion.layoutlm_analyzer.ollama.chat",
+                            side_effect=lambda **kwargs: {"message": {"content": next(answers)}}):
+                result = process_image(str(image_path), cache=cache, preprocessor=ImagePreprocessor(self.config))
+            self.assertIsNone(result)
+            self.assertEqual(cache.stats()["entries"], 0)  # Not cached, so the next attempt asks again
+            cache.close()
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file